@@ -2,11 +2,17 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, Body, Response
+import json
+from typing import List
+
+from pydantic import BaseModel
+
+from fastapi import FastAPI, Body, Response, Query
+from fastapi.responses import StreamingResponse
 
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 
-from repository import add_token, scan_tokens, get_token, seed_tokens
+from repository import add_token, add_tokens, get_tokens, iter_tokens, get_token, seed_tokens
 from instrumentation import setup_tracing
 
 setup_tracing()
@@ -42,9 +48,46 @@ def add_token_route(
     return {"token": token}
 
 
+class Token(BaseModel):
+    username: str
+    token: str
+
+
+@app.post("/tokens/bulk")
+def add_tokens_route(tokens: List[Token]):
+    return add_tokens([t.model_dump() for t in tokens])
+
+
 @app.get("/tokens")
-def get_tokens_route():
-    return scan_tokens()
+def get_tokens_route(
+    page_size: int = Query(default=50, ge=1, le=1000),
+    last_token: str = Query(default=None),
+):
+    res = get_tokens(page_size, last_token)
+
+    if not res["has_more"]:
+        return {"result": res["items"]}
+
+    return {
+        "pagination": {
+            "last_token": res["last_token"],
+            "has_more": res["has_more"],
+        },
+        "result": res["items"],
+    }
+
+
+def stream_tokens():
+    # a json array written one token at a time, so the whole table is never in memory
+    yield "["
+    for i, token in enumerate(iter_tokens()):
+        yield ("," if i else "") + json.dumps(token)
+    yield "]"
+
+
+@app.get("/tokens/all")
+def get_all_tokens_route():
+    return StreamingResponse(stream_tokens(), media_type="application/json")
 
 
 @app.post("/seed")
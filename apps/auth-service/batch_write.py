@@ -0,0 +1,104 @@
+# shared by auth-service and files-service, the copies must be the same
+# (every app is built from its folder), `make check-shared` compares them
+import time
+import random
+from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+from opentelemetry import trace, context as otel_context
+
+from clients import get_client
+from config import (
+    BATCH_WRITE_CONCURRENCY, BATCH_WRITE_MAX_ATTEMPTS, BATCH_WRITE_BASE_DELAY,
+    BATCH_WRITE_MAX_DELAY,
+)
+
+# max number of items of a BatchWriteItem request
+BATCH_SIZE = 25
+# errors of a request that are retried with backoff like the unprocessed items
+THROTTLING_ERRORS = {
+    "ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded",
+}
+
+tracer = trace.get_tracer(__name__)
+
+# shared by every call, so BATCH_WRITE_CONCURRENCY is the max of requests in
+# flight of the whole process and the threads are reused
+_pool = ThreadPoolExecutor(max_workers=BATCH_WRITE_CONCURRENCY, thread_name_prefix="batch-write")
+
+
+def _write_chunk(ctx, table_name: str, items: List[dict]) -> List[dict]:
+    """ Writes up to 25 items, returns the ones that couldn't be written """
+    token = otel_context.attach(ctx)
+    try:
+        db = get_client('dynamodb')
+        requests = {table_name: [{"PutRequest": {"Item": item}} for item in items]}
+
+        for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+            if attempt > 0:
+                # exponential backoff with full jitter, the table is throttling us
+                delay = min(BATCH_WRITE_MAX_DELAY, BATCH_WRITE_BASE_DELAY * 2 ** attempt)
+                time.sleep(random.uniform(0, delay))
+
+            try:
+                res = db.batch_write_item(RequestItems=requests)
+            except ClientError as e:
+                if e.response["Error"]["Code"] in THROTTLING_ERRORS:
+                    continue
+                # e.g. an invalid item, the other chunks are still written
+                print("failed to write batch:", e)
+                trace.get_current_span().record_exception(e)
+                break
+            except BotoCoreError as e:
+                # e.g. a connection error, the items are reported as failed
+                print("failed to send batch:", e)
+                trace.get_current_span().record_exception(e)
+                break
+            requests = res.get("UnprocessedItems") or {}
+            if not requests:
+                return []
+
+        return [r["PutRequest"]["Item"] for r in requests.get(table_name, [])]
+    finally:
+        otel_context.detach(token)
+
+
+@tracer.start_as_current_span("batch_write_items")
+def batch_write_items(table_name: str, items: List[dict]) -> Tuple[dict, List[dict]]:
+    """
+        Writes the items with BatchWriteItem requests of 25 items sent concurrently,
+        retrying the unprocessed ones. Returns the number of written and failed
+        items with the throughput, and the items that couldn't be written.
+
+        Parameters:
+            table_name: dynamodb table
+            items: items in the dynamodb format, e.g. {"id": {"S": "..."}}
+    """
+    span = trace.get_current_span()
+    span.set_attributes({"table.name": table_name, "batch.items": len(items)})
+
+    chunks = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+    ctx = otel_context.get_current()
+
+    start = time.perf_counter()
+    failed_items = [
+        item
+        for failed in _pool.map(lambda chunk: _write_chunk(ctx, table_name, chunk), chunks)
+        for item in failed
+    ]
+    seconds = time.perf_counter() - start
+    failed = len(failed_items)
+
+    result = {
+        "written": len(items) - failed,
+        "failed": failed,
+        "seconds": round(seconds, 3),
+        "items_per_second": round((len(items) - failed) / seconds, 1) if seconds else 0,
+    }
+    span.set_attributes({f"batch.{k}": v for k, v in result.items()})
+
+    if failed:
+        print("batch write failed items:", table_name, result)
+        span.set_status(trace.StatusCode.ERROR)
+    return result, failed_items
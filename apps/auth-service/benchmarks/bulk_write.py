@@ -0,0 +1,99 @@
+"""
+    Compares items/sec writing tokens one put_item at a time (how seed_tokens
+    worked) against the batch writes of batch_write.py.
+
+    It runs against a local stub of the DynamoDB endpoint that takes --latency
+    seconds per request and leaves --unprocessed of every batch unprocessed,
+    like a throttled table, run it from apps/auth-service:
+
+        python -m benchmarks.bulk_write --items 5000 --latency 0.01
+"""
+import os
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# fake credentials must be set before boto3 creates a session
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+from config import AUTH_TABLE
+from clients import get_client
+from batch_write import batch_write_items
+
+LATENCY = 0.01
+UNPROCESSED = 0.1
+
+
+class DynamoStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(LATENCY)
+
+        response = {}
+        if self.headers.get("X-Amz-Target", "").endswith("BatchWriteItem"):
+            unprocessed = {
+                table: [r for r in requests if random.random() < UNPROCESSED]
+                for table, requests in request["RequestItems"].items()
+            }
+            response["UnprocessedItems"] = {t: r for t, r in unprocessed.items() if r}
+
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def put_one_by_one(items: list) -> float:
+    db = get_client('dynamodb')
+    start = time.perf_counter()
+    for item in items:
+        db.put_item(TableName=AUTH_TABLE, Item=item)
+    return len(items) / (time.perf_counter() - start)
+
+
+def put_in_batches(items: list) -> float:
+    result, _ = batch_write_items(AUTH_TABLE, items)
+    return result["items_per_second"]
+
+
+def main():
+    global LATENCY, UNPROCESSED
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=LATENCY)
+    parser.add_argument("--unprocessed", type=float, default=UNPROCESSED)
+    args = parser.parse_args()
+    LATENCY, UNPROCESSED = args.latency, args.unprocessed
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DynamoStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["AWS_ENDPOINT_URL"] = f"http://127.0.0.1:{server.server_port}"
+
+    items = [
+        {"token": {"S": f"token-{i}"}, "username": {"S": f"user-{i}"}}
+        for i in range(args.items)
+    ]
+    # one by one is too slow to write every item, its rate doesn't depend on the count
+    before = put_one_by_one(items[:min(len(items), 500)])
+    after = put_in_batches(items)
+    server.shutdown()
+
+    print(f"put_item:       {before:10.1f} items/s")
+    print(f"batch writes:   {after:10.1f} items/s")
+    print(f"speedup:        {after / before:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
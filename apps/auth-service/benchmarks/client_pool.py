@@ -0,0 +1,83 @@
+"""
+    Compares requests/sec of a DynamoDB get_item creating a boto3 resource per
+    call (old behavior) against the shared resource of clients.py.
+
+    It runs against a local stub of the DynamoDB endpoint so no aws account is
+    needed, run it from apps/auth-service:
+
+        python -m benchmarks.client_pool --requests 500 --threads 8
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# fake credentials and endpoint must be set before boto3 creates a session
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+import boto3
+
+from config import AWS_REGION, AUTH_TABLE
+from clients import get_resource
+
+
+class DynamoStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({
+            "Item": {"token": {"S": "abc"}, "username": {"S": "bench"}}
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def get_token_per_call_resource():
+    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
+    return dynamodb.Table(AUTH_TABLE).get_item(Key={'token': 'abc'})
+
+
+def get_token_shared_resource():
+    dynamodb = get_resource('dynamodb')
+    return dynamodb.Table(AUTH_TABLE).get_item(Key={'token': 'abc'})
+
+
+def run(fn, requests: int, threads: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda _: fn(), range(requests)))
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DynamoStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["AWS_ENDPOINT_URL"] = f"http://127.0.0.1:{server.server_port}"
+
+    before = run(get_token_per_call_resource, args.requests, args.threads)
+    after = run(get_token_shared_resource, args.requests, args.threads)
+    server.shutdown()
+
+    print(f"resource per call: {before:10.1f} req/s")
+    print(f"shared resource:   {after:10.1f} req/s")
+    print(f"speedup:           {after / before:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,3 +4,26 @@ AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 OTLP_COLLECTOR_ENDPOINT = os.getenv("OTLP_COLLECTOR_ENDPOINT")
 AUTH_TABLE = "otel-observability-auth"
 FILES_TABLE = "otel-observability-files"
+
+# boto3 clients are shared by the whole process (see clients.py)
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "50"))
+AWS_MAX_RETRIES = int(os.getenv("AWS_MAX_RETRIES", "3"))
+AWS_RETRY_MODE = os.getenv("AWS_RETRY_MODE", "standard")
+AWS_TCP_KEEPALIVE = os.getenv("AWS_TCP_KEEPALIVE", "true").lower() == "true"
+
+# ratio of the traces started in this service that are sampled, and the
+# routes with their own sampler, e.g. "/validate=rate:50,/tokens=0.1"
+TRACES_SAMPLER_RATIO = float(os.getenv("TRACES_SAMPLER_RATIO", "1.0"))
+TRACES_SAMPLER_RULES = os.getenv("TRACES_SAMPLER_RULES", "/validate=rate:50")
+
+# seconds that has_tokens remembers that the table isn't empty (see repository.py)
+HAS_TOKENS_CACHE_SECONDS = float(os.getenv("HAS_TOKENS_CACHE_SECONDS", "60"))
+
+METRICS_EXPORT_INTERVAL_MILLIS = int(os.getenv("METRICS_EXPORT_INTERVAL_MILLIS", "15000"))
+
+# BatchWriteItem requests sent at the same time by the bulk endpoints, and the
+# retries of the unprocessed items (see batch_write.py)
+BATCH_WRITE_CONCURRENCY = int(os.getenv("BATCH_WRITE_CONCURRENCY", "8"))
+BATCH_WRITE_MAX_ATTEMPTS = int(os.getenv("BATCH_WRITE_MAX_ATTEMPTS", "8"))
+BATCH_WRITE_BASE_DELAY = float(os.getenv("BATCH_WRITE_BASE_DELAY", "0.05"))
+BATCH_WRITE_MAX_DELAY = float(os.getenv("BATCH_WRITE_MAX_DELAY", "2"))
@@ -1,10 +1,13 @@
+import time
 import uuid
+from typing import Iterator, List
 
 from faker import Faker
-import boto3
 from opentelemetry import trace
 
-from config import AWS_REGION, AUTH_TABLE
+from config import AUTH_TABLE, HAS_TOKENS_CACHE_SECONDS
+from clients import get_resource
+from batch_write import batch_write_items
 
 
 tracer = trace.get_tracer("auth-service")
@@ -16,7 +19,7 @@ def add_token(username: str, token: str):
     span.set_attribute("user.username", username)
     span.set_attribute("db.table", AUTH_TABLE)
 
-    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
+    dynamodb = get_resource('dynamodb')
     table = dynamodb.Table(AUTH_TABLE)
     return table.put_item(Item={
         'username': username,
@@ -24,14 +27,113 @@ def add_token(username: str, token: str):
     })
 
 
-@tracer.start_as_current_span("scan_tokens") 
-def scan_tokens():
+# the attributes returned when listing the tokens
+TOKEN_PROJECTION = {
+    'ProjectionExpression': '#token, #username',
+    'ExpressionAttributeNames': {'#token': 'token', '#username': 'username'},
+}
+
+# monotonic time until the table is known to have tokens. The service doesn't
+# delete tokens, but they can be deleted out of it (e.g. the console), so
+# has_tokens checks the table again once it expires. A delete endpoint must
+# reset it
+_has_tokens_until = 0.0
+
+
+def _set_has_tokens():
+    global _has_tokens_until
+    _has_tokens_until = time.monotonic() + HAS_TOKENS_CACHE_SECONDS
+
+
+@tracer.start_as_current_span("add_tokens") 
+def add_tokens(tokens: List[dict]) -> dict:
+    """
+        Inserts the tokens with batch writes, returns the write stats
+
+        Parameters:
+            tokens: list of {"username": ..., "token": ...}
+    """
     span = trace.get_current_span()
-    span.set_attribute("db.table", AUTH_TABLE)
+    span.set_attributes({"db.table": AUTH_TABLE, "tokens.count": len(tokens)})
+
+    # a batch can't write the same key twice, the last one wins
+    unique = {t["token"]: t["username"] for t in tokens}
+    result, _ = batch_write_items(AUTH_TABLE, [
+        {"username": {"S": username}, "token": {"S": token}}
+        for token, username in unique.items()
+    ])
+    if result["written"]:
+        _set_has_tokens()
+    return result
+
+
+@tracer.start_as_current_span("get_tokens") 
+def get_tokens(page_size: int = 50, last_token: str = None):
+    """
+        Returns a page of tokens, the next one starts after `last_token`
+
+        Parameters:
+            page_size: max number of tokens returned
+            last_token: last token of the previous page
+    """
+    span = trace.get_current_span()
+    span.set_attributes({
+        "db.table": AUTH_TABLE,
+        "query.page_size": page_size,
+        "query.last_token": last_token or "None",
+    })
 
-    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
+    dynamodb = get_resource('dynamodb')
     table = dynamodb.Table(AUTH_TABLE)
-    return table.scan()['Items']
+
+    scan_params = {**TOKEN_PROJECTION, 'Limit': page_size}
+    if last_token:
+        scan_params['ExclusiveStartKey'] = {'token': last_token}
+
+    rs = table.scan(**scan_params)
+
+    span.set_attributes({
+        "result.count": len(rs.get('Items', [])),
+        "result.has_more": 'LastEvaluatedKey' in rs
+    })
+
+    return {
+        'items': rs.get('Items', []),
+        'last_token': rs.get('LastEvaluatedKey', {}).get('token'),
+        'has_more': 'LastEvaluatedKey' in rs
+    }
+
+
+def iter_tokens(page_size: int = 500) -> Iterator[dict]:
+    """ Yields every token, reading the table one page at a time """
+    last_token = None
+    while True:
+        res = get_tokens(page_size, last_token)
+        yield from res['items']
+
+        if not res['has_more']:
+            return
+        last_token = res['last_token']
+
+
+@tracer.start_as_current_span("has_tokens") 
+def has_tokens() -> bool:
+    span = trace.get_current_span()
+    cached = time.monotonic() < _has_tokens_until
+    span.set_attributes({"db.table": AUTH_TABLE, "cache.hit": cached})
+    if cached:
+        return True
+
+    dynamodb = get_resource('dynamodb')
+    table = dynamodb.Table(AUTH_TABLE)
+    # a single key is enough to know that the table isn't empty
+    rs = table.scan(Limit=1, ProjectionExpression='#token',
+                    ExpressionAttributeNames={'#token': 'token'})
+
+    if not rs.get('Items'):
+        return False
+    _set_has_tokens()
+    return True
 
 
 @tracer.start_as_current_span("get_token") 
@@ -39,7 +141,7 @@ def get_token(token: str):
     span = trace.get_current_span()
     span.set_attribute("db.table", AUTH_TABLE)
 
-    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
+    dynamodb = get_resource('dynamodb')
     table = dynamodb.Table(AUTH_TABLE)
     res = table.get_item(Key={'token': token})
     return res.get('Item', None)
@@ -50,10 +152,11 @@ def seed_tokens():
     span = trace.get_current_span()
     span.set_attribute("db.table", AUTH_TABLE)
 
-    tokens = scan_tokens()
-    if len(tokens) > 0:
+    if has_tokens():
         return
 
     faker = Faker()
-    for _ in range(4):
-        add_token(faker.user_name(), uuid.uuid4().hex[:20])
+    add_tokens([
+        {"username": faker.user_name(), "token": uuid.uuid4().hex[:20]}
+        for _ in range(4)
+    ])
@@ -0,0 +1,120 @@
+# the same module is in every app (auth-service, files-service and
+# load-pipeline/src), `make check-shared` compares the copies
+import time
+import threading
+from typing import Dict, Optional, Sequence
+
+from opentelemetry import trace
+from opentelemetry.context import Context
+from opentelemetry.sdk.trace.sampling import (
+    ALWAYS_OFF, ALWAYS_ON, Decision, ParentBased, Sampler, SamplingResult,
+    TraceIdRatioBased,
+)
+from opentelemetry.trace import Link, SpanKind
+from opentelemetry.util.types import Attributes
+
+
+class RateLimitingSampler(Sampler):
+    """ Samples up to `per_second` traces per second """
+
+    def __init__(self, per_second: float):
+        self.per_second = per_second
+        # token bucket refilled continuously, one token per sampled trace
+        self._tokens = per_second
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def should_sample(
+        self,
+        parent_context: Optional[Context],
+        trace_id: int,
+        name: str,
+        kind: Optional[SpanKind] = None,
+        attributes: Attributes = None,
+        links: Optional[Sequence[Link]] = None,
+        trace_state=None,
+    ) -> SamplingResult:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.per_second, self._tokens + (now - self._last_refill) * self.per_second
+            )
+            self._last_refill = now
+
+            sampled = self._tokens >= 1
+            if sampled:
+                self._tokens -= 1
+
+        parent_trace_state = trace.get_current_span(parent_context).get_span_context().trace_state
+        if not sampled:
+            return SamplingResult(Decision.DROP, None, parent_trace_state)
+        return SamplingResult(Decision.RECORD_AND_SAMPLE, attributes, parent_trace_state)
+
+    def get_description(self) -> str:
+        return f"RateLimitingSampler{{{self.per_second}}}"
+
+
+class RouteSampler(Sampler):
+    """
+        Delegates to the sampler of the http route of the span (or its name
+        for non http spans), or to the default one if it has no rule
+    """
+
+    def __init__(self, default: Sampler, rules: Dict[str, Sampler]):
+        self.default = default
+        self.rules = rules
+
+    def should_sample(
+        self,
+        parent_context: Optional[Context],
+        trace_id: int,
+        name: str,
+        kind: Optional[SpanKind] = None,
+        attributes: Attributes = None,
+        links: Optional[Sequence[Link]] = None,
+        trace_state=None,
+    ) -> SamplingResult:
+        # http server spans are named "<method> <route>"
+        route = (attributes or {}).get("http.route") or name.split(" ")[-1]
+        sampler = self.rules.get(route, self.default)
+        return sampler.should_sample(
+            parent_context, trace_id, name, kind, attributes, links, trace_state
+        )
+
+    def get_description(self) -> str:
+        rules = ",".join(f"{r}={s.get_description()}" for r, s in self.rules.items())
+        return f"RouteSampler{{default={self.default.get_description()},{rules}}}"
+
+
+def parse_sampler(value: str) -> Sampler:
+    """ 'always', 'never', 'rate:<traces per second>' or a ratio from 0 to 1 """
+    value = value.strip()
+    if value == "always":
+        return ALWAYS_ON
+    if value == "never":
+        return ALWAYS_OFF
+    if value.startswith("rate:"):
+        return RateLimitingSampler(float(value[len("rate:"):]))
+    return TraceIdRatioBased(float(value))
+
+
+def parse_rules(value: str) -> Dict[str, Sampler]:
+    """ e.g. '/upload/complete=always,/validate=rate:50,/files=0.1' """
+    rules = {}
+    for rule in filter(None, (r.strip() for r in value.split(","))):
+        route, sampler = rule.split("=", 1)
+        rules[route.strip()] = parse_sampler(sampler)
+    return rules
+
+
+def create_sampler(ratio: float, rules: str) -> Sampler:
+    """
+        Samples `ratio` of the traces started in this service, except the routes
+        with a rule. Spans with a parent in this service follow its decision, and
+        the ones with a parent in another service too unless their route has a rule.
+    """
+    route_rules = parse_rules(rules)
+    return ParentBased(
+        root=RouteSampler(TraceIdRatioBased(ratio), route_rules),
+        remote_parent_sampled=RouteSampler(ALWAYS_ON, route_rules),
+    )
@@ -1,8 +1,17 @@
+import json
+import asyncio
+import hashlib
 from typing import List
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Body, Query, Path, Depends, Request, Response
+from fastapi import (
+    FastAPI, Body, Query, Path, Depends, Request, Response, HTTPException,
+)
 from dotenv import load_dotenv
+from botocore.exceptions import ClientError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 
 load_dotenv()
 
@@ -10,18 +19,37 @@ from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from opentelemetry import trace
 
 from repositories.files import (
-    get_files, update_file, insert_file, InsertFile, UpdateFile,
+    get_files, update_file, insert_file, insert_files, InsertFile, UpdateFile,
     delete_file,
 )
 from dependencies import get_username, auth
 from services.aws import (
     init_upload, FilePart, complete_upload, get_presigned_url,
-    list_multipart_uploads, queue_uploaded_file,
+    get_presigned_urls, list_multipart_uploads, list_parts,
 )
+from repositories.outbox import transition_file
+from services.dispatcher import outbox_dispatcher
+from services.sweeper import upload_sweeper
+from services.auth import close_auth_client
+from services.profiling import profile_csv
+from instruments import uploaded_bytes, uploaded_rows
+from aws_io import run_io, shutdown_io
 from instrumentation import setup_tracing
 setup_tracing()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    outbox_dispatcher.start()
+    upload_sweeper.start()
+    yield
+    await upload_sweeper.stop()
+    await outbox_dispatcher.stop()
+    await close_auth_client()
+    shutdown_io()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,7 +57,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["traceparent", "tracestate"]
+    expose_headers=["traceparent", "tracestate", "ETag"]
 )
 
 FastAPIInstrumentor.instrument_app(app)
@@ -38,11 +66,12 @@ tracer = trace.get_tracer(__name__)
 
 
 @app.post("/upload/init")
-def init_upload_route(
+async def init_upload_route(
     filename: str = Body(),
     file_size: int = Body(),
-    columns: List[str] = Body(),
-    row_count: int = Body(),
+    # optional, the file is profiled in the server after the upload
+    columns: List[str] = Body(default=[]),
+    row_count: int = Body(default=0),
     username: str = Depends(get_username),
 ):
     span = trace.get_current_span()
@@ -51,21 +80,23 @@ def init_upload_route(
         "file.rows": row_count, "file.columns": columns
     })
 
-    upload_id = init_upload(filename)
-
-    file_id = insert_file(InsertFile(
-        filename=filename,
-        file_size=file_size,
-        username=username,
-        columns=columns,
-        row_count=row_count,
-    ))
+    # the multipart upload and the file record don't depend on each other
+    upload_id, file_id = await asyncio.gather(
+        run_io(init_upload, filename),
+        run_io(insert_file, InsertFile(
+            filename=filename,
+            file_size=file_size,
+            username=username,
+            columns=columns,
+            row_count=row_count,
+        )),
+    )
 
     return {"upload_id": upload_id, "file_id": file_id}
 
 
 @app.post("/upload/get-presigned-url", dependencies=[Depends(auth)])
-def get_presigned_url_route(
+async def get_presigned_url_route(
     filename: str = Body(),
     upload_id: str = Body(),
     part_number: int = Body(),
@@ -76,13 +107,60 @@ def get_presigned_url_route(
         "file.name": filename
     })
 
-    presigned_url = get_presigned_url(filename, upload_id, part_number)
+    presigned_url = await run_io(get_presigned_url, filename, upload_id, part_number)
 
     return {"url": presigned_url}
 
 
+# s3 multipart uploads support part numbers from 1 to 10,000
+MAX_PART_NUMBER = 10000
+
+
+@app.post("/upload/get-presigned-urls", dependencies=[Depends(auth)])
+async def get_presigned_urls_route(
+    filename: str = Body(),
+    upload_id: str = Body(),
+    part_numbers: List[int] = Body(default=None),
+    first_part: int = Body(default=None),
+    last_part: int = Body(default=None),
+):
+    # signs several parts at once, either a list of part numbers or a range
+    if part_numbers is None:
+        if first_part is None or last_part is None:
+            raise HTTPException(
+                status_code=422,
+                detail="part_numbers or first_part and last_part are required",
+            )
+        # checked before building the range, so a huge range isn't allocated
+        if not 1 <= first_part <= last_part <= MAX_PART_NUMBER:
+            raise HTTPException(
+                status_code=422,
+                detail=f"first_part and last_part must be between 1 and {MAX_PART_NUMBER}, "
+                       "and first_part can't be greater than last_part",
+            )
+        part_numbers = list(range(first_part, last_part + 1))
+
+    if not part_numbers or len(part_numbers) > MAX_PART_NUMBER or any(
+        p < 1 or p > MAX_PART_NUMBER for p in part_numbers
+    ):
+        raise HTTPException(
+            status_code=422,
+            detail=f"part numbers must be between 1 and {MAX_PART_NUMBER}",
+        )
+
+    span = trace.get_current_span()
+    span.set_attributes({
+        "upload.id": upload_id, "file.name": filename,
+        "parts.count": len(part_numbers),
+    })
+
+    urls = await run_io(get_presigned_urls, filename, upload_id, part_numbers)
+
+    return {"urls": [{"part_number": n, "url": url} for n, url in urls.items()]}
+
+
 @app.post("/upload/complete", dependencies=[Depends(auth)])
-def complete_upload_route(
+async def complete_upload_route(
     file_id: str = Body(),
     filename: str = Body(),
     upload_id: str = Body(),
@@ -94,56 +172,125 @@ def complete_upload_route(
         "upload.id": upload_id, "parts.count": len(parts)
     })
     try:
-        complete_upload(filename, upload_id, parts)
+        await run_io(complete_upload, filename, upload_id, parts)
     except Exception as e:
         print(e)
         span.set_status(trace.StatusCode.ERROR)
         span.set_attribute("error", str(e))
 
-        update_file(file_id, UpdateFile( status="failed"))
+        await run_io(update_file, file_id, UpdateFile(status="failed"))
         return {"message": "Upload failed"}
 
-    update_file(file_id, UpdateFile(status="stored"))
+    # the columns and rows sent by the client are replaced by the ones in the
+    # stored file, it must be done before queueing it to be loaded
+    try:
+        profile = await run_io(profile_csv, filename)
+    except Exception as e:
+        print(e)
+        span.set_status(trace.StatusCode.ERROR)
+        span.set_attribute("error", str(e))
 
-    queue_uploaded_file(file_id, filename)
+        await run_io(update_file, file_id, UpdateFile(status="failed"))
+        return {"message": "Upload failed"}
+
+    # the file is stored and its message to load it is added to the outbox in
+    # the same transaction, the dispatcher sends it to the queue
+    await run_io(transition_file, file_id, UpdateFile(
+        status="stored",
+        columns=profile.columns,
+        column_types=profile.column_types,
+        column_max_lengths=profile.column_max_lengths,
+        row_count=profile.row_count,
+        row_count_estimated=profile.row_count_estimated,
+    ), queue_filename=filename)
+    outbox_dispatcher.notify()
+
+    uploaded_bytes.record(profile.file_size)
+    uploaded_rows.record(profile.row_count)
 
     return {"message": "Upload completed"}
 
 
+@app.get("/upload/{upload_id}/parts", dependencies=[Depends(auth)])
+async def list_parts_route(
+    upload_id: str = Path(),
+    filename: str = Query(),
+):
+    # the parts already uploaded, to resume an upload sending only the missing ones
+    span = trace.get_current_span()
+    span.set_attributes({"upload.id": upload_id, "file.name": filename})
+
+    try:
+        parts = await run_io(list_parts, filename, upload_id)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchUpload":
+            raise HTTPException(status_code=404, detail="Upload not found")
+        raise
+
+    return {"parts": parts}
+
+
 @app.get("/upload/list-multipart-uploads")
-def list_multipart_uploads_route():
-    return list_multipart_uploads()
+async def list_multipart_uploads_route():
+    return await run_io(list_multipart_uploads)
 
 
 @app.get("/files")
-def get_files_route(
-    page_size: int = Query(default=10),
+async def get_files_route(
+    request: Request,
+    page_size: int = Query(default=10, ge=1, le=1000),
+    cursor: str = Query(default=None),
+    # deprecated, the cursor has the complete key of the last file
     last_id: str = Query(default=None),
+    fields: str = Query(default=None, description="e.g. id,filename,status"),
 ):
-    res = get_files(page_size, last_id)
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    try:
+        res = await run_io(get_files, page_size, cursor, field_list, last_id)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
     if not res["has_more"]:
-        return {"result": res["items"]}
-
-    return {
-        "pagination": {
-            "last_id": res["last_id"],
-            "has_more": res["has_more"],
-        },
-        "result": res["items"],
-    }
+        body = {"result": res["items"]}
+    else:
+        body = {
+            "pagination": {
+                "cursor": res["cursor"],
+                "last_id": res["last_id"],
+                "has_more": res["has_more"],
+            },
+            "result": res["items"],
+        }
+
+    # the clients poll the files, they only get the body when it changed
+    content = jsonable_encoder(body)
+    etag = '"' + hashlib.sha1(
+        json.dumps(content, sort_keys=True).encode()
+    ).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (t.strip().removeprefix("W/") for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content, headers=headers)
 
 
 @app.post("/files")
-def insert_file_route(file: InsertFile):
-    return insert_file(file)
+async def insert_file_route(file: InsertFile):
+    return await run_io(insert_file, file)
+
+
+@app.post("/files/bulk")
+async def insert_files_route(files: List[InsertFile]):
+    ids, result = await run_io(insert_files, files)
+    return {"ids": ids, **result}
 
 
 @app.put("/files/{id}")
-def update_file_route(file: UpdateFile, id: str = Path()):
-    return update_file(id, file)
+async def update_file_route(file: UpdateFile, id: str = Path()):
+    return await run_io(update_file, id, file)
 
 
 @app.delete("/files/{id}")
-def delete_file_route(id: str = Path()):
-    return delete_file(id)
+async def delete_file_route(id: str = Path()):
+    return await run_io(delete_file, id)
@@ -0,0 +1,32 @@
+import asyncio
+import contextvars
+from functools import partial
+from typing import Callable, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+
+from config import AWS_IO_THREADS
+
+T = TypeVar("T")
+
+# boto3 is blocking, so the aws calls of the async routes run in these threads.
+# Waiting requests are coroutines instead of threads of the starlette threadpool,
+# only the calls in progress use a thread, up to AWS_IO_THREADS at the same time.
+_executor = ThreadPoolExecutor(max_workers=AWS_IO_THREADS, thread_name_prefix="aws-io")
+
+
+async def run_io(fn: Callable[..., T], *args, **kwargs) -> T:
+    """
+        Runs a blocking function (e.g. a repository call) without blocking the
+        event loop, the current context is copied so its spans have the right parent.
+
+        Parameters:
+            fn: function to run
+            args, kwargs: arguments of the function
+    """
+    ctx = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(ctx.run, fn, *args, **kwargs))
+
+
+def shutdown_io():
+    _executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,128 @@
+"""
+    Measures the throughput of the server side multipart uploads of
+    services/uploader.py with different concurrency levels, from a memory
+    mapped file and from a stream.
+
+    It runs against a local stand-in of s3 that receives every part at
+    --part-mbps MB/s and fails --failure-rate of them, so no aws account is
+    needed, run it from apps/files-service:
+
+        python -m benchmarks.multipart_upload --size-mb 256 --concurrency 1 4 16
+"""
+import os
+import io
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# fake credentials, bucket and endpoint must be set before the config is imported
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ["S3_BUCKET_NAME"] = "benchmark"
+
+from services.uploader import MultipartUploader
+
+PART_MBPS = 50.0
+FAILURE_RATE = 0.02
+
+
+class S3StandInHandler(BaseHTTPRequestHandler):
+    """ The multipart upload requests of s3, the parts are discarded """
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def _reply(self, status: int, body: bytes = b"", headers: dict = None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        query = parse_qs(urlparse(self.path).query, keep_blank_values=True)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if "uploads" in query:
+            body = (
+                "<InitiateMultipartUploadResult><Bucket>benchmark</Bucket><Key>file</Key>"
+                f"<UploadId>{uuid.uuid4().hex}</UploadId></InitiateMultipartUploadResult>"
+            )
+        else:
+            body = (
+                "<CompleteMultipartUploadResult><Bucket>benchmark</Bucket><Key>file</Key>"
+                "<ETag>\"etag\"</ETag></CompleteMultipartUploadResult>"
+            )
+        self._reply(200, body.encode(), {"Content-Type": "application/xml"})
+
+    def do_PUT(self):
+        remaining = int(self.headers.get("Content-Length", 0))
+        md5 = hashlib.md5()
+        start = time.perf_counter()
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 1024 * 1024))
+            md5.update(chunk)
+            remaining -= len(chunk)
+            # limits the bandwidth of every connection like a real network
+            received = int(self.headers["Content-Length"]) - remaining
+            delay = received / (PART_MBPS * 1024 * 1024) - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        if random.random() < FAILURE_RATE:
+            self._reply(503)
+            return
+        self._reply(200, headers={"ETag": f'"{md5.hexdigest()}"'})
+
+    def do_DELETE(self):
+        self._reply(204)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    global PART_MBPS, FAILURE_RATE
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--part-size-mb", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--part-mbps", type=float, default=PART_MBPS)
+    parser.add_argument("--failure-rate", type=float, default=FAILURE_RATE)
+    args = parser.parse_args()
+    PART_MBPS, FAILURE_RATE = args.part_mbps, args.failure_rate
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), S3StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["AWS_ENDPOINT_URL"] = f"http://127.0.0.1:{server.server_port}"
+
+    with tempfile.NamedTemporaryFile() as file:
+        file.write(os.urandom(1024 * 1024) * args.size_mb)
+        file.flush()
+
+        print(f"{'source':<8} {'concurrency':>11} {'MB/s':>8} {'retries':>8}")
+        for concurrency in args.concurrency:
+            uploader = MultipartUploader(
+                part_size=args.part_size_mb * 1024 * 1024, concurrency=concurrency,
+            )
+            with open(file.name, "rb") as f:
+                result = uploader.upload(f, "benchmark.csv")
+            print(f"{'mmap':<8} {concurrency:>11} {result.mb_per_second:>8.1f} {result.retries:>8}")
+
+            with open(file.name, "rb") as f:
+                # a stream without file descriptor, like stdin in a pipe
+                result = uploader.upload(io.BufferedReader(io.BytesIO(f.read())), "benchmark.csv")
+            print(f"{'stream':<8} {concurrency:>11} {result.mb_per_second:>8.1f} {result.retries:>8}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
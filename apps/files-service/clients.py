@@ -0,0 +1,82 @@
+# shared by auth-service and files-service, the copies must be the same
+# (every app is built from its folder), `make check-shared` compares them
+import threading
+
+import boto3
+from botocore.config import Config
+
+from instruments import instrument_aws_session
+from config import (
+    AWS_REGION, AWS_MAX_POOL_CONNECTIONS, AWS_MAX_RETRIES, AWS_RETRY_MODE,
+    AWS_TCP_KEEPALIVE,
+)
+
+
+# building a boto3 client is expensive (session, endpoint resolution, connection
+# pool), so they are created once per process and reused by every request
+_lock = threading.Lock()
+_session = None
+_clients = {}
+# boto3 resources are not thread safe, so they are cached per thread
+_resources = threading.local()
+
+
+def _get_session() -> boto3.Session:
+    global _session
+    if _session is None:
+        _session = boto3.Session()
+        instrument_aws_session(_session)
+    return _session
+
+
+def _get_config() -> Config:
+    return Config(
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=AWS_TCP_KEEPALIVE,
+        retries={"max_attempts": AWS_MAX_RETRIES, "mode": AWS_RETRY_MODE},
+    )
+
+
+def get_client(service_name: str, region_name: str = AWS_REGION):
+    """
+        Returns a boto3 client shared by the whole process.
+
+        Parameters:
+            service_name: aws service name, e.g. 's3', 'sqs', 'dynamodb'
+            region_name: aws region of the client
+    """
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        # another thread could create it while we were waiting the lock
+        if key not in _clients:
+            _clients[key] = _get_session().client(
+                service_name, region_name=region_name, config=_get_config()
+            )
+        return _clients[key]
+
+
+def get_resource(service_name: str, region_name: str = AWS_REGION):
+    """
+        Returns a boto3 resource reused by the current thread.
+
+        Parameters:
+            service_name: aws service name, e.g. 'dynamodb'
+            region_name: aws region of the resource
+    """
+    key = (service_name, region_name)
+    cache = getattr(_resources, "cache", None)
+    if cache is None:
+        cache = _resources.cache = {}
+
+    if key not in cache:
+        # boto3 sessions are not thread safe while creating clients
+        with _lock:
+            cache[key] = _get_session().resource(
+                service_name, region_name=region_name, config=_get_config()
+            )
+    return cache[key]
+
@@ -6,3 +6,71 @@ SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
 BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 OTLP_COLLECTOR_ENDPOINT = os.getenv("OTLP_COLLECTOR_ENDPOINT")
 FILES_TABLE = "otel-observability-files"
+# messages waiting to be sent to the queue (see repositories/outbox.py)
+OUTBOX_TABLE = "otel-observability-outbox"
+
+# threads running the aws calls of the async routes (see aws_io.py). Only the
+# calls in progress take a thread, so this is the max of aws calls in flight
+# of the process, the requests waiting for them are coroutines
+AWS_IO_THREADS = int(os.getenv("AWS_IO_THREADS", "256"))
+# boto3 clients are shared by the whole process (see clients.py), with a
+# connection per io thread so no call waits for a free connection
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", str(AWS_IO_THREADS)))
+AWS_MAX_RETRIES = int(os.getenv("AWS_MAX_RETRIES", "3"))
+AWS_RETRY_MODE = os.getenv("AWS_RETRY_MODE", "standard")
+AWS_TCP_KEEPALIVE = os.getenv("AWS_TCP_KEEPALIVE", "true").lower() == "true"
+
+# in-process cache of auth-service token validations
+TOKEN_CACHE_MAX_SIZE = int(os.getenv("TOKEN_CACHE_MAX_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "60"))
+TOKEN_CACHE_NEGATIVE_TTL = float(os.getenv("TOKEN_CACHE_NEGATIVE_TTL", "5"))
+
+# pooled http client used to validate tokens against auth-service
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", "5"))
+AUTH_CONNECT_TIMEOUT = float(os.getenv("AUTH_CONNECT_TIMEOUT", "2"))
+AUTH_MAX_CONNECTIONS = int(os.getenv("AUTH_MAX_CONNECTIONS", "100"))
+AUTH_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AUTH_MAX_KEEPALIVE_CONNECTIONS", "20"))
+AUTH_MAX_CONCURRENCY = int(os.getenv("AUTH_MAX_CONCURRENCY", "500"))
+# http/2 uses the h2 package, locked with the http2 extra of httpx
+AUTH_HTTP2 = os.getenv("AUTH_HTTP2", "false").lower() == "true"
+
+# ranged reads used to profile the uploaded csv files
+PROFILE_CHUNK_BYTES = int(os.getenv("PROFILE_CHUNK_BYTES", str(64 * 1024)))
+PROFILE_SAMPLES = int(os.getenv("PROFILE_SAMPLES", "8"))
+
+# ratio of the traces started in this service that are sampled, and the
+# routes with their own sampler, e.g. "/upload/complete=always,/files=rate:10"
+TRACES_SAMPLER_RATIO = float(os.getenv("TRACES_SAMPLER_RATIO", "1.0"))
+TRACES_SAMPLER_RULES = os.getenv("TRACES_SAMPLER_RULES", "/upload/complete=always")
+
+METRICS_EXPORT_INTERVAL_MILLIS = int(os.getenv("METRICS_EXPORT_INTERVAL_MILLIS", "15000"))
+
+# BatchWriteItem requests sent at the same time by the bulk endpoints, and the
+# retries of the unprocessed items (see batch_write.py)
+BATCH_WRITE_CONCURRENCY = int(os.getenv("BATCH_WRITE_CONCURRENCY", "8"))
+BATCH_WRITE_MAX_ATTEMPTS = int(os.getenv("BATCH_WRITE_MAX_ATTEMPTS", "8"))
+BATCH_WRITE_BASE_DELAY = float(os.getenv("BATCH_WRITE_BASE_DELAY", "0.05"))
+BATCH_WRITE_MAX_DELAY = float(os.getenv("BATCH_WRITE_MAX_DELAY", "2"))
+
+# seconds between checks of the outbox when it's empty, new messages of this
+# process are sent right away
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+# outbox messages read at a time, they are sent in batches of 10
+OUTBOX_READ_LIMIT = int(os.getenv("OUTBOX_READ_LIMIT", "100"))
+# seconds that a message is reserved for the replica sending it, after that
+# another replica sends it (e.g. when the first one stopped)
+OUTBOX_CLAIM_SECONDS = int(os.getenv("OUTBOX_CLAIM_SECONDS", "60"))
+
+# multipart uploads from servers (see services/uploader.py), s3 parts must
+# be at least 5MB except the last one
+UPLOAD_PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024)))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "8"))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "5"))
+
+# multipart uploads not completed after this time are aborted so their parts
+# aren't stored forever, checked every UPLOAD_SWEEP_INTERVAL seconds
+STALE_UPLOAD_AGE = float(os.getenv("STALE_UPLOAD_AGE", str(24 * 60 * 60)))
+UPLOAD_SWEEP_INTERVAL = float(os.getenv("UPLOAD_SWEEP_INTERVAL", str(60 * 60)))
+
+# seconds the first page of the files is cached, 0 to disable it
+FILES_FIRST_PAGE_TTL = float(os.getenv("FILES_FIRST_PAGE_TTL", "2"))
@@ -1,10 +1,19 @@
+import httpx
 from fastapi import HTTPException, Header, Depends
 from opentelemetry import trace
 
 from services.auth import validate_token
+from services.token_cache import TokenCache
+from config import TOKEN_CACHE_MAX_SIZE, TOKEN_CACHE_TTL, TOKEN_CACHE_NEGATIVE_TTL
 
 tracer = trace.get_tracer(__name__)
 
+token_cache = TokenCache(
+    max_size=TOKEN_CACHE_MAX_SIZE,
+    ttl=TOKEN_CACHE_TTL,
+    negative_ttl=TOKEN_CACHE_NEGATIVE_TTL,
+)
+
 
 @tracer.start_as_current_span("auth")
 async def auth(token: str = Header()):
@@ -13,7 +22,12 @@ async def auth(token: str = Header()):
     if not token:
         raise HTTPException(status_code=401)
 
-    ok, user = validate_token(token)
+    try:
+        ok, user = await token_cache.get_or_load(token, validate_token)
+    except httpx.HTTPError as e:
+        # auth-service failed, the token is neither valid nor invalid
+        span.record_exception(e)
+        raise HTTPException(status_code=503, detail="Auth service unavailable")
     if not ok:
         raise HTTPException(status_code=401)
     
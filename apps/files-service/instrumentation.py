@@ -1,22 +1,38 @@
-from opentelemetry import trace
+from opentelemetry import trace, metrics
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.instrumentation.botocore import BotocoreInstrumentor
 from opentelemetry.semconv.attributes.service_attributes import SERVICE_NAME
 
-from config import OTLP_COLLECTOR_ENDPOINT
+from config import (
+    OTLP_COLLECTOR_ENDPOINT, METRICS_EXPORT_INTERVAL_MILLIS, TRACES_SAMPLER_RATIO,
+    TRACES_SAMPLER_RULES,
+)
+from sampling import create_sampler
 
 def setup_tracing():
   BotocoreInstrumentor().instrument()
 
   resource = Resource.create({SERVICE_NAME: "files-service"})
 
-  tracer_provider = TracerProvider(resource=resource)
+  sampler = create_sampler(TRACES_SAMPLER_RATIO, TRACES_SAMPLER_RULES)
+  tracer_provider = TracerProvider(resource=resource, sampler=sampler)
 
   otel_exporter = OTLPSpanExporter(endpoint=OTLP_COLLECTOR_ENDPOINT, insecure=True)
   span_processor = BatchSpanProcessor(otel_exporter)
   tracer_provider.add_span_processor(span_processor)
 
-  trace.set_tracer_provider(tracer_provider)
\ No newline at end of file
+  trace.set_tracer_provider(tracer_provider)
+
+  metric_exporter = OTLPMetricExporter(endpoint=OTLP_COLLECTOR_ENDPOINT, insecure=True)
+  metric_reader = PeriodicExportingMetricReader(
+    metric_exporter, export_interval_millis=METRICS_EXPORT_INTERVAL_MILLIS
+  )
+  meter_provider = MeterProvider(resource=resource, metric_readers=[metric_reader])
+
+  metrics.set_meter_provider(meter_provider)
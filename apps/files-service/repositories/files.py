@@ -1,13 +1,18 @@
-from typing import List
+import json
+import time
+import base64
+import threading
+from typing import List, Optional, Tuple
 from datetime import datetime
 from ulid import ULID
 
-import boto3
 from pydantic import BaseModel, Field
 from boto3.dynamodb.conditions import Key
 from opentelemetry import trace
 
-from config import AWS_REGION, FILES_TABLE
+from config import FILES_TABLE, FILES_FIRST_PAGE_TTL
+from clients import get_client, get_resource
+from batch_write import batch_write_items
 
 
 tracer = trace.get_tracer(__name__)
@@ -17,13 +22,21 @@ class InsertFile(BaseModel):
     filename: str
     file_size: int
     status: str = Field(default='pending', description='pending, stored, loaded')
-    row_count: int
+    # the columns and rows are optional because they are profiled after the upload
+    row_count: int = 0
     username: str
-    columns: List[str]
+    columns: List[str] = []
 
 
 class UpdateFile(BaseModel):
     status: str = Field(default='pending', description='pending, stored, loaded, failed')
+    columns: Optional[List[str]] = None
+    column_types: Optional[List[str]] = None
+    # bytes of the longest value of every column in the profiled rows
+    column_max_lengths: Optional[List[int]] = None
+    row_count: Optional[int] = None
+    # false when the whole file was profiled, its column types are exact
+    row_count_estimated: Optional[bool] = None
 
 
 class File(BaseModel):
@@ -34,16 +47,87 @@ class File(BaseModel):
     status: str = Field(default='pending', description='pending, stored, loaded')
 
 
+# attributes of a file that can be requested with `fields`
+FILE_FIELDS = {
+    "id", "filename", "file_size", "status", "username", "columns",
+    "column_types", "column_max_lengths", "row_count", "row_count_estimated",
+    "creation_datetime",
+}
+
+# attributes of the LastEvaluatedKey of creation_datetime-index, the table key
+# and the index key
+CURSOR_KEYS = {"id", "data_type"}
+
+# the first page is requested on every poll of the dashboard, it's kept for a
+# few seconds and dropped when a file changes. The generation avoids storing a
+# page read before a change.
+_first_pages = {}
+_first_pages_generation = 0
+_first_pages_lock = threading.Lock()
+
+
+def invalidate_first_pages():
+    global _first_pages_generation
+    with _first_pages_lock:
+        _first_pages.clear()
+        _first_pages_generation += 1
+
+
+def encode_cursor(last_key: Optional[dict]) -> Optional[str]:
+    """ The LastEvaluatedKey of a query as an opaque string """
+    if not last_key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(last_key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    """ The ExclusiveStartKey of a cursor, only the keys of the index are accepted """
+    try:
+        last_key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(last_key, dict) or set(last_key) != CURSOR_KEYS:
+        raise ValueError("Invalid cursor")
+    if not all(isinstance(v, str) for v in last_key.values()) or last_key["data_type"] != "FILE":
+        raise ValueError("Invalid cursor")
+    return last_key
+
+
 @tracer.start_as_current_span("get_files")
-def get_files(page_size: int = 10, last_id: str = None):
+def get_files(
+    page_size: int = 10, cursor: str = None, fields: List[str] = None, last_id: str = None,
+):
+    """
+        Returns a page of files, the newest first
+
+        Parameters:
+            page_size: max number of files returned
+            cursor: cursor returned with the previous page
+            fields: attributes returned of every file, all of them by default
+            last_id: id of the last file of the previous page, use cursor instead
+    """
     span = trace.get_current_span()
     span.set_attributes({
         "query.page_size": page_size,
-        "query.last_id": last_id or "None",
+        "query.cursor": cursor or "None",
+        "query.fields": fields or [],
         "table.name": FILES_TABLE
     })
-    
-    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
+
+    if fields is not None and not set(fields) <= FILE_FIELDS:
+        raise ValueError(f"Invalid fields: {', '.join(sorted(set(fields) - FILE_FIELDS))}")
+
+    first_page = not cursor and not last_id
+    cache_key = (page_size, tuple(fields or ()))
+    if first_page:
+        with _first_pages_lock:
+            cached = _first_pages.get(cache_key)
+            generation = _first_pages_generation
+        span.set_attribute("cache.hit", cached is not None and cached[0] > time.monotonic())
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+    dynamodb = get_resource('dynamodb')
     table = dynamodb.Table(FILES_TABLE)
     
     query_params = {
@@ -52,8 +136,17 @@ def get_files(page_size: int = 10, last_id: str = None):
         'ScanIndexForward': False, # sort in descending order
         'Limit': page_size,
     }
+
+    if fields:
+        # placeholders because some fields (e.g. status, columns) are reserved words
+        names = {f"#f{i}": field for i, field in enumerate(fields)}
+        query_params['ProjectionExpression'] = ', '.join(names)
+        query_params['ExpressionAttributeNames'] = names
     
-    if last_id:
+    if cursor:
+        # the complete key of the index, the table key and the index key
+        query_params['ExclusiveStartKey'] = decode_cursor(cursor)
+    elif last_id:
         query_params['ExclusiveStartKey'] = {'id': last_id, "data_type": "FILE"}
     
     rs = table.query(**query_params)
@@ -63,12 +156,36 @@ def get_files(page_size: int = 10, last_id: str = None):
         "result.has_more": 'LastEvaluatedKey' in rs
     })
     
-    return {
+    res = {
         'items': rs.get('Items', []),
+        'cursor': encode_cursor(rs.get('LastEvaluatedKey')),
         'last_id': rs.get('LastEvaluatedKey', {}).get('id'),
         'has_more': 'LastEvaluatedKey' in rs
     }
 
+    if first_page and FILES_FIRST_PAGE_TTL > 0:
+        with _first_pages_lock:
+            if generation == _first_pages_generation:
+                _first_pages[cache_key] = (time.monotonic() + FILES_FIRST_PAGE_TTL, res)
+    return res
+
+
+def file_item(id: str, file: InsertFile) -> dict:
+    """ The file in the dynamodb format """
+    return {
+        "id": {"S": id},
+        "filename": {"S": file.filename},
+        "file_size": {"N": str(file.file_size)},
+        "status": {"S": file.status},
+        "username": {"S": file.username},
+        "columns": {"L": [{"S": col} for col in file.columns]},
+        # data_type is an artificial attribute to "hack" dynamodb 
+        # because its required add a hash key in GlobalSecondaryIndexes
+        "data_type": {"S": "FILE"}, 
+        "creation_datetime": {"S": datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
+        "row_count": {"N": str(file.row_count)},
+    }
+
 
 @tracer.start_as_current_span("insert_file") 
 def insert_file(file: InsertFile) -> str:
@@ -79,25 +196,11 @@ def insert_file(file: InsertFile) -> str:
         "table.name": FILES_TABLE
     })
     
-    db = boto3.client('dynamodb', region_name=AWS_REGION)
+    db = get_client('dynamodb')
     id = str(ULID())
     
-    res = db.put_item(
-        TableName=FILES_TABLE,
-        Item={
-            "id": {"S": id},
-            "filename": {"S": file.filename},
-            "file_size": {"N": str(file.file_size)},
-            "status": {"S": file.status},
-            "username": {"S": file.username},
-            "columns": {"L": [{"S": col} for col in file.columns]},
-            # data_type is an artificial attribute to "hack" dynamodb 
-            # because its required add a hash key in GlobalSecondaryIndexes
-            "data_type": {"S": "FILE"}, 
-            "creation_datetime": {"S": datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
-            "row_count": {"N": str(file.row_count)},
-        }
-    )
+    res = db.put_item(TableName=FILES_TABLE, Item=file_item(id, file))
+    invalidate_first_pages()
     if res.get('ResponseMetadata', {}).get('HTTPStatusCode') != 200:
         raise Exception("Failed to insert file")
     
@@ -105,6 +208,56 @@ def insert_file(file: InsertFile) -> str:
     return id
 
 
+@tracer.start_as_current_span("insert_files")
+def insert_files(files: List[InsertFile]) -> Tuple[List[str], dict]:
+    """
+        Inserts the files with batch writes, returns the ids of the inserted
+        files and the write stats
+    """
+    span = trace.get_current_span()
+    span.set_attributes({"files.count": len(files), "table.name": FILES_TABLE})
+
+    ids = [str(ULID()) for _ in files]
+    result, failed_items = batch_write_items(
+        FILES_TABLE, [file_item(id, file) for id, file in zip(ids, files)]
+    )
+    invalidate_first_pages()
+
+    failed_ids = {item["id"]["S"] for item in failed_items}
+    return [id for id in ids if id not in failed_ids], result
+
+
+def update_file_expression(file: UpdateFile) -> dict:
+    """ The UpdateExpression and its attributes to set the fields of the file """
+    # #st is a placeholder for status because status is a reserved word
+    updates = ['#st = :status']
+    names = {'#st': 'status'}
+    values = {':status': {'S': file.status}}
+
+    if file.columns is not None:
+        updates.append('#cols = :columns')
+        names['#cols'] = 'columns'
+        values[':columns'] = {"L": [{"S": col} for col in file.columns]}
+    if file.column_types is not None:
+        updates.append('column_types = :column_types')
+        values[':column_types'] = {"L": [{"S": t} for t in file.column_types]}
+    if file.column_max_lengths is not None:
+        updates.append('column_max_lengths = :column_max_lengths')
+        values[':column_max_lengths'] = {"L": [{"N": str(n)} for n in file.column_max_lengths]}
+    if file.row_count is not None:
+        updates.append('row_count = :row_count')
+        values[':row_count'] = {"N": str(file.row_count)}
+    if file.row_count_estimated is not None:
+        updates.append('row_count_estimated = :row_count_estimated')
+        values[':row_count_estimated'] = {"BOOL": file.row_count_estimated}
+
+    return {
+        'UpdateExpression': 'set ' + ', '.join(updates),
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values,
+    }
+
+
 @tracer.start_as_current_span("update_file")
 def update_file(id: str, file: UpdateFile):
     span = trace.get_current_span()
@@ -114,15 +267,13 @@ def update_file(id: str, file: UpdateFile):
         "table.name": FILES_TABLE
     })
 
-    db = boto3.client('dynamodb', region_name=AWS_REGION)
+    db = get_client('dynamodb')
     res = db.update_item(
-        TableName='otel-observability-files',
+        TableName=FILES_TABLE,
         Key={'id': {'S': id}},
-        # #st is a placeholder for status because status is a reserved word
-        UpdateExpression='set #st = :status',
-        ExpressionAttributeNames={'#st': 'status'},
-        ExpressionAttributeValues={':status': {'S': file.status}},
+        **update_file_expression(file),
     )
+    invalidate_first_pages()
     if res.get('ResponseMetadata', {}).get('HTTPStatusCode') != 200:
         raise Exception("Failed to update file")
 
@@ -132,8 +283,10 @@ def delete_file(id: str):
     span = trace.get_current_span()
     span.set_attributes({"table.name": FILES_TABLE, "file.id": id})
 
-    db = boto3.client('dynamodb', region_name=AWS_REGION)
-    return db.delete_item(
+    db = get_client('dynamodb')
+    res = db.delete_item(
         TableName=FILES_TABLE,
         Key={'id': {'S': id}},
     )
+    invalidate_first_pages()
+    return res
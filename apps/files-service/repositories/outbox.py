@@ -0,0 +1,174 @@
+import time
+from typing import List
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+from ulid import ULID
+
+from opentelemetry import trace
+
+from config import FILES_TABLE, OUTBOX_TABLE
+from clients import get_client
+from repositories.files import UpdateFile, update_file_expression, invalidate_first_pages
+
+
+tracer = trace.get_tracer(__name__)
+
+
+@tracer.start_as_current_span("transition_file")
+def transition_file(id: str, file: UpdateFile, queue_filename: str = None):
+    """
+        Updates the file and, when `queue_filename` is given, adds the message
+        to load it into the outbox in the same transaction, so a stored file is
+        always queued. The message is sent by the dispatcher (services/dispatcher.py).
+
+        Parameters:
+            id: id of the file
+            file: fields of the file updated
+            queue_filename: name of the file in the bucket to be loaded
+    """
+    span = trace.get_current_span()
+    span.set_attributes({
+        "file.id": id, "file.status": file.status, "table.name": FILES_TABLE,
+        "outbox.queued": queue_filename is not None,
+    })
+
+    items = [{
+        "Update": {
+            "TableName": FILES_TABLE,
+            "Key": {"id": {"S": id}},
+            "ConditionExpression": "attribute_exists(id)",
+            **update_file_expression(file),
+        }
+    }]
+
+    if queue_filename is not None:
+        span_context = span.get_span_context()
+        items.append({
+            "Put": {
+                "TableName": OUTBOX_TABLE,
+                "Item": {
+                    "id": {"S": str(ULID())},
+                    "file_id": {"S": id},
+                    "file_name": {"S": queue_filename},
+                    # to create a link with the load pipeline
+                    "trace_id": {"S": str(span_context.trace_id)},
+                    "span_id": {"S": str(span_context.span_id)},
+                    # the link is sampled only if the request was (head sampling)
+                    "trace_flags": {"S": str(int(span_context.trace_flags))},
+                    "creation_datetime": {"S": datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
+                },
+            }
+        })
+
+    db = get_client('dynamodb')
+    res = db.transact_write_items(TransactItems=items)
+    invalidate_first_pages()
+    if res.get('ResponseMetadata', {}).get('HTTPStatusCode') != 200:
+        raise Exception("Failed to update file")
+
+
+# max number of actions of a TransactWriteItems request
+TRANSACTION_MAX_ITEMS = 100
+
+
+def get_outbox_messages(limit: int) -> List[dict]:
+    """ Returns up to `limit` messages that no dispatcher has claimed """
+    # without span, it's called on every poll of the dispatcher
+    db = get_client('dynamodb')
+    # the outbox only has the messages not sent yet, so it's always small. The
+    # Limit is applied before the filter, so the pages are read until there are
+    # enough messages, the claimed ones don't hide the rest
+    params = {
+        "TableName": OUTBOX_TABLE,
+        "Limit": limit,
+        "ConsistentRead": True,
+        "FilterExpression": "attribute_not_exists(claimed_until) OR claimed_until < :now",
+        "ExpressionAttributeValues": {":now": {"N": str(int(time.time()))}},
+    }
+
+    messages = []
+    while len(messages) < limit:
+        res = db.scan(**params)
+        messages += [
+            {k: v["S"] for k, v in item.items() if "S" in v}
+            for item in res.get("Items", [])
+        ]
+        if "LastEvaluatedKey" not in res:
+            break
+        params["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+    return messages[:limit]
+
+
+@tracer.start_as_current_span("claim_outbox_messages")
+def claim_outbox_messages(messages: List[dict], seconds: int) -> List[dict]:
+    """
+        Reserves the messages for this replica for `seconds` with conditional
+        writes in a transaction per 100 messages, so every replica of the
+        service can run a dispatcher without sending the same message. Returns
+        the messages claimed, the ones claimed by another replica are skipped.
+    """
+    span = trace.get_current_span()
+    span.set_attributes({"table.name": OUTBOX_TABLE, "messages.count": len(messages)})
+
+    now = int(time.time())
+    db = get_client('dynamodb')
+    claimed = []
+    for i in range(0, len(messages), TRANSACTION_MAX_ITEMS):
+        pending = messages[i:i + TRANSACTION_MAX_ITEMS]
+        while pending:
+            try:
+                db.transact_write_items(TransactItems=[
+                    {
+                        "Update": {
+                            "TableName": OUTBOX_TABLE,
+                            "Key": {"id": {"S": message["id"]}},
+                            "UpdateExpression": "set claimed_until = :until",
+                            # attribute_exists avoids creating a message sent and removed meanwhile
+                            "ConditionExpression": (
+                                "attribute_exists(id)"
+                                " AND (attribute_not_exists(claimed_until) OR claimed_until < :now)"
+                            ),
+                            "ExpressionAttributeValues": {
+                                ":now": {"N": str(now)},
+                                ":until": {"N": str(now + seconds)},
+                            },
+                        }
+                    }
+                    for message in pending
+                ])
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") != "TransactionCanceledException":
+                    raise
+                # the whole transaction is canceled, it's retried without the
+                # messages claimed (or sent) by another replica meanwhile
+                reasons = e.response.get("CancellationReasons", [])
+                remaining = [m for m, r in zip(pending, reasons) if r.get("Code") == "None"]
+                if len(remaining) == len(pending):
+                    raise
+                pending = remaining
+                continue
+
+            claimed += pending
+            break
+
+    span.set_attribute("messages.claimed", len(claimed))
+    return claimed
+
+
+@tracer.start_as_current_span("delete_outbox_messages")
+def delete_outbox_messages(ids: List[str]):
+    """ Removes up to 25 sent messages from the outbox """
+    span = trace.get_current_span()
+    span.set_attributes({"table.name": OUTBOX_TABLE, "messages.count": len(ids)})
+
+    db = get_client('dynamodb')
+    requests = {OUTBOX_TABLE: [{"DeleteRequest": {"Key": {"id": {"S": id}}}} for id in ids]}
+    # the messages left are sent again in the next pass of the dispatcher
+    for _ in range(3):
+        requests = db.batch_write_item(RequestItems=requests).get("UnprocessedItems")
+        if not requests:
+            return
+
+    span.set_attribute("messages.not_deleted", len(requests.get(OUTBOX_TABLE, [])))
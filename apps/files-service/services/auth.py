@@ -1,24 +1,63 @@
-from typing import Tuple
-import requests
+import asyncio
+from typing import Optional, Tuple
+
+import httpx
 from opentelemetry.propagate import inject
 from opentelemetry import trace
 
-from config import AUTH_DOMAIN
+from config import (
+    AUTH_DOMAIN, AUTH_TIMEOUT, AUTH_CONNECT_TIMEOUT, AUTH_MAX_CONNECTIONS,
+    AUTH_MAX_KEEPALIVE_CONNECTIONS, AUTH_MAX_CONCURRENCY, AUTH_HTTP2,
+)
 
 tracer = trace.get_tracer(__name__)
 
+# shared by every request so connections to auth-service are kept alive
+_client: Optional[httpx.AsyncClient] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def get_auth_client() -> httpx.AsyncClient:
+    global _client, _semaphore
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=AUTH_DOMAIN,
+            http2=AUTH_HTTP2,
+            timeout=httpx.Timeout(AUTH_TIMEOUT, connect=AUTH_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=AUTH_MAX_CONNECTIONS,
+                max_keepalive_connections=AUTH_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+        )
+        # limits the validations in flight, the rest wait their turn
+        _semaphore = asyncio.Semaphore(AUTH_MAX_CONCURRENCY)
+    return _client
+
+
+async def close_auth_client():
+    global _client, _semaphore
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        _semaphore = None
+
 
 @tracer.start_as_current_span("validate_token", kind=trace.SpanKind.CLIENT)
-def validate_token(token: str) -> Tuple[bool, dict]:
+async def validate_token(token: str) -> Tuple[bool, dict]:
     headers = {}
     inject(headers)
 
-    res = requests.post(
-        f"{AUTH_DOMAIN}/validate",
-        json={"token": token},
-        headers=headers
-    )
-    if res.status_code != 200:
+    client = get_auth_client()
+    async with _semaphore:
+        res = await client.post(
+            "/validate",
+            json={"token": token},
+            headers=headers
+        )
+    # only a rejected token is a valid answer, the other errors of auth-service
+    # (5xx, 429...) raise so the token cache doesn't store them as invalid
+    if res.status_code in (401, 403):
         return False, None
+    res.raise_for_status()
 
-    return True, res.json()
\ No newline at end of file
+    return True, res.json()
@@ -1,10 +1,11 @@
-from typing import List
+from typing import Dict, List
+from datetime import datetime, timedelta, timezone
 
-import boto3
 from pydantic import BaseModel
 from opentelemetry import trace
 
-from config import AWS_REGION, SQS_QUEUE_URL, BUCKET_NAME
+from config import SQS_QUEUE_URL, BUCKET_NAME
+from clients import get_client
 
 
 tracer = trace.get_tracer("files-service")
@@ -22,7 +23,7 @@ def init_upload(filename: str) -> str:
         "bucket.name": BUCKET_NAME,
     })
 
-    s3 = boto3.client('s3', region_name=AWS_REGION)
+    s3 = get_client('s3')
 
     response = s3.create_multipart_upload(
         Bucket=BUCKET_NAME,
@@ -33,16 +34,8 @@ def init_upload(filename: str) -> str:
     return id
 
 
-@tracer.start_as_current_span("get_presigned_url") 
-def get_presigned_url(filename: str, upload_id: str, part_number: int) -> str:
-    span = trace.get_current_span()
-    span.set_attributes({
-        "file.name": filename, "bucket.name": BUCKET_NAME,
-        "upload.id": upload_id, "file.part_number": part_number, 
-    })
-
-    s3 = boto3.client('s3', region_name=AWS_REGION)
-
+def _sign_upload_part(s3, filename: str, upload_id: str, part_number: int) -> str:
+    # signing is done locally, it doesn't make any request to s3
     return s3.generate_presigned_url(
         'upload_part',
         Params={
@@ -55,6 +48,38 @@ def get_presigned_url(filename: str, upload_id: str, part_number: int) -> str:
     )
 
 
+@tracer.start_as_current_span("get_presigned_url") 
+def get_presigned_url(filename: str, upload_id: str, part_number: int) -> str:
+    span = trace.get_current_span()
+    span.set_attributes({
+        "file.name": filename, "bucket.name": BUCKET_NAME,
+        "upload.id": upload_id, "file.part_number": part_number, 
+    })
+
+    s3 = get_client('s3')
+
+    return _sign_upload_part(s3, filename, upload_id, part_number)
+
+
+@tracer.start_as_current_span("get_presigned_urls")
+def get_presigned_urls(
+    filename: str, upload_id: str, part_numbers: List[int]
+) -> Dict[int, str]:
+    span = trace.get_current_span()
+    span.set_attributes({
+        "file.name": filename, "bucket.name": BUCKET_NAME, "upload.id": upload_id,
+        "parts.count": len(part_numbers),
+        "parts.first": min(part_numbers), "parts.last": max(part_numbers),
+    })
+
+    s3 = get_client('s3')
+
+    return {
+        part_number: _sign_upload_part(s3, filename, upload_id, part_number)
+        for part_number in part_numbers
+    }
+
+
 @tracer.start_as_current_span("complete_upload") 
 def complete_upload(filename: str, upload_id: str, parts: List[FilePart]):
     span = trace.get_current_span()
@@ -62,7 +87,7 @@ def complete_upload(filename: str, upload_id: str, parts: List[FilePart]):
         "file.name": filename, "bucket.name": BUCKET_NAME, "upload.id": upload_id,
     })
 
-    s3 = boto3.client('s3', region_name=AWS_REGION)
+    s3 = get_client('s3')
 
     s3.complete_multipart_upload(
         Bucket=BUCKET_NAME,
@@ -72,43 +97,123 @@ def complete_upload(filename: str, upload_id: str, parts: List[FilePart]):
     )
 
 
+@tracer.start_as_current_span("abort_upload") 
+def abort_upload(filename: str, upload_id: str):
+    span = trace.get_current_span()
+    span.set_attributes({
+        "file.name": filename, "bucket.name": BUCKET_NAME, "upload.id": upload_id,
+    })
+
+    s3 = get_client('s3')
+
+    # the parts already uploaded are deleted too
+    s3.abort_multipart_upload(Bucket=BUCKET_NAME, Key=filename, UploadId=upload_id)
+
+
+@tracer.start_as_current_span("list_parts") 
+def list_parts(filename: str, upload_id: str) -> List[dict]:
+    """ Returns the parts already uploaded, with their PartNumber, ETag and Size """
+    span = trace.get_current_span()
+    span.set_attributes({
+        "file.name": filename, "bucket.name": BUCKET_NAME, "upload.id": upload_id,
+    })
+
+    s3 = get_client('s3')
+
+    # s3 returns up to 1000 parts per page
+    parts = []
+    for page in s3.get_paginator('list_parts').paginate(
+        Bucket=BUCKET_NAME, Key=filename, UploadId=upload_id,
+    ):
+        parts.extend(
+            {"PartNumber": p["PartNumber"], "ETag": p["ETag"], "Size": p["Size"]}
+            for p in page.get("Parts", [])
+        )
+
+    span.set_attribute("parts.count", len(parts))
+    return parts
+
+
+@tracer.start_as_current_span("list_stale_uploads") 
+def list_stale_uploads(max_age: timedelta) -> List[dict]:
+    """ Returns the Key and UploadId of the multipart uploads started before max_age """
+    span = trace.get_current_span()
+    span.set_attributes({"bucket.name": BUCKET_NAME, "uploads.max_age": max_age.total_seconds()})
+
+    s3 = get_client('s3')
+
+    oldest = datetime.now(timezone.utc) - max_age
+    uploads = []
+    for page in s3.get_paginator('list_multipart_uploads').paginate(Bucket=BUCKET_NAME):
+        uploads.extend(
+            {"Key": u["Key"], "UploadId": u["UploadId"]}
+            for u in page.get("Uploads", [])
+            if u["Initiated"] < oldest
+        )
+
+    span.set_attribute("uploads.count", len(uploads))
+    return uploads
+
+
 def list_multipart_uploads() -> list[str]:
-    s3 = boto3.client('s3', region_name=AWS_REGION)
+    s3 = get_client('s3')
 
     return s3.list_multipart_uploads(Bucket=BUCKET_NAME)
 
 
-@tracer.start_as_current_span("queue_uploaded_file") 
-def queue_uploaded_file(file_id: str, file_name: str):
+# max number of messages of a SendMessageBatch request
+SQS_BATCH_SIZE = 10
+
+
+@tracer.start_as_current_span("queue_uploaded_files") 
+def queue_uploaded_files(messages: List[dict]) -> List[str]:
+    """
+        Sends up to 10 messages of the outbox to the queue with a single request,
+        returns the ids of the messages sent
+
+        Parameters:
+            messages: outbox messages, with id, file_id, file_name, trace_id and span_id
+    """
     span = trace.get_current_span()
     span.set_attributes({
-        "file.id": file_id, "file.name": file_name, "queue.url": SQS_QUEUE_URL,
+        "file.ids": [m["file_id"] for m in messages],
+        "queue.url": SQS_QUEUE_URL, "messages.count": len(messages),
     })
 
-    sqs = boto3.client('sqs', region_name=AWS_REGION)
-    res = sqs.send_message(
+    sqs = get_client('sqs')
+    res = sqs.send_message_batch(
         QueueUrl=SQS_QUEUE_URL,
-        MessageBody="file uploaded",
-        MessageAttributes={
-            "file_id": {
-                "DataType": "String",
-                "StringValue": file_id,
-            },
-            "file_name": {
-                "DataType": "String",
-                "StringValue": file_name,
-            },
-            # attributes to create a link with the load pipeline
-            "trace_id": {
-                "DataType": "String",
-                "StringValue": str(span.get_span_context().trace_id),
-            },
-            "span_id": {
-                "DataType": "String",
-                "StringValue": str(span.get_span_context().span_id),
+        Entries=[{
+            "Id": m["id"],
+            "MessageBody": "file uploaded",
+            "MessageAttributes": {
+                "file_id": {
+                    "DataType": "String",
+                    "StringValue": m["file_id"],
+                },
+                "file_name": {
+                    "DataType": "String",
+                    "StringValue": m["file_name"],
+                },
+                # attributes to create a link with the load pipeline
+                "trace_id": {
+                    "DataType": "String",
+                    "StringValue": m["trace_id"],
+                },
+                "span_id": {
+                    "DataType": "String",
+                    "StringValue": m["span_id"],
+                }
             }
-        }
+        } for m in messages],
     )
     if res.get('ResponseMetadata', {}).get('HTTPStatusCode') != 200:
-        raise Exception("Failed to queue uploaded file")
-    return res.get('MessageId')
+        raise Exception("Failed to queue uploaded files")
+
+    failed = res.get("Failed", [])
+    if failed:
+        span.set_status(trace.StatusCode.ERROR)
+        span.set_attribute("messages.failed", len(failed))
+        print("failed to queue messages:", failed)
+
+    return [entry["Id"] for entry in res.get("Successful", [])]
@@ -0,0 +1,107 @@
+import asyncio
+from typing import Optional
+
+from opentelemetry import trace
+from opentelemetry.instrumentation.utils import suppress_instrumentation
+
+from aws_io import run_io
+from repositories.outbox import (
+    get_outbox_messages, claim_outbox_messages, delete_outbox_messages,
+)
+from services.aws import queue_uploaded_files, SQS_BATCH_SIZE
+from config import OUTBOX_POLL_INTERVAL, OUTBOX_READ_LIMIT, OUTBOX_CLAIM_SECONDS
+
+tracer = trace.get_tracer(__name__)
+
+
+class OutboxDispatcher:
+    """
+        Sends the messages of the outbox to the queue in batches of 10 and
+        removes them from the outbox. It runs in the background of the service,
+        checking the outbox every `poll_interval` seconds or right away when
+        notified of a new message.
+
+        Every replica of the service runs a dispatcher, a message is claimed
+        with a conditional write before sending it so only one of them sends
+        it, and the others only read the messages not claimed. A message is sent at least once, if the service stops after
+        sending it but before removing it, it's sent again once its claim
+        expires.
+    """
+
+    def __init__(self, poll_interval: float, read_limit: int, claim_seconds: int):
+        self.poll_interval = poll_interval
+        self.read_limit = read_limit
+        self.claim_seconds = claim_seconds
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        """ There are new messages in the outbox """
+        self._wake.set()
+
+    def dispatch(self) -> int:
+        """ Sends the messages of the outbox, returns the number of messages sent """
+        # the outbox is usually empty, its polls aren't traced
+        with suppress_instrumentation():
+            messages = get_outbox_messages(self.read_limit)
+        if not messages:
+            return 0
+
+        # linked with the requests that stored the files
+        links = [
+            trace.Link(trace.SpanContext(
+                trace_id=int(m["trace_id"]), span_id=int(m["span_id"]), is_remote=True,
+                # the messages written before the flags were stored are not sampled
+                trace_flags=trace.TraceFlags(int(m.get("trace_flags", "0"))),
+            ))
+            for m in messages
+        ]
+        with tracer.start_as_current_span("dispatch_outbox", links=links) as span:
+            span.set_attribute("messages.count", len(messages))
+
+            messages = claim_outbox_messages(messages, self.claim_seconds)
+            sent = 0
+            for i in range(0, len(messages), SQS_BATCH_SIZE):
+                ids = queue_uploaded_files(messages[i:i + SQS_BATCH_SIZE])
+                if ids:
+                    delete_outbox_messages(ids)
+                sent += len(ids)
+
+            span.set_attribute("messages.sent", sent)
+            return sent
+
+    async def run(self):
+        while True:
+            self._wake.clear()
+            try:
+                sent = await run_io(self.dispatch)
+            except Exception as e:
+                print("failed to dispatch the outbox:", e)
+                sent = 0
+
+            # a full read means there are more messages waiting
+            if sent >= self.read_limit:
+                continue
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+outbox_dispatcher = OutboxDispatcher(
+    poll_interval=OUTBOX_POLL_INTERVAL,
+    read_limit=OUTBOX_READ_LIMIT,
+    claim_seconds=OUTBOX_CLAIM_SECONDS,
+)
@@ -0,0 +1,215 @@
+import csv
+import re
+from typing import List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from pydantic import BaseModel
+from botocore.exceptions import ClientError
+from opentelemetry import trace, context
+
+from config import BUCKET_NAME, PROFILE_CHUNK_BYTES, PROFILE_SAMPLES
+from clients import get_client
+
+
+tracer = trace.get_tracer("files-service")
+
+# the header is looked for in the first bytes, growing up to this limit
+MAX_HEADER_BYTES = 1024 * 1024
+
+
+class CsvProfile(BaseModel):
+    file_size: int
+    columns: List[str]
+    column_types: List[str]
+    # bytes of the longest value of every column in the profiled rows
+    column_max_lengths: List[int]
+    row_count: int
+    row_count_estimated: bool
+
+
+# the types are the ones of the redshift tables of the load pipeline, so the
+# values with leading zeros (e.g. codes like 007) are strings and the integers
+# of more than 18 digits, which don't fit a BIGINT, are decimals
+_INTEGER = re.compile(r"^[+-]?(0|[1-9]\d{0,17})$")
+_DECIMAL = re.compile(r"^[+-]?((0|[1-9]\d*)(\.\d*)?|\.\d+)([eE][+-]?\d+)?$")
+_BOOLEAN = {"true", "false", "t", "f", "yes", "no"}
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?$")
+
+
+def _value_type(value: str) -> Optional[str]:
+    if value == "":
+        return None  # empty values fit in any type
+    if value.lower() in _BOOLEAN:
+        return "boolean"
+    if _INTEGER.match(value):
+        return "integer"
+    if _DECIMAL.match(value):
+        return "decimal"
+    if _DATE.match(value):
+        return "date"
+    if _TIMESTAMP.match(value):
+        return "timestamp"
+    return "string"
+
+
+def _merge_types(current: Optional[str], new: Optional[str]) -> Optional[str]:
+    if current is None or current == new:
+        return new or current
+    if new is None:
+        return current
+    if {current, new} == {"integer", "decimal"}:
+        return "decimal"
+    if {current, new} == {"date", "timestamp"}:
+        return "timestamp"
+    return "string"
+
+
+def infer_column_types(column_count: int, rows: List[List[str]]) -> List[str]:
+    types = [None] * column_count
+    for row in rows:
+        for i, value in enumerate(row[:column_count]):
+            types[i] = _merge_types(types[i], _value_type(value.strip()))
+    # columns without values in the sample are treated as strings
+    return [t or "string" for t in types]
+
+
+def measure_column_lengths(column_count: int, rows: List[List[str]]) -> List[int]:
+    lengths = [0] * column_count
+    for row in rows:
+        for i, value in enumerate(row[:column_count]):
+            lengths[i] = max(lengths[i], len(value.encode()))
+    return lengths
+
+
+def _get_range(filename: str, start: int, end: int) -> Tuple[bytes, int]:
+    """ Returns the bytes from start to end (exclusive) and the size of the object """
+    s3 = get_client('s3')
+    res = s3.get_object(Bucket=BUCKET_NAME, Key=filename, Range=f"bytes={start}-{end - 1}")
+    # e.g. "bytes 0-65535/1048576"
+    file_size = int(res["ContentRange"].rsplit("/", 1)[1])
+    return res["Body"].read(), file_size
+
+
+def _read_range(filename: str, start: int, end: int) -> bytes:
+    return _get_range(filename, start, end)[0]
+
+
+def _read_header(filename: str) -> Tuple[bytes, bytes, int]:
+    """
+        Returns the header line, the rest of the bytes read with it
+        and the size of the file
+    """
+    size = PROFILE_CHUNK_BYTES
+    while True:
+        try:
+            head, file_size = _get_range(filename, 0, size)
+        except ClientError as e:
+            # ranges can't be read from empty objects
+            if e.response.get("Error", {}).get("Code") == "InvalidRange":
+                return b"", b"", 0
+            raise
+
+        newline = head.find(b"\n")
+        if newline != -1:
+            return head[:newline + 1], head[newline + 1:], file_size
+        if size >= file_size or size >= MAX_HEADER_BYTES:
+            return head, b"", file_size
+        size = min(size * 2, MAX_HEADER_BYTES)
+
+
+def _complete_lines(chunk: bytes, starts_at_line: bool, is_last: bool) -> bytes:
+    # drop the partial lines at the edges of the chunk
+    if not starts_at_line:
+        newline = chunk.find(b"\n")
+        chunk = chunk[newline + 1:] if newline != -1 else b""
+    if not is_last:
+        newline = chunk.rfind(b"\n")
+        chunk = chunk[:newline + 1] if newline != -1 else b""
+    return chunk
+
+
+def _parse_rows(data: bytes) -> List[List[str]]:
+    lines = data.decode("utf-8", errors="replace").splitlines()
+    return [row for row in csv.reader(lines) if row]
+
+
+@tracer.start_as_current_span("profile_csv")
+def profile_csv(filename: str) -> CsvProfile:
+    """
+        Reads the header and a few chunks spread over the object in s3 to get
+        the columns, their types and max lengths and the number of rows of a
+        csv file, using constant memory no matter its size.
+
+        The row count is exact for files that fit in the sampled chunks,
+        otherwise it's estimated from the average size of the sampled rows.
+    """
+    span = trace.get_current_span()
+    span.set_attributes({"file.name": filename, "bucket.name": BUCKET_NAME})
+
+    header, rest, file_size = _read_header(filename)
+    span.set_attribute("file.size", file_size)
+    columns = [c.strip() for c in next(csv.reader([header.decode("utf-8-sig")]), [])]
+    body_start = len(header)
+    body_size = file_size - body_start
+
+    read_until = body_start + len(rest)
+    remaining = file_size - read_until
+
+    if remaining <= PROFILE_SAMPLES * PROFILE_CHUNK_BYTES:
+        # small enough to be read entirely
+        if remaining > 0:
+            rest += _read_range(filename, read_until, file_size)
+        rows = _parse_rows(rest)
+        sampled_bytes = len(rest)
+        estimated = False
+    else:
+        # chunks evenly spread over the body, the first one continues the header
+        step = remaining // PROFILE_SAMPLES
+        ranges = [
+            (read_until + i * step, read_until + i * step + PROFILE_CHUNK_BYTES)
+            for i in range(PROFILE_SAMPLES)
+        ]
+        # the s3 spans of the worker threads must be children of this span
+        ctx = context.get_current()
+
+        def read_chunk(r):
+            token = context.attach(ctx)
+            try:
+                return _read_range(filename, *r)
+            finally:
+                context.detach(token)
+
+        with ThreadPoolExecutor(max_workers=PROFILE_SAMPLES) as pool:
+            chunks = list(pool.map(read_chunk, ranges))
+        chunks[0] = rest + chunks[0]
+
+        rows, sampled_bytes = [], 0
+        for i, chunk in enumerate(chunks):
+            lines = _complete_lines(chunk, starts_at_line=i == 0, is_last=False)
+            rows.extend(_parse_rows(lines))
+            sampled_bytes += len(lines)
+
+        estimated = True
+
+    if estimated and rows:
+        row_count = round(body_size / (sampled_bytes / len(rows)))
+    else:
+        row_count = len(rows)
+
+    profile = CsvProfile(
+        file_size=file_size,
+        columns=columns,
+        column_types=infer_column_types(len(columns), rows),
+        column_max_lengths=measure_column_lengths(len(columns), rows),
+        row_count=row_count,
+        row_count_estimated=estimated,
+    )
+
+    span.set_attributes({
+        "file.columns": profile.columns, "file.column_types": profile.column_types,
+        "file.column_max_lengths": profile.column_max_lengths,
+        "file.rows": profile.row_count, "file.rows_estimated": profile.row_count_estimated,
+        "profile.sampled_rows": len(rows), "profile.sampled_bytes": sampled_bytes,
+    })
+    return profile
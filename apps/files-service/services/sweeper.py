@@ -0,0 +1,64 @@
+import asyncio
+from typing import Optional
+from datetime import timedelta
+
+from botocore.exceptions import ClientError
+from opentelemetry import trace
+
+from aws_io import run_io
+from services.aws import list_stale_uploads, abort_upload
+from config import STALE_UPLOAD_AGE, UPLOAD_SWEEP_INTERVAL
+
+tracer = trace.get_tracer(__name__)
+
+
+class UploadSweeper:
+    """
+        Aborts the multipart uploads older than `max_age` seconds, the parts of
+        an upload that is never completed are stored (and paid) until it's
+        aborted. It runs in the background of the service every `interval` seconds.
+    """
+
+    def __init__(self, max_age: float, interval: float):
+        self.max_age = timedelta(seconds=max_age)
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    @tracer.start_as_current_span("sweep_uploads")
+    def sweep(self) -> int:
+        """ Aborts the stale uploads, returns the number of aborted uploads """
+        span = trace.get_current_span()
+
+        aborted = 0
+        for upload in list_stale_uploads(self.max_age):
+            try:
+                abort_upload(upload["Key"], upload["UploadId"])
+                aborted += 1
+            except ClientError as e:
+                # e.g. completed or aborted by another instance meanwhile
+                print("failed to abort upload:", upload["UploadId"], e)
+
+        span.set_attribute("uploads.aborted", aborted)
+        return aborted
+
+    async def run(self):
+        while True:
+            try:
+                await run_io(self.sweep)
+            except Exception as e:
+                print("failed to sweep the uploads:", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+upload_sweeper = UploadSweeper(max_age=STALE_UPLOAD_AGE, interval=UPLOAD_SWEEP_INTERVAL)
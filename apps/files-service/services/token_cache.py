@@ -0,0 +1,101 @@
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from opentelemetry import trace, metrics
+
+
+meter = metrics.get_meter(__name__)
+
+cache_hits = meter.create_counter(
+    "token_cache.hits", description="Token validations served from the cache"
+)
+cache_misses = meter.create_counter(
+    "token_cache.misses", description="Token validations sent to auth-service"
+)
+cache_evictions = meter.create_counter(
+    "token_cache.evictions", description="Tokens evicted because the cache was full"
+)
+
+ValidationResult = Tuple[bool, Optional[dict]]
+
+
+class TokenCache:
+    """
+        LRU cache with TTL for the result of validating a token.
+
+        Valid tokens live `ttl` seconds and invalid ones `negative_ttl` seconds,
+        concurrent misses of the same token share a single call to the loader.
+        When the loader raises nothing is cached, so a failure of auth-service
+        is not remembered as an invalid token.
+    """
+
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # token -> (expires_at, result), the most recently used at the end
+        self._items: OrderedDict[str, Tuple[float, ValidationResult]] = OrderedDict()
+        # token -> result of the call in progress
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _get(self, token: str) -> Optional[ValidationResult]:
+        entry = self._items.get(token)
+        if entry is None:
+            return None
+
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del self._items[token]
+            return None
+
+        self._items.move_to_end(token)
+        return result
+
+    def _set(self, token: str, result: ValidationResult):
+        ok, _ = result
+        ttl = self.ttl if ok else self.negative_ttl
+        self._items[token] = (time.monotonic() + ttl, result)
+        self._items.move_to_end(token)
+
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            cache_evictions.add(1)
+
+    async def get_or_load(
+        self, token: str, load: Callable[[str], Awaitable[ValidationResult]]
+    ) -> ValidationResult:
+        span = trace.get_current_span()
+
+        result = self._get(token)
+        if result is not None:
+            cache_hits.add(1)
+            span.set_attribute("token_cache.hit", True)
+            return result
+
+        span.set_attribute("token_cache.hit", False)
+
+        future = self._inflight.get(token)
+        if future is not None:
+            # another request is already validating this token
+            span.set_attribute("token_cache.coalesced", True)
+            return await asyncio.shield(future)
+
+        cache_misses.add(1)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[token] = future
+        try:
+            result = await load(token)
+        except Exception as e:
+            future.set_exception(e)
+            # mark it as retrieved to avoid warnings when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[token]
+
+        self._set(token, result)
+        future.set_result(result)
+        span.set_attribute("token_cache.size", len(self._items))
+        return result
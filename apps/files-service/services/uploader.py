@@ -0,0 +1,358 @@
+"""
+    Uploads a local file or stdin to the bucket with a multipart upload sent
+    from the server, the same protocol that the browser follows: the parts are
+    sent in parallel to presigned urls and the upload is completed with their
+    ETags. The file is registered and queued to be loaded like the uploads
+    of the browser.
+
+    Run it from apps/files-service:
+
+        python -m services.uploader data.csv --username me
+        cat data.csv | python -m services.uploader - --filename data.csv --username me
+
+    A failed upload is resumed sending only its missing parts:
+
+        python -m services.uploader data.csv --username me --upload-id <upload id>
+"""
+import os
+import sys
+import mmap
+import stat
+import time
+import queue
+import random
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import httpx
+from pydantic import BaseModel
+from opentelemetry import trace, context as otel_context
+
+from config import UPLOAD_PART_SIZE, UPLOAD_CONCURRENCY, UPLOAD_MAX_ATTEMPTS
+from services.aws import (
+    init_upload, get_presigned_url, complete_upload, list_parts, FilePart,
+)
+
+tracer = trace.get_tracer("files-service")
+
+# s3 limits of the multipart uploads
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+# the parts are sent in pieces of this size, so only a piece of every part in
+# progress is copied from the mmap at a time
+SEND_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadResult(BaseModel):
+    upload_id: str
+    file_size: int
+    parts: int
+    retries: int
+    seconds: float
+    mb_per_second: float
+
+
+def _chunks(view: memoryview) -> Iterator[bytes]:
+    for i in range(0, len(view), SEND_CHUNK_SIZE):
+        yield bytes(view[i:i + SEND_CHUNK_SIZE])
+
+
+def _is_regular_file(source: BinaryIO) -> bool:
+    try:
+        return stat.S_ISREG(os.fstat(source.fileno()).st_mode)
+    except (OSError, ValueError, AttributeError):
+        # e.g. io.BytesIO doesn't have a file descriptor
+        return False
+
+
+# the parts are (view of the part, function called once it's uploaded)
+Parts = Iterator[Tuple[memoryview, Callable]]
+
+
+@contextmanager
+def _mmap_parts(file: BinaryIO, part_size: int) -> Iterator[Parts]:
+    """
+        Parts of a regular file, read from the memory mapped file. The file
+        is unmapped on exit, when every part must be already uploaded.
+    """
+    size = os.fstat(file.fileno()).st_size
+    if size == 0:
+        yield iter([(memoryview(b""), lambda: None)])
+        return
+    if size > part_size * MAX_PARTS:
+        raise Exception(f"the file needs more than {MAX_PARTS} parts, increase the part size")
+
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+
+        def parts():
+            for start in range(0, size, part_size):
+                part = view[start:start + part_size]
+                yield part, part.release
+
+        try:
+            yield parts()
+        finally:
+            view.release()
+
+
+@contextmanager
+def _stream_parts(stream: BinaryIO, part_size: int, buffers: int) -> Iterator[Parts]:
+    """
+        Parts of a stream (e.g. stdin), read into a pool of `buffers` buffers
+        that are reused once their part is uploaded, so the memory is bounded
+    """
+    pool = queue.Queue()
+    for _ in range(buffers):
+        pool.put(bytearray(part_size))
+
+    def parts():
+        first = True
+        while True:
+            # waits for a part to be uploaded when every buffer is in use
+            buffer = pool.get()
+            view = memoryview(buffer)
+
+            size = 0
+            while size < part_size:
+                read = stream.readinto(view[size:])
+                if not read:
+                    break
+                size += read
+
+            if size == 0 and not first:
+                return
+
+            first = False
+            yield view[:size], lambda b=buffer: pool.put(b)
+            if size < part_size:
+                return
+
+    yield parts()
+
+
+class MultipartUploader:
+    """
+        Sends the parts of a multipart upload to presigned urls with
+        `concurrency` parts in progress, retrying every part up to
+        `max_attempts` times.
+    """
+
+    def __init__(
+        self,
+        part_size: int = UPLOAD_PART_SIZE,
+        concurrency: int = UPLOAD_CONCURRENCY,
+        max_attempts: int = UPLOAD_MAX_ATTEMPTS,
+    ):
+        if part_size < MIN_PART_SIZE:
+            raise Exception(f"the part size must be at least {MIN_PART_SIZE} bytes")
+
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self._retries = 0
+        self._lock = threading.Lock()
+
+    def _upload_part(
+        self, ctx, http: httpx.Client, filename: str, upload_id: str,
+        part_number: int, view: memoryview, release: Callable,
+    ) -> FilePart:
+        token = otel_context.attach(ctx)
+        try:
+            url = get_presigned_url(filename, upload_id, part_number)
+
+            for attempt in range(self.max_attempts):
+                if attempt > 0:
+                    with self._lock:
+                        self._retries += 1
+                    time.sleep(random.uniform(0, min(10, 0.5 * 2 ** attempt)))
+
+                try:
+                    res = http.put(
+                        url, content=_chunks(view),
+                        headers={"Content-Length": str(len(view))},
+                    )
+                except httpx.TransportError as e:
+                    print(f"part {part_number} failed:", e)
+                    continue
+
+                # s3 errors 5xx and throttling are retried, the others won't succeed
+                if res.status_code == 200:
+                    return FilePart(PartNumber=part_number, ETag=res.headers["ETag"])
+                if res.status_code < 500 and res.status_code != 429:
+                    break
+                print(f"part {part_number} failed:", res.status_code)
+
+            raise Exception(f"failed to upload part {part_number}")
+        finally:
+            release()
+            otel_context.detach(token)
+
+    @tracer.start_as_current_span("multipart_upload")
+    def upload(
+        self, source: BinaryIO, filename: str, upload_id: str = None
+    ) -> UploadResult:
+        """
+            Uploads a file or a stream to the bucket, if a part fails the
+            upload can be resumed with its id
+
+            Parameters:
+                source: binary file or stream, regular files are memory mapped
+                filename: key of the file in the bucket
+                upload_id: upload to resume, only its missing parts are sent
+        """
+        span = trace.get_current_span()
+        span.set_attributes({
+            "file.name": filename, "upload.part_size": self.part_size,
+            "upload.concurrency": self.concurrency,
+        })
+
+        if _is_regular_file(source):
+            open_parts = _mmap_parts(source, self.part_size)
+        else:
+            # a buffer per part in progress and one more being read
+            open_parts = _stream_parts(source, self.part_size, self.concurrency + 1)
+
+        self._retries = 0
+        start = time.perf_counter()
+        uploaded = {}
+        if upload_id is None:
+            upload_id = init_upload(filename)
+        else:
+            uploaded = {p["PartNumber"]: p for p in list_parts(filename, upload_id)}
+        span.set_attributes({"upload.id": upload_id, "parts.resumed": len(uploaded)})
+
+        ctx = otel_context.get_current()
+        file_size = 0
+        futures: List[Future] = []
+        failed = threading.Event()
+        limits = httpx.Limits(max_connections=self.concurrency)
+        try:
+            # the pool waits for the parts in progress before the parts are closed
+            with open_parts as parts, httpx.Client(limits=limits, timeout=60) as http, \
+                    ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                for part_number, (view, release) in enumerate(parts, start=1):
+                    if part_number > MAX_PARTS:
+                        release()
+                        raise Exception(f"the stream needs more than {MAX_PARTS} parts")
+
+                    file_size += len(view)
+
+                    # a part of the same size was already uploaded
+                    done = uploaded.get(part_number)
+                    if done is not None and done["Size"] == len(view):
+                        release()
+                        future = Future()
+                        future.set_result(FilePart(PartNumber=part_number, ETag=done["ETag"]))
+                        futures.append(future)
+                        continue
+
+                    future = pool.submit(
+                        self._upload_part, ctx, http, filename, upload_id,
+                        part_number, view, release,
+                    )
+                    future.add_done_callback(lambda f: f.exception() and failed.set())
+                    futures.append(future)
+
+                    # stops reading as soon as a part fails
+                    if failed.is_set():
+                        break
+
+                file_parts = [f.result() for f in futures]
+
+            complete_upload(filename, upload_id, file_parts)
+        except Exception as e:
+            span.record_exception(e)
+            span.set_status(trace.StatusCode.ERROR)
+            # the parts uploaded are kept to resume it, the sweeper aborts it if it's not
+            print("upload failed, resume it with --upload-id", upload_id)
+            raise
+
+        seconds = time.perf_counter() - start
+        result = UploadResult(
+            upload_id=upload_id,
+            file_size=file_size,
+            parts=len(file_parts),
+            retries=self._retries,
+            seconds=round(seconds, 3),
+            mb_per_second=round(file_size / 1024 / 1024 / seconds, 2),
+        )
+        span.set_attributes({
+            "file.size": file_size, "parts.count": result.parts,
+            "upload.retries": result.retries,
+        })
+        return result
+
+
+def ingest_file(
+    source: BinaryIO, filename: str, username: str,
+    uploader: Optional[MultipartUploader] = None, upload_id: str = None,
+) -> Tuple[str, UploadResult]:
+    """
+        Uploads the file, profiles it and queues it to be loaded, as it's done
+        with the uploads of the browser. Returns the id of the file and the
+        upload stats.
+    """
+    # imported here so the uploader can be used without dynamodb
+    from repositories.files import insert_file, InsertFile, UpdateFile
+    from repositories.outbox import transition_file
+    from services.profiling import profile_csv
+
+    uploader = uploader or MultipartUploader()
+    result = uploader.upload(source, filename, upload_id)
+
+    file_id = insert_file(InsertFile(
+        filename=filename, file_size=result.file_size, username=username,
+    ))
+    profile = profile_csv(filename)
+    # the dispatcher of the running service sends the message to the queue
+    transition_file(file_id, UpdateFile(
+        status="stored",
+        columns=profile.columns,
+        column_types=profile.column_types,
+        column_max_lengths=profile.column_max_lengths,
+        row_count=profile.row_count,
+        row_count_estimated=profile.row_count_estimated,
+    ), queue_filename=filename)
+
+    return file_id, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload a csv file to be loaded")
+    parser.add_argument("path", help="file to upload, - for stdin")
+    parser.add_argument("--filename", help="name of the file in the bucket, required with stdin")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--part-size-mb", type=int, default=UPLOAD_PART_SIZE // 1024 // 1024)
+    parser.add_argument("--concurrency", type=int, default=UPLOAD_CONCURRENCY)
+    parser.add_argument("--max-attempts", type=int, default=UPLOAD_MAX_ATTEMPTS)
+    parser.add_argument("--upload-id", help="resume this upload sending only its missing parts")
+    args = parser.parse_args()
+
+    if args.path == "-" and not args.filename:
+        parser.error("--filename is required to upload stdin")
+
+    uploader = MultipartUploader(
+        part_size=args.part_size_mb * 1024 * 1024,
+        concurrency=args.concurrency,
+        max_attempts=args.max_attempts,
+    )
+    filename = args.filename or os.path.basename(args.path)
+
+    if args.path == "-":
+        file_id, result = ingest_file(
+            sys.stdin.buffer, filename, args.username, uploader, args.upload_id
+        )
+    else:
+        with open(args.path, "rb") as f:
+            file_id, result = ingest_file(f, filename, args.username, uploader, args.upload_id)
+
+    print("file_id:", file_id)
+    print(result.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
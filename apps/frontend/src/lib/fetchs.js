@@ -13,7 +13,8 @@ export async function fetchWithSpan(spanName, url, options) {
 
       const res = await fetch(url, { ...options, headers });
       if (!res.ok) {
-        throw new Error(await res.text())
+        // the status lets the callers retry some errors, e.g. an expired url
+        throw Object.assign(new Error(await res.text()), { status: res.status })
       }
 
       span.end()
@@ -2,13 +2,22 @@ export function formatFileSize(size) {
   return `${(size / 1024 / 1024).toFixed(2)} MB`;
 }
 
+// only the beginning of the file is read, the server profiles the whole file after the upload
+const HEAD_SIZE = 64 * 1024;
+
 export function getCsvHeadersColumns(file, onSuccess) {
+  const head = file.slice(0, HEAD_SIZE);
   const reader = new FileReader();
   reader.onload = (e) => {
     const text = e.target.result;
-    const firstLine = text.split('\n')[0];
-    const headers = firstLine.split(',').map(header => header.trim());
-    const rowCount = text.split('\n').length - 1; // -1 to exclude header row
+    const lines = text.split('\n');
+    const headers = lines[0].split(',').map(header => header.trim());
+    // estimated from the size in bytes of the lines read, excluding the header
+    // row (the text length counts characters, some take several bytes)
+    const headerSize = new TextEncoder().encode(lines[0]).length + 1;
+    const rowCount = file.size <= HEAD_SIZE
+      ? lines.length - 1
+      : Math.round((file.size - headerSize) / ((head.size - headerSize) / (lines.length - 1)));
     console.log('Number of rows:', rowCount);
     console.log('CSV Headers:', headers);
     onSuccess(headers, rowCount);
@@ -16,5 +25,5 @@ export function getCsvHeadersColumns(file, onSuccess) {
   reader.onerror = (e) => {
     console.error('Error reading file:', e);
   };
-  reader.readAsText(file);
+  reader.readAsText(head);
 }
\ No newline at end of file
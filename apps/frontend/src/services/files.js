@@ -4,6 +4,11 @@ import { API_DOMAIN } from "../lib/config";
 import { fetchWithSpan } from "../lib/fetchs";
 
 export const DEFAULT_PART_SIZE = 5;
+// parts signed by every request of presigned urls, they are requested as the upload progresses
+const URLS_WINDOW_SIZE = 20;
+// the urls expire after 1 hour (files-service services/aws.py), they are signed
+// again when they are older than this
+const URLS_MAX_AGE_MS = 50 * 60 * 1000;
 
 
 const tracer = trace.getTracer("frontend")
@@ -30,6 +35,30 @@ export async function uploadFileByParts({ file, columns, rowCount }, { batchSize
     const totalParts = Math.ceil(file.size / partSizeInMB);
     const partResults = [];
 
+    // the urls of a window of parts are signed together the first time one of
+    // its parts is uploaded, so the last parts of a long upload aren't expired
+    const windows = {};
+    const signWindow = (first) => {
+      const last = Math.min(first + URLS_WINDOW_SIZE - 1, totalParts);
+      const window = { signedAt: Date.now() };
+      window.urls = context.with(ctx, getPresignedUrls, undefined, file, uploadId, first, last, token)
+        .then(urls => (window.signed = urls));
+      // a failed request is done again by the next part of the window
+      window.urls.catch(() => windows[first] === window && delete windows[first]);
+      windows[first] = window;
+      return window;
+    };
+    const getPartUrl = async (partNumber, expiredUrl) => {
+      const first = Math.floor((partNumber - 1) / URLS_WINDOW_SIZE) * URLS_WINDOW_SIZE + 1;
+      let window = windows[first];
+      // the parts of a window whose url expired sign it again only once
+      if (!window || Date.now() - window.signedAt > URLS_MAX_AGE_MS
+          || (expiredUrl && window.signed?.[partNumber] === expiredUrl)) {
+        window = signWindow(first);
+      }
+      return (await window.urls)[partNumber];
+    };
+
     for (let partNumber = 1; partNumber <= totalParts; partNumber++) {
       uploadPartJobs.push(async () => {
         const jobSpan = tracer.startSpan("job-upload-part-" + partNumber, {}, ctx)
@@ -38,9 +67,18 @@ export async function uploadFileByParts({ file, columns, rowCount }, { batchSize
         try {
           const part = file.slice((partNumber - 1) * partSizeInMB, partNumber * partSizeInMB);
 
-          const url = await context.with(jobCtx, getPresignedUrl, undefined, file, uploadId, partNumber, token);
-
-          const etag = await context.with(jobCtx, uploadPart, undefined, url, part);
+          const url = await getPartUrl(partNumber);
+          let etag;
+          try {
+            etag = await context.with(jobCtx, uploadPart, undefined, url, part);
+          } catch (error) {
+            // s3 answers 403 when the url expired, e.g. the tab was suspended
+            if (error.status !== 403) {
+              throw error
+            }
+            jobSpan.addEvent("url-expired")
+            etag = await context.with(jobCtx, uploadPart, undefined, await getPartUrl(partNumber, url), part);
+          }
 
           partResults.push({
             PartNumber: partNumber,
@@ -102,19 +140,21 @@ async function uploadPart(url, part) {
   return res.headers.get("ETag")
 }
 
-async function getPresignedUrl(file, uploadId, partNumber, token) {
-  const res = await fetchWithSpan("get-presigned-url", `${API_DOMAIN}/upload/get-presigned-url`, {
+async function getPresignedUrls(file, uploadId, firstPart, lastPart, token) {
+  const res = await fetchWithSpan("get-presigned-urls", `${API_DOMAIN}/upload/get-presigned-urls`, {
     method: "POST",
     headers: { "Content-Type": "application/json", "Token": token},
     body: JSON.stringify({
       filename: file.name,
       upload_id: uploadId,
-      part_number: partNumber,
+      first_part: firstPart,
+      last_part: lastPart,
     }),
   })
 
-  const { url } = await res.json()
-  return url
+  const { urls } = await res.json()
+  // map part number -> url
+  return Object.fromEntries(urls.map(({ part_number, url }) => [part_number, url]))
 }
 
 async function completeUpload(fileName, fileId, uploadId, partResults, token) {
@@ -132,7 +172,9 @@ async function completeUpload(fileName, fileId, uploadId, partResults, token) {
 }
 
 export async function fetchUploadedFiles() {
-  const res = await fetch(`${API_DOMAIN}/files`);
+  // only the fields shown, the browser revalidates the response with its ETag
+  const fields = "id,filename,username,columns,row_count,file_size,creation_datetime,status";
+  const res = await fetch(`${API_DOMAIN}/files?fields=${fields}`);
   if (!res.ok) {
     throw new Error("Failed to fetch uploaded files");
   }
@@ -2,9 +2,11 @@ import { AUTH_DOMAIN } from "../lib/config";
 
 
 export async function getTokens() {
-  const res = await fetch(`${AUTH_DOMAIN}/tokens`);
+  // only the first page, the list is paginated
+  const res = await fetch(`${AUTH_DOMAIN}/tokens?page_size=50`);
   if (!res.ok) {
     throw new Error("Failed to get tokens");
   }
-  return res.json();
+  const { result } = await res.json();
+  return result;
 }
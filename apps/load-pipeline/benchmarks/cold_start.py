@@ -0,0 +1,96 @@
+"""
+    Measures the cold start of the lambda: the time to import src.app (the
+    init phase, which also sets up the instrumentation) and to create the aws
+    clients used by the first invocation, each run in a new python process.
+
+    The imports of the slowest run are profiled with `python -X importtime`,
+    and the script fails when the median init time is over the budget, so it
+    can run in the build. Run it from apps/load-pipeline:
+
+        python -m benchmarks.cold_start [--runs 5] [--budget-ms 600] [--report importtime.txt]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import List, Tuple
+
+# runs in the child process, prints the times as json
+CHILD = """
+import json, time
+start = time.perf_counter()
+import src.app
+init = time.perf_counter() - start
+
+from src.clients import get_client
+start = time.perf_counter()
+for service in ("dynamodb", "s3", "redshift-data"):
+    get_client(service)
+clients = time.perf_counter() - start
+print(json.dumps({"init_ms": init * 1000, "clients_ms": clients * 1000}))
+"""
+
+
+def run_child(importtime: bool) -> Tuple[dict, str]:
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD]
+    env = {
+        **os.environ,
+        "AWS_REGION": os.getenv("AWS_REGION", "us-east-1"),
+        # the clients are only created, no request is sent
+        "AWS_ACCESS_KEY_ID": os.getenv("AWS_ACCESS_KEY_ID", "testing"),
+        "AWS_SECRET_ACCESS_KEY": os.getenv("AWS_SECRET_ACCESS_KEY", "testing"),
+    }
+    res = subprocess.run(args, capture_output=True, text=True, env=env, check=True)
+    return json.loads(res.stdout.strip().splitlines()[-1]), res.stderr
+
+
+def parse_importtime(stderr: str) -> List[Tuple[int, int, str]]:
+    """ Returns (self us, cumulative us, module) of every import """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        imports.append((int(self_us), int(cumulative_us), module.rstrip()))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=600, help="max median init time")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports shown")
+    parser.add_argument("--report", help="file where the whole -X importtime output is written")
+    args = parser.parse_args()
+
+    # the first run warms the .pyc files, as they are in the deployment package
+    run_child(importtime=False)
+
+    runs = [run_child(importtime=False)[0] for _ in range(args.runs)]
+    init = statistics.median(r["init_ms"] for r in runs)
+    clients = statistics.median(r["clients_ms"] for r in runs)
+
+    print(f"init (import src.app): median {init:.0f}ms, max {max(r['init_ms'] for r in runs):.0f}ms")
+    print(f"aws clients of the first invocation: median {clients:.0f}ms")
+
+    _, stderr = run_child(importtime=True)
+    imports = parse_importtime(stderr)
+    print(f"\nslowest imports (cumulative, {len(imports)} modules):")
+    for self_us, cumulative_us, module in sorted(imports, key=lambda i: -i[1])[:args.top]:
+        print(f"{cumulative_us / 1000:>8.1f}ms {self_us / 1000:>7.1f}ms self  {module}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(stderr)
+        print("\nimporttime report:", args.report)
+
+    if init > args.budget_ms:
+        print(f"\nthe init time {init:.0f}ms is over the budget of {args.budget_ms:.0f}ms")
+        sys.exit(1)
+    print(f"\nthe init time is within the budget of {args.budget_ms:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+    Compares the size and query time in redshift of a csv file loaded with the
+    inferred column types against the previous schema (every column VARCHAR(10000)).
+
+    The types are inferred from the profile of the file stored by files-service.
+    It needs the same env vars as the lambda (S3_BUCKET_NAME, REDSHIFT_WORKGROUP,
+    REDSHIFT_DATABASE, AWS_REGION), run it from apps/load-pipeline:
+
+        python -m benchmarks.column_types <file id> [--runs 5]
+
+    Both tables are dropped at the end.
+"""
+import time
+import argparse
+
+import boto3
+
+from src.services import (
+    AWS_REGION, exec_and_wait, create_table_query, copy_query, get_table_name,
+    get_file_metadata,
+)
+from src.type_inference import infer_file_column_types
+
+
+def query_rows(client, query: str) -> list:
+    query_id = exec_and_wait(client, query, timeout=None)
+    res = client.get_statement_result(Id=query_id)
+    return [[list(v.values())[0] for v in r] for r in res.get("Records", [])]
+
+
+def load(client, table_name: str, file: dict, column_types: list) -> float:
+    start = time.perf_counter()
+    exec_and_wait(client, [
+        create_table_query(table_name, file, column_types),
+        copy_query(table_name, file["columns"], file["filename"]),
+    ], timeout=None)
+    return time.perf_counter() - start
+
+
+def table_size_mb(client, table_name: str) -> int:
+    rows = query_rows(
+        client, f"SELECT size FROM svv_table_info WHERE \"table\" = '{table_name.lower()}';"
+    )
+    return int(rows[0][0]) if rows else 0
+
+
+def query_time(client, table_name: str, column: str, runs: int) -> float:
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        # the predicate changes the query text so the result cache isn't used
+        exec_and_wait(client, f"""
+            SELECT "{column}", COUNT(*) FROM "public"."{table_name}"
+            WHERE {i} = {i}
+            GROUP BY 1 ORDER BY 2 DESC LIMIT 10;
+        """, timeout=None)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file_id", help="id of the file in the files table")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    client = boto3.client('redshift-data', region_name=AWS_REGION)
+
+    file = get_file_metadata(args.file_id)
+    columns = file["columns"]
+    base_name = get_table_name(file["filename"])
+    tables = {
+        "varchar": (f"{base_name}_bench_varchar", ["VARCHAR(10000)"] * len(columns)),
+        "inferred": (f"{base_name}_bench_inferred", infer_file_column_types(columns, [file])),
+    }
+
+    try:
+        results = {}
+        for name, (table_name, column_types) in tables.items():
+            load_time = load(client, table_name, file, column_types)
+            results[name] = {
+                "load_seconds": load_time,
+                "size_mb": table_size_mb(client, table_name),
+                "query_seconds": query_time(client, table_name, columns[0], args.runs),
+            }
+    finally:
+        for table_name, _ in tables.values():
+            exec_and_wait(client, f'DROP TABLE IF EXISTS "public"."{table_name}";')
+
+    print(f"{'schema':<10} {'load (s)':>10} {'size (MB)':>10} {'query p50 (s)':>14}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['load_seconds']:>10.2f} {r['size_mb']:>10} {r['query_seconds']:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
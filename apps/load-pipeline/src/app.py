@@ -1,28 +1,98 @@
-from opentelemetry import trace
+import os
+import time
+from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from opentelemetry import trace, context as otel_context
 
 from .services import (
-    update_file_status, copy_content_to_redshift, 
-    get_file_metadata
+    copy_content_to_redshift, get_file_metadata, copy_files_to_redshift, get_table_name,
+    acquire_load_lease, acquire_load_leases, release_load_lease, release_load_leases,
 )
-from .instrumentation import setup_instrumentation
+from .instrumentation import setup_instrumentation, flush_spans, flush_before_timeout
+from .instruments import loaded_bytes, loaded_rows, queue_to_loaded_lag
 
 setup_instrumentation()
 
 tracer = trace.get_tracer(__name__)
 
+# number of messages of the batch processed at the same time
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "5"))
+
 
-@tracer.start_as_current_span("main") 
 def main(event, context):
+    # the spans of the invocation are exported together when it finishes
+    with flush_before_timeout(context):
+        try:
+            return process_event(event, context)
+        finally:
+            flush_spans()
+
+
+@tracer.start_as_current_span("main") 
+def process_event(event, context):
     span = trace.get_current_span()
     span.set_attribute("event", event)
 
-    for r in event["Records"]:
-        process_message(r)
+    records = event["Records"]
+    span.set_attributes({
+        "messages.count": len(records), "messages.max_concurrency": MAX_CONCURRENCY,
+    })
 
+    # files loaded in the same table are processed together
+    groups = {}
+    for r in records:
+        _, file_name = get_message_file(r)
+        groups.setdefault(get_table_name(file_name), []).append(r)
 
-@tracer.start_as_current_span("process_message")
-def process_message(msg):
-    span = trace.get_current_span()
+    span.set_attribute("tables.count", len(groups))
+
+    # the worker threads don't inherit the current span, it has to be passed.
+    # They create their aws clients with get_client, which is safe between threads
+    ctx = otel_context.get_current()
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_CONCURRENCY, len(groups)))) as pool:
+        futures = {
+            pool.submit(process_group_in_context, ctx, msgs): msgs
+            for msgs in groups.values()
+        }
+        for future in as_completed(futures):
+            msgs = futures[future]
+            try:
+                failed_ids = future.result()
+            except Exception as e:
+                print("failed to process messages:", [m["messageId"] for m in msgs], e)
+                failed_ids = [m["messageId"] for m in msgs]
+
+            failures.extend({"itemIdentifier": id} for id in failed_ids)
+
+    span.set_attribute("messages.failed", len(failures))
+
+    # only the failed messages return to the queue to be retried
+    # (requires ReportBatchItemFailures in the event source mapping)
+    return {"batchItemFailures": failures}
+
+
+def process_group_in_context(ctx, msgs) -> List[str]:
+    """ Processes messages of the same table, returns the ids of the failed ones """
+    token = otel_context.attach(ctx)
+    try:
+        if len(msgs) == 1:
+            process_message(msgs[0])
+            return []
+        return process_messages(msgs)
+    finally:
+        otel_context.detach(token)
+
+
+def get_message_file(msg) -> Tuple[str, str]:
+    file_id = msg["messageAttributes"]["file_id"]["stringValue"]
+    file_name = msg["messageAttributes"]["file_name"]["stringValue"]
+    return file_id, file_name
+
+
+def link_message_producer(span, msg):
     # create a link with the message producer
     trace_id = msg["messageAttributes"]["trace_id"]["stringValue"]
     span_id = msg["messageAttributes"]["span_id"]["stringValue"]
@@ -31,16 +101,117 @@ def process_message(msg):
         trace_flags=trace.TraceFlags.SAMPLED, trace_state=trace.TraceState() 
     ))
 
-    file_id = msg["messageAttributes"]["file_id"]["stringValue"]
-    file_name = msg["messageAttributes"]["file_name"]["stringValue"]
+
+def record_loaded(msg, file: dict):
+    """ Records the metrics of a file loaded into redshift """
+    attributes = {"table.name": get_table_name(file["filename"])}
+    loaded_bytes.add(int(file.get("file_size", 0)), attributes)
+    loaded_rows.add(int(file.get("row_count", 0)), attributes)
+
+    # milliseconds since epoch when the message was sent to the queue
+    sent_timestamp = msg.get("attributes", {}).get("SentTimestamp")
+    if sent_timestamp:
+        queue_to_loaded_lag.record(time.time() - int(sent_timestamp) / 1000, attributes)
+
+
+@tracer.start_as_current_span("process_message")
+def process_message(msg):
+    span = trace.get_current_span()
+    link_message_producer(span, msg)
+
+    file_id, file_name = get_message_file(msg)
 
     span.set_attributes({"file.id": file_id, "file.name": file_name})
 
     print("file_id:", file_id, "file name:", file_name)
 
-    update_file_status(file_id, "loading")
+    # a redelivered message of a loaded file is done
+    if not acquire_load_lease(file_id):
+        print("file already loaded:", file_id)
+        return
+
+    try:
+        file = get_file_metadata(file_id)
+        copy_content_to_redshift(file)
+    except Exception:
+        # releases the lease, so the retry doesn't wait for it to expire
+        release_load_lease(file_id, "stored")
+        raise
+
+    if release_load_lease(file_id, "loaded"):
+        record_loaded(msg, file)
+
+
+@tracer.start_as_current_span("process_messages")
+def process_messages(msgs) -> List[str]:
+    """
+        Loads several files of the same table, the ones with the same columns
+        are loaded in a single transaction. Returns the ids of the failed messages.
+    """
+    span = trace.get_current_span()
+    for msg in msgs:
+        link_message_producer(span, msg)
+
+    span.set_attributes({
+        "file.ids": [get_message_file(m)[0] for m in msgs],
+        "file.names": [get_message_file(m)[1] for m in msgs],
+    })
+
+    acquired, loaded, failed = acquire_load_leases([get_message_file(m)[0] for m in msgs])
+    span.set_attributes({"files.duplicated": len(loaded), "files.lease_failed": len(failed)})
+
+    # the messages of files already loaded are done, the ones of files that
+    # couldn't be acquired are retried
+    failed_ids = [m["messageId"] for m in msgs if get_message_file(m)[0] in failed]
+    acquired = set(acquired)
+    # leases not released yet, they return to stored if something fails
+    held = set(acquired)
+
+    try:
+        # columns -> [(message, file)]
+        groups = {}
+        for msg in msgs:
+            file_id, file_name = get_message_file(msg)
+            if file_id not in acquired:
+                continue
+            # the same file can be in several messages of the batch
+            acquired.remove(file_id)
+            print("file_id:", file_id, "file name:", file_name)
+
+            try:
+                file = get_file_metadata(file_id)
+            except Exception as e:
+                print("failed to get the file metadata:", file_id, e)
+                span.record_exception(e)
+                failed_ids.append(msg["messageId"])
+                held.discard(file_id)
+                release_load_leases([file_id], "stored")
+                continue
+            groups.setdefault(tuple(file["columns"]), []).append((msg, file))
+
+        for items in groups.values():
+            files = [file for _, file in items]
+            file_ids = [file["id"] for file in files]
+            try:
+                if len(files) == 1:
+                    copy_content_to_redshift(files[0])
+                else:
+                    copy_files_to_redshift(files)
+            except Exception as e:
+                print("failed to copy files:", [f["filename"] for f in files], e)
+                span.record_exception(e)
+                span.set_status(trace.StatusCode.ERROR)
+                failed_ids.extend(msg["messageId"] for msg, _ in items)
+                # releases the leases, so the retries don't wait for them to expire
+                held.difference_update(file_ids)
+                release_load_leases(file_ids, "stored")
+                continue
 
-    file = get_file_metadata(file_id)
-    copy_content_to_redshift(file)
+            held.difference_update(file_ids)
+            for msg, file in items:
+                if release_load_lease(file["id"], "loaded"):
+                    record_loaded(msg, file)
+    finally:
+        release_load_leases(list(held), "stored")
 
-    update_file_status(file_id, "loaded")
+    return failed_ids
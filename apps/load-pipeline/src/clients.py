@@ -0,0 +1,50 @@
+import os
+import threading
+
+import boto3
+
+AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+
+# building a boto3 client loads the service model and resolves the endpoint
+# (~10ms, ~300ms the first one of the container), so they are created once
+# per container and reused by every invocation
+_lock = threading.Lock()
+_clients = {}
+
+
+def _instrument_botocore():
+    """
+        Traces the calls of the aws clients. It's called before the first
+        client is created instead of in the init, importing the botocore
+        instrumentation is part of the cold start otherwise
+    """
+    from opentelemetry.instrumentation.botocore import BotocoreInstrumentor
+    BotocoreInstrumentor().instrument()
+
+
+def get_client(service_name: str, region_name: str = AWS_REGION):
+    """
+        Returns a boto3 client shared by the whole container. It uses the
+        default session, instrumented in setup_instrumentation, and botocore
+        is instrumented with the first client. The session is not thread
+        safe while it creates clients (it can fail with
+        KeyError: 'credential_provider'), so the clients are created under a
+        lock and the worker threads must get them from here instead of
+        calling boto3.client themselves.
+
+        Parameters:
+            service_name: aws service name, e.g. 's3', 'dynamodb', 'redshift-data'
+            region_name: aws region of the client
+    """
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        # another thread could create it while we were waiting the lock
+        if key not in _clients:
+            if not _clients:
+                _instrument_botocore()
+            _clients[key] = boto3.client(service_name, region_name=region_name)
+        return _clients[key]
@@ -1,28 +1,185 @@
-import os 
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional
 
-from opentelemetry import trace
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+import boto3
+from opentelemetry import trace, metrics
 from opentelemetry.sdk.resources import Resource
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import SimpleSpanProcessor
-from opentelemetry.instrumentation.botocore import BotocoreInstrumentor
+from opentelemetry.sdk.trace import TracerProvider, ReadableSpan, SpanProcessor
+from opentelemetry.sdk.trace.export import SpanExporter
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import (
+    PeriodicExportingMetricReader, MetricExporter, MetricExportResult, MetricsData,
+)
 from opentelemetry.semconv.resource import ResourceAttributes
 
+from .sampling import create_sampler
+from .instruments import instrument_aws_session
+
 OTLP_COLLECTOR_ENDPOINT = os.getenv("OTLP_COLLECTOR_ENDPOINT")
+# OTLP_COLLECTOR_ENDPOINT is the url of the traces, e.g. http://collector:4318/v1/traces
+OTLP_METRICS_ENDPOINT = os.getenv(
+    "OTLP_METRICS_ENDPOINT",
+    (OTLP_COLLECTOR_ENDPOINT or "").replace("/v1/traces", "/v1/metrics") or None,
+)
+# spans kept in memory before exporting them even if the invocation didn't finish
+MAX_BUFFERED_SPANS = int(os.getenv("MAX_BUFFERED_SPANS", "2048"))
+# time before the lambda timeout when the spans are exported
+FLUSH_MARGIN_MILLIS = int(os.getenv("FLUSH_MARGIN_MILLIS", "5000"))
+# ratio of the invocations sampled, every span of an invocation follows the main span
+TRACES_SAMPLER_RATIO = float(os.getenv("TRACES_SAMPLER_RATIO", "1.0"))
+
+
+def create_span_exporter() -> SpanExporter:
+    # the otlp exporters (requests, protobuf) take ~100ms to import, so they are
+    # imported on the first export, after the records of the first invocation
+    # are processed, instead of in the cold start
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    return OTLPSpanExporter(endpoint=OTLP_COLLECTOR_ENDPOINT)
+
+
+def create_metric_exporter() -> MetricExporter:
+    from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+    return OTLPMetricExporter(endpoint=OTLP_METRICS_ENDPOINT)
+
+
+class LazyMetricExporter(MetricExporter):
+    """ Creates the metric exporter on the first export """
+
+    def __init__(self, exporter_factory: Callable[[], MetricExporter]):
+        # the defaults of the otlp exporter, cumulative temporality
+        super().__init__()
+        self.exporter_factory = exporter_factory
+        self._exporter: Optional[MetricExporter] = None
+        self._lock = threading.Lock()
+
+    def _get_exporter(self) -> MetricExporter:
+        with self._lock:
+            if self._exporter is None:
+                self._exporter = self.exporter_factory()
+            return self._exporter
+
+    def export(self, metrics_data: MetricsData, timeout_millis: float = 10_000, **kwargs) -> MetricExportResult:
+        return self._get_exporter().export(metrics_data, timeout_millis=timeout_millis, **kwargs)
+
+    def force_flush(self, timeout_millis: float = 10_000) -> bool:
+        return self._exporter is None or self._exporter.force_flush(timeout_millis)
+
+    def shutdown(self, timeout_millis: float = 30_000, **kwargs):
+        if self._exporter is not None:
+            self._exporter.shutdown(timeout_millis=timeout_millis, **kwargs)
+
+
+class LambdaSpanProcessor(SpanProcessor):
+    """
+        Keeps the finished spans in memory and exports them together when
+        force_flush is called, at the end of every invocation. The exporter
+        is created with `exporter_factory` on the first export.
+
+        A BatchSpanProcessor exports from a background thread that is frozen
+        between lambda invocations, so spans could be lost, and a
+        SimpleSpanProcessor makes a request for every span.
+    """
+
+    def __init__(
+        self,
+        exporter_factory: Callable[[], SpanExporter],
+        max_buffered_spans: int = MAX_BUFFERED_SPANS,
+    ):
+        self.exporter_factory = exporter_factory
+        self.exporter: Optional[SpanExporter] = None
+        self.max_buffered_spans = max_buffered_spans
+        self._spans: List[ReadableSpan] = []
+        self._lock = threading.Lock()
+        # only one export at a time, the exporter is not thread safe
+        self._export_lock = threading.Lock()
+
+    def on_start(self, span, parent_context=None):
+        pass
+
+    def on_end(self, span: ReadableSpan):
+        if not span.context.trace_flags.sampled:
+            return
+
+        with self._lock:
+            self._spans.append(span)
+            full = len(self._spans) >= self.max_buffered_spans
+
+        # avoids growing without limit in very long invocations
+        if full:
+            self.force_flush()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        with self._lock:
+            spans, self._spans = self._spans, []
+
+        if not spans:
+            return True
+
+        with self._export_lock:
+            try:
+                if self.exporter is None:
+                    self.exporter = self.exporter_factory()
+                self.exporter.export(spans)
+            except Exception as e:
+                print("failed to export spans:", e)
+                return False
+        return True
+
+    def shutdown(self):
+        self.force_flush()
+        if self.exporter is not None:
+            self.exporter.shutdown()
 
 
 def setup_instrumentation():
-    BotocoreInstrumentor().instrument()
+    # the spans of the aws calls are set up with the first client (see clients.py)
 
-    exporter = OTLPSpanExporter(endpoint=OTLP_COLLECTOR_ENDPOINT)
-    # use simple processor to avoid batching and losing spans because of timeout of 15 minutes
-    # of the execution lambda function
-    processor = SimpleSpanProcessor(exporter) 
+    # spans are exported once per invocation (see flush_spans)
+    processor = LambdaSpanProcessor(create_span_exporter)
 
     resource = Resource.create({ResourceAttributes.SERVICE_NAME: "load-pipeline"})
-    provider = TracerProvider(resource=resource)
+    sampler = create_sampler(TRACES_SAMPLER_RATIO, rules="")
+    provider = TracerProvider(resource=resource, sampler=sampler)
 
     provider.add_span_processor(processor)
 
     trace.set_tracer_provider(provider)
 
+    # metrics are exported with the spans at the end of the invocation (see flush_spans)
+    metric_reader = PeriodicExportingMetricReader(
+        LazyMetricExporter(create_metric_exporter),
+        export_interval_millis=float("inf"),
+    )
+    metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=[metric_reader]))
+
+    # clients created with boto3.client(...) use the default session
+    boto3.setup_default_session()
+    instrument_aws_session(boto3.DEFAULT_SESSION)
+
+
+def flush_spans():
+    """ Exports the spans and metrics recorded so far """
+    for provider in (trace.get_tracer_provider(), metrics.get_meter_provider()):
+        if hasattr(provider, "force_flush"):
+            provider.force_flush()
+
+
+@contextmanager
+def flush_before_timeout(context):
+    """
+        Exports the spans finished so far when the lambda is about to time out,
+        so they are not lost if the invocation is killed
+    """
+    timer: Optional[threading.Timer] = None
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        delay = (context.get_remaining_time_in_millis() - FLUSH_MARGIN_MILLIS) / 1000
+        timer = threading.Timer(max(delay, 0), flush_spans)
+        timer.daemon = True
+        timer.start()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.cancel()
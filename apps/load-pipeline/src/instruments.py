@@ -0,0 +1,65 @@
+# the meters of the app are declared here, the instrumentation of the aws
+# calls (from _start_timer to the end) is the same in every app and
+# `make check-shared` compares it
+import time
+
+import boto3
+from opentelemetry import metrics
+
+
+meter = metrics.get_meter("load-pipeline")
+
+aws_call_duration = meter.create_histogram(
+    "aws.client.duration", unit="s", description="Duration of the calls to aws apis"
+)
+copy_duration = meter.create_histogram(
+    "pipeline.copy.duration", unit="s", description="Duration of the COPY into redshift"
+)
+loaded_bytes = meter.create_counter(
+    "pipeline.loaded.size", unit="By", description="Bytes of the files loaded into redshift"
+)
+loaded_rows = meter.create_counter(
+    "pipeline.loaded.rows", unit="{row}", description="Rows loaded into redshift"
+)
+queue_to_loaded_lag = meter.create_histogram(
+    "pipeline.queue_to_loaded.duration", unit="s",
+    description="Time since the file was queued until it was loaded",
+)
+
+
+def _start_timer(model, context, **kwargs):
+    context["metrics_start_time"] = time.perf_counter()
+    context["metrics_attributes"] = {
+        "aws.service": model.service_model.service_name,
+        "aws.operation": model.name,
+    }
+
+
+def _record_call(context, error: bool):
+    start = context.get("metrics_start_time")
+    if start is None:
+        return
+
+    aws_call_duration.record(
+        time.perf_counter() - start, {**context["metrics_attributes"], "error": error}
+    )
+
+
+def _record_response(context, http_response=None, parsed=None, **kwargs):
+    # after-call is also emitted for the error responses of aws (4xx, 5xx),
+    # after-call-error only when no response was received
+    status_code = getattr(http_response, "status_code", 200)
+    error = status_code >= 400 or "Error" in (parsed or {})
+    _record_call(context, error=error)
+
+
+def _record_error(context, **kwargs):
+    _record_call(context, error=True)
+
+
+def instrument_aws_session(session: boto3.Session):
+    """ Records the duration of the calls of every client created by the session """
+    events = session.events
+    events.register("before-call", _start_timer)
+    events.register("after-call", _record_response)
+    events.register("after-call-error", _record_error)
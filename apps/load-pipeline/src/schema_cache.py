@@ -0,0 +1,73 @@
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from .clients import get_client
+
+# optional dynamodb table (hash key 'table_name') to share the known schemas
+# between lambda containers, when it's not set they only live in memory
+SCHEMA_CACHE_TABLE = os.getenv("SCHEMA_CACHE_TABLE")
+# items of other versions are ignored, e.g. the ones cached before the file_id
+# of the tables was backfilled (see services.backfill_file_id_queries) or
+# without the order of the columns
+SCHEMA_CACHE_VERSION = 3
+
+_lock = threading.Lock()
+# table name -> columns known to exist in redshift in the order of the table
+# (lowercase because redshift lowercases identifiers), it stays warm while the
+# lambda container is reused
+_tables: Dict[str, Tuple[str, ...]] = {}
+
+
+def get_table_columns(table_name: str) -> Optional[Tuple[str, ...]]:
+    """ Returns the known columns of the table in order or None if it's unknown """
+    with _lock:
+        columns = _tables.get(table_name)
+
+    if columns is not None or not SCHEMA_CACHE_TABLE:
+        return columns
+
+    db = get_client('dynamodb')
+    res = db.get_item(
+        TableName=SCHEMA_CACHE_TABLE,
+        Key={'table_name': {'S': table_name}},
+    )
+    item = res.get('Item', None)
+    if not item or item.get('version', {}).get('N') != str(SCHEMA_CACHE_VERSION):
+        return None
+
+    columns = tuple(c['S'] for c in item['columns']['L'])
+    with _lock:
+        _tables[table_name] = columns
+    return columns
+
+
+def set_table_columns(table_name: str, columns: Iterable[str]):
+    # without duplicates, keeping the order
+    columns = tuple(dict.fromkeys(c.lower() for c in columns))
+    with _lock:
+        _tables[table_name] = columns
+
+    if SCHEMA_CACHE_TABLE:
+        db = get_client('dynamodb')
+        db.put_item(
+            TableName=SCHEMA_CACHE_TABLE,
+            Item={
+                'table_name': {'S': table_name},
+                'columns': {'L': [{'S': c} for c in columns]},
+                'version': {'N': str(SCHEMA_CACHE_VERSION)},
+            },
+        )
+
+
+def forget_table(table_name: str):
+    """ Removes the table from the cache, e.g. when it was changed outside the pipeline """
+    with _lock:
+        _tables.pop(table_name, None)
+
+    if SCHEMA_CACHE_TABLE:
+        db = get_client('dynamodb')
+        db.delete_item(
+            TableName=SCHEMA_CACHE_TABLE,
+            Key={'table_name': {'S': table_name}},
+        )
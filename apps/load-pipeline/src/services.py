@@ -1,14 +1,38 @@
 import os
 import time
+import random
 import re
+import uuid
+import threading
+from typing import Dict, FrozenSet, List, Optional, Tuple, Union
 
 import boto3
+from botocore.exceptions import ClientError
 from opentelemetry import trace
 
+from .clients import get_client
+from .schema_cache import get_table_columns, set_table_columns, forget_table
+from .type_inference import infer_file_column_types, get_encoding, get_sort_key, VARCHAR
+from .splitting import write_parts, delete_split, SPLITS_PREFIX
+from .instruments import copy_duration
+
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 REDSHIFT_WORKGROUP = os.getenv("REDSHIFT_WORKGROUP")
 REDSHIFT_DATABASE = os.getenv("REDSHIFT_DATABASE")
+# seconds that a file is reserved for the consumer loading it, after that
+# another consumer can load it (e.g. when the first one crashed), it's the
+# visibility timeout of the queue
+LOAD_LEASE_SECONDS = int(os.getenv("LOAD_LEASE_SECONDS", "900"))
+
+# file id -> token of the leases held by this process
+_leases: Dict[str, str] = {}
+_leases_lock = threading.Lock()
+
+# seconds between checks of a query status, it grows on every check up to the max
+POLL_INITIAL_INTERVAL = float(os.getenv("POLL_INITIAL_INTERVAL", "0.2"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "5"))
+POLL_BACKOFF_FACTOR = float(os.getenv("POLL_BACKOFF_FACTOR", "2"))
 
 tracer = trace.get_tracer(__name__)
 
@@ -18,7 +42,7 @@ def get_file_metadata(file_id: str):
     span = trace.get_current_span()
     span.set_attributes({"file.id": file_id, "table.name": "otel-observability-files"})
 
-    db = boto3.client('dynamodb', region_name=AWS_REGION)
+    db = get_client('dynamodb')
     res = db.get_item(
         TableName='otel-observability-files',
         Key={'id': {'S': file_id}},
@@ -34,7 +58,10 @@ def get_file_metadata(file_id: str):
     data = {}
     for k, v in item.items():
         if "L" in v:
-            data[k] = [c['S'] for c in v['L']]
+            # e.g. the columns or their max lengths
+            data[k] = [c['S'] if "S" in c else int(c['N']) for c in v['L']]
+        elif "BOOL" in v:
+            data[k] = v['BOOL']
         else:
             data[k] = v['S'] if "S" in v else v['N']
 
@@ -49,7 +76,7 @@ def update_file_status(file_id: str, status: str):
         "table.name": "otel-observability-files"
     })
 
-    db = boto3.client('dynamodb', region_name=AWS_REGION)
+    db = get_client('dynamodb')
     res = db.update_item(
         TableName='otel-observability-files',
         Key={'id': {'S': file_id}},
@@ -62,6 +89,282 @@ def update_file_status(file_id: str, status: str):
         raise Exception("Failed to update file")
 
 
+@tracer.start_as_current_span("acquire_load_lease")
+def acquire_load_lease(file_id: str) -> bool:
+    """
+        Moves the file from stored to loading with a conditional write, so
+        only one consumer loads it and a redelivered message costs one write
+        instead of a COPY. The lease of a consumer that didn't finish expires
+        after LOAD_LEASE_SECONDS, a long running consumer renews it with
+        renew_load_leases.
+
+        The lease has a random token kept by this process until the lease is
+        released with release_load_lease, so a consumer whose lease expired
+        can't change the status of a file that another consumer took.
+
+        Returns False when the file is already loaded, the message is a
+        duplicate. Raises an exception when another consumer is loading it,
+        so the message is retried later.
+    """
+    span = trace.get_current_span()
+    span.set_attributes({"file.id": file_id, "table.name": "otel-observability-files"})
+
+    now = int(time.time())
+    token = uuid.uuid4().hex
+    db = get_client('dynamodb')
+    try:
+        db.update_item(
+            TableName='otel-observability-files',
+            Key={'id': {'S': file_id}},
+            UpdateExpression='set #st = :loading, lease_expires_at = :expires, lease_token = :token',
+            ConditionExpression=(
+                '#st = :stored'
+                ' OR (#st = :loading AND attribute_not_exists(lease_expires_at))'
+                ' OR (#st = :loading AND lease_expires_at < :now)'
+            ),
+            # #st is a placeholder for status because status is a reserved word
+            ExpressionAttributeNames={'#st': 'status'},
+            ExpressionAttributeValues={
+                ':stored': {'S': 'stored'},
+                ':loading': {'S': 'loading'},
+                ':now': {'N': str(now)},
+                ':expires': {'N': str(now + LOAD_LEASE_SECONDS)},
+                ':token': {'S': token},
+            },
+            ReturnValuesOnConditionCheckFailure='ALL_OLD',
+        )
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
+
+        status = e.response.get('Item', {}).get('status', {}).get('S')
+        span.set_attribute("file.status", str(status))
+        if status == 'loaded':
+            span.set_attribute("file.duplicate", True)
+            return False
+        raise Exception(f"file {file_id} can't be loaded, its status is {status}")
+
+    with _leases_lock:
+        _leases[file_id] = token
+    return True
+
+
+def acquire_load_leases(file_ids: List[str]) -> Tuple[List[str], List[str], List[str]]:
+    """
+        Acquires the lease of every file, returns the ids of the files
+        acquired, the ones already loaded and the ones that failed
+    """
+    acquired, loaded, failed = [], [], []
+    for file_id in dict.fromkeys(file_ids):
+        try:
+            (acquired if acquire_load_lease(file_id) else loaded).append(file_id)
+        except Exception as e:
+            print("failed to acquire the lease of the file:", file_id, e)
+            failed.append(file_id)
+    return acquired, loaded, failed
+
+
+@tracer.start_as_current_span("release_load_lease")
+def release_load_lease(file_id: str, status: str) -> bool:
+    """
+        Ends the lease of the file setting its status, stored to load it again
+        or loaded. The write is conditional on the file still being leased
+        with the token of this process, returns False when the lease was lost
+        (it expired and another consumer took it), the status is not changed.
+    """
+    span = trace.get_current_span()
+    span.set_attributes({
+        "file.id": file_id, "file.status": status,
+        "table.name": "otel-observability-files"
+    })
+
+    with _leases_lock:
+        token = _leases.pop(file_id, None)
+    if token is None:
+        raise Exception(f"the lease of the file {file_id} is not held")
+
+    db = get_client('dynamodb')
+    try:
+        db.update_item(
+            TableName='otel-observability-files',
+            Key={'id': {'S': file_id}},
+            UpdateExpression='set #st = :status remove lease_expires_at, lease_token',
+            ConditionExpression='#st = :loading AND lease_token = :token',
+            # #st is a placeholder for status because status is a reserved word
+            ExpressionAttributeNames={'#st': 'status'},
+            ExpressionAttributeValues={
+                ':status': {'S': status},
+                ':loading': {'S': 'loading'},
+                ':token': {'S': token},
+            },
+        )
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
+        print("the lease of the file was lost:", file_id)
+        span.set_attribute("file.lease_lost", True)
+        return False
+
+    return True
+
+
+def release_load_leases(file_ids: List[str], status: str):
+    """ Releases the lease of every file, the failures are only logged """
+    for file_id in dict.fromkeys(file_ids):
+        try:
+            release_load_lease(file_id, status)
+        except Exception as e:
+            print("failed to release the lease of the file:", file_id, e)
+
+
+@tracer.start_as_current_span("renew_load_leases")
+def renew_load_leases():
+    """
+        Extends LOAD_LEASE_SECONDS the leases held by this process, a long
+        running consumer calls it while the loads take longer than a lease
+    """
+    span = trace.get_current_span()
+    with _leases_lock:
+        leases = dict(_leases)
+    span.set_attribute("files.count", len(leases))
+
+    db = get_client('dynamodb')
+    for file_id, token in leases.items():
+        try:
+            db.update_item(
+                TableName='otel-observability-files',
+                Key={'id': {'S': file_id}},
+                UpdateExpression='set lease_expires_at = :expires',
+                ConditionExpression='#st = :loading AND lease_token = :token',
+                # #st is a placeholder for status because status is a reserved word
+                ExpressionAttributeNames={'#st': 'status'},
+                ExpressionAttributeValues={
+                    ':expires': {'N': str(int(time.time()) + LOAD_LEASE_SECONDS)},
+                    ':loading': {'S': 'loading'},
+                    ':token': {'S': token},
+                },
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                print("failed to renew the lease of the file:", file_id, e)
+                continue
+            with _leases_lock:
+                released = _leases.get(file_id) != token
+            # not an error when it was released meanwhile
+            if not released:
+                print("the lease of the file was taken by another consumer:", file_id)
+
+
+def get_table_name(filename: str) -> str:
+    # remove file extension from filename
+    filename = os.path.splitext(filename)[0]
+    return re.sub(r'[^a-zA-Z0-9_]', '_', filename)
+
+
+# columns of every table, before the ones of the files
+TABLE_COLUMNS = ("timestamp", "file_id", "file_name")
+
+
+def create_table_query(table_name: str, file: dict, column_types: List[str]) -> str:
+    sort_key = get_sort_key(file["columns"], column_types)
+
+    definitions = []
+    for column, column_type in zip(file["columns"], column_types):
+        # sort key columns are not compressed to make range filters faster
+        encoding = "RAW" if column == sort_key else get_encoding(column_type)
+        definitions.append(f'"{column}" {column_type} ENCODE {encoding}')
+
+    return f"""
+        CREATE TABLE IF NOT EXISTS "public"."{table_name}" (
+            "timestamp" TIMESTAMP DEFAULT CURRENT_TIMESTAMP ENCODE AZ64,
+            "file_id" VARCHAR(64) ENCODE ZSTD,
+            "file_name" VARCHAR(1024) ENCODE ZSTD,
+            {', '.join(definitions)}
+        )
+        DISTSTYLE AUTO
+        {f'SORTKEY ("{sort_key}")' if sort_key else 'SORTKEY AUTO'};
+    """
+
+
+# comment of the file_id column once the rows loaded before the loads set
+# their own file_id are detached (see backfill_file_id_queries)
+FILE_ID_COMMENT = "file id of the row, set by the load"
+
+
+def backfill_file_id_queries(table_name: str, legacy_file_id: str) -> List[str]:
+    """
+        The tables created before the loads replaced the rows by file_id have
+        the id of the file that created them as the DEFAULT of file_id, and the
+        COPY of every file left it in its rows. Those rows get a NULL file_id,
+        so deleting the rows of the table creator doesn't delete the rows of
+        the other files, and the column is marked with FILE_ID_COMMENT.
+
+        Parameters:
+            table_name: table where the data is loaded
+            legacy_file_id: the DEFAULT of file_id
+    """
+    return [
+        f'UPDATE "public"."{table_name}" SET "file_id" = NULL '
+        f'WHERE "file_id" = {quote_literal(legacy_file_id)};',
+        f'COMMENT ON COLUMN "public"."{table_name}"."file_id" IS {quote_literal(FILE_ID_COMMENT)};',
+    ]
+
+
+def copy_query(table_name: str, columns: List[str], key: str, manifest: bool = False) -> str:
+    """ COPY of a csv file, or of the gzip parts of a manifest (see splitting.py) """
+    # compression analysis is disabled because the encodings are declared in the DDL
+    return f"""
+        COPY {table_name} ({', '.join([f'"{c}"' for c in columns])})
+        FROM 's3://{S3_BUCKET_NAME}/{key}'
+        IAM_ROLE default
+        REGION '{AWS_REGION}'
+        IGNOREHEADER 1
+        DATEFORMAT 'auto'
+        TIMEFORMAT 'auto'
+        COMPUPDATE OFF
+        FORMAT CSV{' MANIFEST GZIP' if manifest else ''};
+    """
+
+
+def quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def replace_files_queries(
+    table_name: str, columns: List[str], files: List[dict], manifest_key: str
+) -> List[str]:
+    """
+        Queries that load the files into a staging table and replace their
+        rows in the table (delete and insert by file_id), so loading a file
+        again doesn't duplicate its rows. They must run in one transaction.
+
+        The parts of the manifest have the file_id and file_name of every
+        row (see splitting.py), so all the files are loaded with a single
+        COPY and its rows are inserted with the file they come from.
+
+        Parameters:
+            table_name: table where the data is loaded
+            columns: columns of the files
+            files: metadata of the files
+            manifest_key: manifest of the parts of the files (see write_parts)
+    """
+    # temp tables live in the session of the statement, so the name doesn't collide
+    stage = f"stage_{table_name}"
+    file_columns = ["file_id", "file_name", *columns]
+    column_list = ', '.join([f'"{c}"' for c in file_columns])
+    file_ids = ', '.join(quote_literal(f["id"]) for f in files)
+
+    return [
+        f'CREATE TEMP TABLE {stage} (LIKE "public"."{table_name}");',
+        copy_query(stage, file_columns, manifest_key, manifest=True),
+        f'DELETE FROM "public"."{table_name}" WHERE "file_id" IN ({file_ids});',
+        f"""
+            INSERT INTO "public"."{table_name}" ({column_list})
+            SELECT {column_list} FROM {stage};
+        """,
+    ]
+
+
 @tracer.start_as_current_span("copy_content_to_redshift") 
 def copy_content_to_redshift(file: dict):
     span = trace.get_current_span()
@@ -70,54 +373,362 @@ def copy_content_to_redshift(file: dict):
         "file.columns": file["columns"], "bucket.name": S3_BUCKET_NAME
     })
 
-    redshift = boto3.client('redshift-data', region_name=AWS_REGION)
+    redshift = get_client('redshift-data')
 
-    # remove file extension from filename
-    filename = os.path.splitext(file["filename"])[0]
-    table_name = re.sub(r'[^a-zA-Z0-9_]', '_', filename)
+    table_name = get_table_name(file["filename"])
 
     span.set_attribute("wharehouse.table.name", table_name)
 
-    print("creating table", table_name, "for file", file["filename"])
-    exec_and_wait(redshift, f"""
-        CREATE TABLE IF NOT EXISTS "public"."{table_name}" (
-            "timestamp" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            "file_id" VARCHAR(10000) DEFAULT '{file["id"]}',
-            "file_name" VARCHAR(10000) DEFAULT '{file["filename"]}',
-            {', '.join([f'"{c}" VARCHAR(10000)' for c in file["columns"]])}
-        );
-    """)
+    manifest_key = write_parts([file])
 
     print("copying data from s3 to redshift to table:", table_name,"file:", file["filename"])
-    exec_and_wait(redshift, f"""
-        COPY {table_name} ({', '.join([f'"{c}"' for c in file["columns"]])})
-        FROM 's3://{S3_BUCKET_NAME}/{file['filename']}'
-        IAM_ROLE default
-        REGION '{AWS_REGION}'
-        IGNOREHEADER 1
-        FORMAT CSV;
-    """, max_checks=-1)
+    try:
+        load_into_table(
+            redshift, table_name, file, [file],
+            replace_files_queries(table_name, file["columns"], [file], manifest_key),
+        )
+    finally:
+        delete_parts(manifest_key)
+
+
+@tracer.start_as_current_span("copy_files_to_redshift")
+def copy_files_to_redshift(files: List[dict]):
+    """
+        Loads several files with the same table and columns with a single
+        COPY in a transaction, replacing the rows of the files loaded before
+    """
+    span = trace.get_current_span()
+
+    table_name = get_table_name(files[0]["filename"])
+    columns = files[0]["columns"]
+
+    span.set_attributes({
+        "file.names": [f["filename"] for f in files], "file.ids": [f["id"] for f in files],
+        "file.columns": columns, "bucket.name": S3_BUCKET_NAME,
+        "wharehouse.table.name": table_name,
+    })
+
+    redshift = get_client('redshift-data')
+
+    manifest_key = write_parts(files)
+
+    print("copying", len(files), "files from s3 to redshift to table:", table_name)
+    try:
+        load_into_table(
+            redshift, table_name, files[0], files,
+            replace_files_queries(table_name, columns, files, manifest_key),
+        )
+    finally:
+        delete_parts(manifest_key)
+
+
+def delete_parts(manifest_key: str):
+    try:
+        delete_split(manifest_key)
+    except Exception as e:
+        # the parts are overwritten if the files are loaded again, and expire with the prefix
+        print("failed to delete the parts of the manifest:", manifest_key, e)
+
+
+def load_into_table(
+    client: boto3.client, table_name: str, file: dict, files: List[dict], load: List[str],
+    varchar_columns: FrozenSet[str] = frozenset(),
+):
+    """
+        Runs the load queries, creating the table or adding the missing columns
+        of the file in the same transaction when needed.
+
+        When the COPY fails because some values don't fit the type of their
+        column, the columns are changed to VARCHAR and the files are loaded
+        again, otherwise every retry and the later files of the table would
+        fail the same way.
+
+        Parameters:
+            client: boto3 client of redshift
+            table_name: table where the data is loaded
+            file: metadata of the file, its columns are the ones loaded
+            files: metadata of the files loaded, used to infer the column types
+            load: queries that load the files (see replace_files_queries)
+            varchar_columns: columns created as VARCHAR whatever their inferred type
+    """
+    ddl = get_schema_changes(client, table_name, file, files, varchar_columns)
+    start = time.perf_counter()
+    try:
+        exec_and_wait(client, [*ddl, *load], timeout=None)
+    except Exception as e:
+        # the table could have been changed outside the pipeline
+        forget_table(table_name)
+        copy_duration.record(
+            time.perf_counter() - start, {"table.name": table_name, "error": True}
+        )
+        if LOAD_ERROR not in str(e):
+            raise
+
+        failed_columns = fetch_load_error_columns(client, files) - varchar_columns
+        if not failed_columns:
+            raise
+        print("the values don't fit the type of the columns, they are changed to VARCHAR:",
+              table_name, sorted(failed_columns))
+        convert_columns_to_varchar(client, table_name, failed_columns)
+        load_into_table(client, table_name, file, files, load, varchar_columns | failed_columns)
+        return
+    copy_duration.record(
+        time.perf_counter() - start, {"table.name": table_name, "error": False}
+    )
+
+    # the columns added by the load are at the end, after the ones of a new table
+    known_columns = get_table_columns(table_name) or TABLE_COLUMNS
+    set_table_columns(table_name, [*known_columns, *file["columns"]])
+
+
+@tracer.start_as_current_span("get_schema_changes")
+def get_schema_changes(
+    client: boto3.client, table_name: str, file: dict, files: List[dict],
+    varchar_columns: FrozenSet[str] = frozenset(),
+) -> List[str]:
+    """
+        Returns the DDL queries needed for the table to have the columns of the file,
+        it's empty when the table is known to be up to date
+    """
+    span = trace.get_current_span()
+    span.set_attribute("wharehouse.table.name", table_name)
+
+    known_columns = get_table_columns(table_name)
+    span.set_attribute("schema_cache.hit", known_columns is not None)
+
+    backfill = []
+    if known_columns is None:
+        known_columns, legacy_file_id = fetch_table_columns(client, table_name)
+        span.set_attribute("schema.legacy_file_id", legacy_file_id is not None)
+        if legacy_file_id is not None:
+            # runs with the load, when it fails the table is forgotten and checked again
+            backfill = backfill_file_id_queries(table_name, legacy_file_id)
+        if known_columns:
+            set_table_columns(table_name, known_columns)
+
+    column_types = [
+        VARCHAR if c.lower() in varchar_columns else t
+        for c, t in zip(file["columns"], infer_file_column_types(file["columns"], files))
+    ]
+    if not known_columns:
+        return [create_table_query(table_name, file, column_types)]
+
+    # redshift lowercases identifiers
+    missing = [c for c in file["columns"] if c.lower() not in known_columns]
+    span.set_attribute("schema.missing_columns", missing)
+    if not missing:
+        return backfill
+
+    column_types = dict(zip(file["columns"], column_types))
+    return backfill + [
+        f'ALTER TABLE "public"."{table_name}" ADD COLUMN "{c}" {column_types[c]} '
+        f'ENCODE {get_encoding(column_types[c])};'
+        for c in missing
+    ]
+
+
+@tracer.start_as_current_span("fetch_table_columns")
+def fetch_table_columns(
+    client: boto3.client, table_name: str
+) -> Tuple[List[str], Optional[str]]:
+    """
+        Returns the columns of the table in redshift in order, empty if it
+        doesn't exist, and the DEFAULT of its file_id when its rows have to
+        be backfilled (see backfill_file_id_queries)
+    """
+    query_id = exec_and_wait(client, f"""
+        SELECT column_name, column_default, remarks FROM svv_columns
+        WHERE table_schema = 'public' AND table_name = '{table_name.lower()}'
+        ORDER BY ordinal_position;
+    """)
+
+    columns = []
+    legacy_file_id = None
+    params = {"Id": query_id}
+    while True:
+        res = client.get_statement_result(**params)
+        for name, default, remarks in res.get("Records", []):
+            columns.append(name["stringValue"])
+            if name["stringValue"] != "file_id" or remarks.get("stringValue") == FILE_ID_COMMENT:
+                continue
+            # e.g. '01J...'::character varying
+            match = re.match(r"^'(.*)'::", default.get("stringValue") or "")
+            legacy_file_id = match.group(1) if match else None
+        if not res.get("NextToken"):
+            break
+        params["NextToken"] = res["NextToken"]
+
+    return columns, legacy_file_id
+
+
+# error of the COPY when some values couldn't be loaded, its details are
+# in sys_load_error_detail
+LOAD_ERROR = "Load into table"
+
+
+def fetch_rows(client: boto3.client, query: str) -> List[list]:
+    """ Runs the query and returns the values of its rows, None for NULL """
+    query_id = exec_and_wait(client, query)
+
+    rows = []
+    params = {"Id": query_id}
+    while True:
+        res = client.get_statement_result(**params)
+        rows.extend(
+            [None if v.get("isNull") else list(v.values())[0] for v in r]
+            for r in res.get("Records", [])
+        )
+        if not res.get("NextToken"):
+            break
+        params["NextToken"] = res["NextToken"]
+    return rows
+
+
+@tracer.start_as_current_span("fetch_load_error_columns")
+def fetch_load_error_columns(client: boto3.client, files: List[dict]) -> FrozenSet[str]:
+    """ Columns with the values that couldn't be loaded in the last COPY of the files """
+    span = trace.get_current_span()
+
+    # the parts of the files (see splitting.py)
+    conditions = []
+    for file in files:
+        parts = quote_literal(f"s3://{S3_BUCKET_NAME}/{SPLITS_PREFIX}/{file['id']}/%")
+        conditions.append(f"TRIM(file_name) LIKE {parts}")
+
+    rows = fetch_rows(client, f"""
+        SELECT DISTINCT TRIM(column_name) FROM sys_load_error_detail
+        WHERE start_time > DATEADD(hour, -1, GETDATE()) AND ({' OR '.join(conditions)});
+    """)
+    columns = frozenset(r[0].lower() for r in rows if r[0])
+    span.set_attribute("warehouse.load_error_columns", sorted(columns))
+    return columns
+
+
+# a batch of the data api has up to 40 statements, 3 per column and the UPDATE
+CONVERT_COLUMNS_PER_BATCH = 12
+
+
+@tracer.start_as_current_span("convert_columns_to_varchar")
+def convert_columns_to_varchar(client: boto3.client, table_name: str, columns: FrozenSet[str]):
+    """
+        Changes the type of the columns of the table to VARCHAR keeping their
+        values, the ones that don't exist yet (e.g. the table was created by
+        the failed load) are skipped.
+
+        Only the length of a VARCHAR can be changed in place, the values of
+        the other columns are copied to a new VARCHAR column that replaces
+        them at the end of the table, and the new order of the columns is
+        saved in the schema cache.
+
+        The copy is an UPDATE, which writes a new version of every row with
+        a value in the columns (the old ones are reclaimed by the automatic
+        vacuum), so its cost grows with the table. The columns are copied
+        with a single UPDATE, and a column is only converted once because a
+        VARCHAR(65535) fits any value.
+    """
+    span = trace.get_current_span()
+    span.set_attributes({"wharehouse.table.name": table_name, "table.columns": sorted(columns)})
+
+    table = f'"public"."{table_name}"'
+    rows = fetch_rows(client, f"""
+        SELECT column_name, data_type, character_maximum_length FROM svv_columns
+        WHERE table_schema = 'public' AND table_name = {quote_literal(table_name.lower())};
+    """)
+    sort_key = fetch_rows(client, f"""
+        SELECT sortkey1 FROM svv_table_info
+        WHERE "schema" = 'public' AND "table" = {quote_literal(table_name.lower())};
+    """)
+
+    copied = []
+    for column, data_type, max_length in rows:
+        if column not in columns:
+            continue
+
+        if data_type == "character varying":
+            # only the length changes, it can't run in a transaction
+            if max_length != 65535:
+                exec_and_wait(
+                    client, f'ALTER TABLE {table} ALTER COLUMN "{column}" TYPE {VARCHAR};',
+                    timeout=None,
+                )
+            continue
+
+        # a sort key column can't be dropped
+        if sort_key and (sort_key[0][0] or "").strip().lower() == column:
+            exec_and_wait(client, f'ALTER TABLE {table} ALTER SORTKEY NONE;', timeout=None)
+        copied.append((column, data_type))
+
+    span.set_attribute("table.copied_columns", [c for c, _ in copied])
+    for i in range(0, len(copied), CONVERT_COLUMNS_PER_BATCH):
+        batch = copied[i:i + CONVERT_COLUMNS_PER_BATCH]
+        queries = [
+            f'ALTER TABLE {table} ADD COLUMN "{column}__varchar" {VARCHAR} ENCODE ZSTD;'
+            for column, _ in batch
+        ]
+        assignments = []
+        for column, data_type in batch:
+            # booleans can't be cast to VARCHAR
+            value = (
+                f"""CASE WHEN "{column}" THEN 'true' WHEN NOT "{column}" THEN 'false' END"""
+                if data_type == "boolean" else f'"{column}"::{VARCHAR}'
+            )
+            assignments.append(f'"{column}__varchar" = {value}')
+        # the new columns are NULL, only the rows with a value are updated
+        with_values = " OR ".join(f'"{column}" IS NOT NULL' for column, _ in batch)
+        queries.append(f'UPDATE {table} SET {", ".join(assignments)} WHERE {with_values};')
+        for column, _ in batch:
+            queries += [
+                f'ALTER TABLE {table} DROP COLUMN "{column}";',
+                f'ALTER TABLE {table} RENAME COLUMN "{column}__varchar" TO "{column}";',
+            ]
+        exec_and_wait(client, queries, timeout=None)
+
+    # the table whose file_id has to be backfilled is left out of the cache,
+    # the next load fetches its columns and backfills it
+    table_columns, legacy_file_id = fetch_table_columns(client, table_name)
+    if table_columns and legacy_file_id is None:
+        set_table_columns(table_name, table_columns)
+
+
+def poll_intervals():
+    """
+        Yields the seconds to wait between checks of a query status,
+        short at first and growing exponentially up to POLL_MAX_INTERVAL
+    """
+    interval = POLL_INITIAL_INTERVAL
+    while True:
+        # jitter avoids queries started together checking in lockstep
+        yield random.uniform(interval / 2, interval)
+        interval = min(interval * POLL_BACKOFF_FACTOR, POLL_MAX_INTERVAL)
 
 
 @tracer.start_as_current_span("exec_and_wait_query") 
-def exec_and_wait(client: boto3.client, query: str, max_checks: int = 20):
+def exec_and_wait(client: boto3.client, query: Union[str, List[str]], timeout: float = 20):
     """
         Executes a query and waits for it to finish.
-        If max_checks is not provided, it will wait indefinitely.
+        If a list of queries is given they run in a single transaction.
+        If timeout is None, it will wait indefinitely.
 
         Parameters:
             client: boto3 client of redshift
-            query: query to execute
-            max_checks: maximum number of checks to wait for the query to finish (-1 for infinite)
+            query: query or list of queries to execute
+            timeout: maximum seconds to wait for the query to finish (None for infinite)
     """
     exec_span = trace.get_current_span()
     exec_span.set_attribute("warehouse.query", query)
 
-    stm = client.execute_statement(
-        WorkgroupName=REDSHIFT_WORKGROUP,
-        Database=REDSHIFT_DATABASE,
-        Sql=query
-    )
+    if isinstance(query, list):
+        stm = client.batch_execute_statement(
+            WorkgroupName=REDSHIFT_WORKGROUP,
+            Database=REDSHIFT_DATABASE,
+            Sqls=query
+        )
+    else:
+        stm = client.execute_statement(
+            WorkgroupName=REDSHIFT_WORKGROUP,
+            Database=REDSHIFT_DATABASE,
+            Sql=query
+        )
     if stm.get('ResponseMetadata', {}).get('HTTPStatusCode') != 200:
         raise Exception("Failed to execute statement")
 
@@ -125,34 +736,31 @@ def exec_and_wait(client: boto3.client, query: str, max_checks: int = 20):
 
     exec_span.set_attribute("query.id", query_id)
 
+    deadline = None if timeout is None else time.monotonic() + timeout
     last_status = ""
     checks = 0
-    while True:
-        with tracer.start_as_current_span("check-query-status") as check_span:
-            if max_checks  > -1:
-                checks += 1
-                if checks > max_checks:
-                    check_span.add_event("max-checks")
-                    raise Exception("Timeout waiting for copy data to finish")
-
+    try:
+        for interval in poll_intervals():
             desc = client.describe_statement(Id=query_id)
             status = desc.get('Status')
+            checks += 1
 
-            check_span.set_attribute("warehouse.query.status", status)
-
-            # show logs only if status changed
+            # record only the status transitions instead of every check
             if last_status != status:
-                print("describe statement:", status, desc, "... waiting 1 second")
+                print("describe statement:", status, desc)
+                exec_span.add_event("warehouse.query.status", {
+                    "warehouse.query.status": status, "warehouse.query.checks": checks,
+                })
                 last_status = status
 
             if status == 'FINISHED':
-                check_span.add_event("warehouse.query.finished")
+                exec_span.add_event("warehouse.query.finished")
                 break
 
-            if status == 'FAILED':
-                check_span.add_event("warehouse.query.failed")
-                check_span.set_attribute("error", True)
-                
+            if status in ('FAILED', 'ABORTED'):
+                exec_span.add_event("warehouse.query.failed")
+                exec_span.set_attribute("error", True)
+
                 error_message = desc.get('Error', '')
                 if 'Failed to set ClientInfo property: ApplicationName' in error_message:
                     # This is a known non-critical error, continue execution
@@ -161,6 +769,12 @@ def exec_and_wait(client: boto3.client, query: str, max_checks: int = 20):
                 else:
                     raise Exception(f"Failed to copy data: {error_message}")
 
-            time.sleep(1)
+            if deadline is not None and time.monotonic() + interval > deadline:
+                exec_span.add_event("timeout")
+                raise Exception("Timeout waiting for copy data to finish")
+
+            time.sleep(interval)
+    finally:
+        exec_span.set_attribute("warehouse.query.checks", checks)
 
     return query_id
@@ -0,0 +1,392 @@
+"""
+    Rewrites the csv files of a load into gzip parts and a COPY manifest, so
+    redshift loads all of them with a single COPY, in parallel in its slices.
+
+    The id and the name of the file are added at the beginning of every row
+    of its parts, so the rows of the COPY can be told apart and replaced by
+    file (see replace_files_queries in services.py).
+
+    A large object is divided in byte ranges aligned to the beginning of a
+    line, every range is read, compressed and uploaded by a worker thread in
+    constant memory, and every part starts with the header of the file so
+    the COPY skips it with IGNOREHEADER 1.
+
+    The ranges are aligned to line breaks, which can be inside a quoted field.
+    The quotes of every range are counted while it's compressed, a range that
+    starts and ends between rows has an even number of them, so when a range
+    ends inside quotes the parts are deleted and the file is written in a
+    single part.
+"""
+import os
+import json
+import gzip
+import math
+import uuid
+from collections import Counter
+from typing import List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from opentelemetry import trace, context as otel_context
+
+from .clients import get_client
+
+S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+# files of this size or bigger are split in several parts, 0 disables it
+SPLIT_THRESHOLD_BYTES = int(os.getenv("SPLIT_THRESHOLD_BYTES", str(256 * 1024 * 1024)))
+# the number of parts is a multiple of the slices of the workgroup, so every
+# slice loads the same amount of data
+REDSHIFT_SLICES = int(os.getenv("REDSHIFT_SLICES", "8"))
+# max size of a part before compressing it, redshift recommends 1MB - 1GB compressed
+SPLIT_MAX_PART_SIZE = int(os.getenv("SPLIT_MAX_PART_SIZE", str(1024 * 1024 * 1024)))
+# parts written at the same time, every one uses about 6MB of memory. One
+# per vcpu, gzip releases the GIL so they are compressed in parallel (a lambda
+# has a vcpu per 1769MB of memory)
+SPLIT_CONCURRENCY = int(os.getenv("SPLIT_CONCURRENCY", str(os.cpu_count() or 1)))
+# gzip level, the low levels compress csv files almost as well and much faster
+SPLIT_COMPRESS_LEVEL = int(os.getenv("SPLIT_COMPRESS_LEVEL", "3"))
+# folder of the bucket where the parts and manifests are written
+SPLITS_PREFIX = os.getenv("SPLITS_PREFIX", "splits")
+
+# size of the pieces read from s3
+READ_CHUNK_SIZE = 1024 * 1024
+# size of the multipart upload parts of the compressed files, the s3 minimum
+UPLOAD_PART_SIZE = 5 * 1024 * 1024
+# bytes read at a boundary to find the next line break
+ALIGN_READ_SIZE = 64 * 1024
+
+tracer = trace.get_tracer(__name__)
+
+
+def should_split(file: dict) -> bool:
+    return SPLIT_THRESHOLD_BYTES > 0 and int(file.get("file_size") or 0) >= SPLIT_THRESHOLD_BYTES
+
+
+def count_parts(size: int) -> int:
+    """ Smallest multiple of the slices with parts up to SPLIT_MAX_PART_SIZE """
+    return REDSHIFT_SLICES * max(1, math.ceil(size / (REDSHIFT_SLICES * SPLIT_MAX_PART_SIZE)))
+
+
+def read_range(key: str, start: int, end: int) -> bytes:
+    """ Reads the bytes [start, end) of the object """
+    s3 = get_client('s3')
+    res = s3.get_object(Bucket=S3_BUCKET_NAME, Key=key, Range=f"bytes={start}-{end - 1}")
+    return res["Body"].read()
+
+
+def next_line_start(key: str, offset: int, size: int) -> int:
+    """ Position of the first line that starts at the offset or after it """
+    if offset <= 0 or offset >= size:
+        return min(max(offset, 0), size)
+
+    # the line starts at the offset when the previous byte is a line break
+    position = offset - 1
+    while position < size:
+        data = read_range(key, position, min(position + ALIGN_READ_SIZE, size))
+        index = data.find(b"\n")
+        if index != -1:
+            return position + index + 1
+        position += len(data)
+    return size
+
+
+def read_header(key: str, size: int) -> bytes:
+    """ First line of the file, with its line break """
+    end = next_line_start(key, 1, size)
+    return read_range(key, 0, end)
+
+
+class MultipartWriter:
+    """
+        File-like object that uploads what is written to the object with a
+        multipart upload, keeping up to UPLOAD_PART_SIZE bytes in memory
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.size = 0
+        self._buffer = bytearray()
+        self._parts: List[dict] = []
+        self._upload_id: Optional[str] = None
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self.size += len(data)
+        if len(self._buffer) >= UPLOAD_PART_SIZE:
+            self._upload_buffer()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_buffer(self):
+        s3 = get_client('s3')
+        if self._upload_id is None:
+            res = s3.create_multipart_upload(Bucket=S3_BUCKET_NAME, Key=self.key)
+            self._upload_id = res["UploadId"]
+
+        part_number = len(self._parts) + 1
+        res = s3.upload_part(
+            Bucket=S3_BUCKET_NAME, Key=self.key, UploadId=self._upload_id,
+            PartNumber=part_number, Body=bytes(self._buffer),
+        )
+        self._parts.append({"PartNumber": part_number, "ETag": res["ETag"]})
+        self._buffer.clear()
+
+    def close(self):
+        s3 = get_client('s3')
+        # small objects are uploaded with a single request
+        if self._upload_id is None:
+            s3.put_object(Bucket=S3_BUCKET_NAME, Key=self.key, Body=bytes(self._buffer))
+            return
+
+        if self._buffer:
+            self._upload_buffer()
+        s3.complete_multipart_upload(
+            Bucket=S3_BUCKET_NAME, Key=self.key, UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},
+        )
+
+    def abort(self):
+        if self._upload_id is not None:
+            get_client('s3').abort_multipart_upload(
+                Bucket=S3_BUCKET_NAME, Key=self.key, UploadId=self._upload_id,
+            )
+
+
+
+
+# every byte but the double quotes and the line breaks
+NOT_QUOTES_OR_BREAKS = bytes(b for b in range(256) if b not in b'"\n')
+
+
+def quote_field(value: str) -> bytes:
+    return b'"' + value.encode().replace(b'"', b'""') + b'"'
+
+
+class RowPrefixer:
+    """
+        Adds the prefix at the beginning of every row of the csv written in
+        chunks. The quotes of every line are counted, so a line break inside
+        a quoted field doesn't start a row. Empty lines are kept as they are.
+    """
+
+    def __init__(self, prefix: bytes):
+        self.prefix = prefix
+        # the next byte is the first of a line, and the line is outside quotes
+        self.line_start = True
+        self.quoted = False
+        # carriage returns at the end of a chunk, when they start a line it's
+        # unknown yet whether the line is empty
+        self.pending = b""
+
+    def process(self, chunk: bytes) -> bytes:
+        chunk, self.pending = self.pending + chunk, b""
+        # the first line continues the one of the previous chunk
+        first_end = chunk.find(b"\n") + 1
+        if not first_end:
+            return self._process_lines([chunk])
+        out = self._process_lines([chunk[:first_end - 1], b""])
+
+        last_start = chunk.rfind(b"\n") + 1
+        body, last = chunk[first_end:last_start], chunk[last_start:]
+        # fast path, when every complete line has an even number of quotes
+        # every line break starts a row (the quotes of a line are left after
+        # removing the pairs of them when it has an odd number), and without
+        # empty lines (or lines starting with a carriage return) the prefix is
+        # added to all of them
+        odd_lines = b'"' in body.translate(None, NOT_QUOTES_OR_BREAKS).replace(b'""', b"")
+        empty_lines = b"\n\n" in body or b"\n\r" in body or body[:1] in (b"\n", b"\r")
+        if self.quoted or odd_lines or empty_lines:
+            return out + self._process_lines(chunk[first_end:].split(b"\n"))
+
+        if body:
+            out += self.prefix + body[:-1].replace(b"\n", b"\n" + self.prefix) + b"\n"
+        return out + self._process_lines([last])
+
+    def _process_lines(self, lines: List[bytes]) -> bytes:
+        """ The pieces of a chunk split by its line breaks """
+        out = []
+        last = len(lines) - 1
+        for i, line in enumerate(lines):
+            if self.line_start and not self.quoted and line.strip(b"\r"):
+                out.append(self.prefix)
+            out.append(line)
+            if line.count(b'"') % 2:
+                self.quoted = not self.quoted
+            if i < last:
+                out.append(b"\n")
+                self.line_start = True
+            elif self.line_start and not self.quoted and not line.strip(b"\r"):
+                self.pending = out.pop()
+            elif line:
+                self.line_start = False
+        return b"".join(out)
+
+    def flush(self) -> bytes:
+        pending, self.pending = self.pending, b""
+        return pending
+
+
+def write_part(
+    ctx, key: str, part_key: str, prefix: bytes, header: bytes, start: int, end: Optional[int]
+) -> Tuple[int, bool]:
+    """
+        Compresses the header and the bytes [start, end) of the file into the
+        part, with the prefix at the beginning of every row. Returns its size
+        and whether the range ends outside a quoted field.
+    """
+    token = otel_context.attach(ctx)
+    writer = MultipartWriter(part_key)
+    try:
+        with tracer.start_as_current_span("write_split_part") as span:
+            span.set_attributes({
+                "file.name": key, "part.key": part_key, "part.start": start,
+                "part.end": end if end is not None else -1,
+            })
+
+            rows = RowPrefixer(prefix)
+            s3 = get_client('s3')
+            # the whole object when the end is unknown
+            extra = {"Range": f"bytes={start}-{end - 1}"} if end is not None else {}
+            res = s3.get_object(Bucket=S3_BUCKET_NAME, Key=key, **extra)
+            with gzip.GzipFile(fileobj=writer, mode="wb", compresslevel=SPLIT_COMPRESS_LEVEL) as gz:
+                gz.write(rows.process(header))
+                for chunk in res["Body"].iter_chunks(READ_CHUNK_SIZE):
+                    gz.write(rows.process(chunk))
+                gz.write(rows.flush())
+            writer.close()
+
+            span.set_attributes({"part.compressed_size": writer.size, "part.quoted_end": rows.quoted})
+            return writer.size, not rows.quoted
+    except Exception:
+        writer.abort()
+        raise
+    finally:
+        otel_context.detach(token)
+
+
+def part_key(file: dict, index: int) -> str:
+    # the keys depend on the file id, so a retry overwrites the parts of the previous attempt
+    return f"{SPLITS_PREFIX}/{file['id']}/part-{index:04d}.csv.gz"
+
+
+def whole_file_part(file: dict) -> Tuple[dict, str, bytes, int, Optional[int]]:
+    """ A single part with the whole file, header included """
+    return file, part_key(file, 0), b"", 0, None
+
+
+@tracer.start_as_current_span("plan_split")
+def plan_split(file: dict) -> List[Tuple[dict, str, bytes, int, Optional[int]]]:
+    """
+        Divides a large file in ranges aligned to its lines, a part per
+        range: (file, part key, header, start, end). The other files, and
+        the ones whose header has a line break in a quoted field, are
+        written in a single part.
+    """
+    span = trace.get_current_span()
+    key = file["filename"]
+    span.set_attributes({"file.name": key, "file.id": file["id"]})
+    if not should_split(file):
+        return [whole_file_part(file)]
+
+    s3 = get_client('s3')
+    size = s3.head_object(Bucket=S3_BUCKET_NAME, Key=key)["ContentLength"]
+
+    header = read_header(key, size)
+    if header.count(b'"') % 2:
+        span.set_attribute("split.quoted_line_break", True)
+        return [whole_file_part(file)]
+    data_size = size - len(header)
+    parts = count_parts(data_size)
+    boundaries = [len(header)] + [
+        next_line_start(key, len(header) + data_size * i // parts, size)
+        for i in range(1, parts)
+    ] + [size]
+
+    # ranges without lines are skipped, e.g. lines longer than a part
+    ranges: List[Tuple[int, int]] = [
+        (start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start
+    ]
+    span.set_attributes({"file.size": size, "split.parts": len(ranges)})
+    return [(file, part_key(file, i), header, *r) for i, r in enumerate(ranges)]
+
+
+@tracer.start_as_current_span("write_parts")
+def write_parts(files: List[dict]) -> str:
+    """
+        Rewrites the files in gzip parts with the id and the name of their
+        file at the beginning of every row, and returns the key of the COPY
+        manifest of all of them. The large files are split in several parts.
+
+        The parts of all the files are written at the same time, and a split
+        file whose range starts or ends inside a quoted field (a line break
+        in a value) is written again in a single part.
+    """
+    span = trace.get_current_span()
+    ctx = otel_context.get_current()
+
+    def write(part: Tuple[dict, str, bytes, int, Optional[int]]) -> Tuple[int, bool]:
+        file, key, header, start, end = part
+        prefix = quote_field(file["id"]) + b"," + quote_field(file["filename"]) + b","
+        return write_part(ctx, file["filename"], key, prefix, header, start, end)
+
+    parts = [p for file in files for p in plan_split(file)]
+    with ThreadPoolExecutor(max_workers=SPLIT_CONCURRENCY) as pool:
+        results = list(pool.map(write, parts))
+
+        # a file in a single part with an odd number of quotes is malformed, the COPY reports it
+        parts_per_file = Counter(p[0]["id"] for p in parts)
+        unbalanced = {
+            p[0]["id"] for p, (_, balanced) in zip(parts, results)
+            if not balanced and parts_per_file[p[0]["id"]] > 1
+        }
+        if unbalanced:
+            span.set_attribute("split.quoted_line_break", sorted(unbalanced))
+            delete_objects([p[1] for p in parts if p[0]["id"] in unbalanced])
+            kept = [(p, r) for p, r in zip(parts, results) if p[0]["id"] not in unbalanced]
+            rewritten = [whole_file_part(f) for f in files if f["id"] in unbalanced]
+            parts = [p for p, _ in kept] + rewritten
+            results = [r for _, r in kept] + list(pool.map(write, rewritten))
+
+    s3 = get_client('s3')
+    manifest_key = f"{SPLITS_PREFIX}/manifests/{uuid.uuid4()}"
+    manifest = {
+        "entries": [
+            {
+                "url": f"s3://{S3_BUCKET_NAME}/{p[1]}",
+                "mandatory": True,
+                "meta": {"content_length": size},
+            }
+            for p, (size, _) in zip(parts, results)
+        ]
+    }
+    s3.put_object(Bucket=S3_BUCKET_NAME, Key=manifest_key, Body=json.dumps(manifest))
+
+    span.set_attributes({
+        "files.count": len(files), "split.parts": len(parts),
+        "split.compressed_size": sum(size for size, _ in results),
+    })
+    return manifest_key
+
+
+def delete_split(manifest_key: str):
+    """ Removes the parts listed in the manifest and the manifest """
+    s3 = get_client('s3')
+    res = s3.get_object(Bucket=S3_BUCKET_NAME, Key=manifest_key)
+    manifest = json.loads(res["Body"].read())
+
+    bucket_prefix = f"s3://{S3_BUCKET_NAME}/"
+    delete_objects([e["url"][len(bucket_prefix):] for e in manifest["entries"]] + [manifest_key])
+
+
+def delete_objects(keys: List[str]):
+    s3 = get_client('s3')
+    # up to 1000 keys per request
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=S3_BUCKET_NAME,
+            Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True},
+        )
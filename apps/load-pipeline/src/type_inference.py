@@ -0,0 +1,116 @@
+from typing import List, Optional
+
+from opentelemetry import trace
+
+tracer = trace.get_tracer(__name__)
+
+# the files are profiled by files-service when they are uploaded
+# (services/profiling.py), they have the type of every column in column_types
+_TYPES = {
+    "boolean": "BOOLEAN",
+    "integer": "BIGINT",
+    # it also accepts the values with exponent, e.g. 1e5
+    "decimal": "DOUBLE PRECISION",
+    "date": "DATE",
+    # the values can have a time zone, the ones without it are UTC
+    "timestamp": "TIMESTAMPTZ",
+}
+# varchar is stored with its actual length, the max doesn't fail with the
+# values longer than the ones of the profile. It's the type of the columns
+# whose values didn't fit and of the ones without a measured length
+VARCHAR = "VARCHAR(65535)"
+VARCHAR_MAX_LENGTH = 65535
+# the string columns are sized from the longest value of the profile (in
+# bytes), multiplied by the headroom and rounded up to a power of two, so a
+# longer value of the rows that weren't sampled still fits. The width of a
+# varchar sets the memory of the queries that sort or hash it
+VARCHAR_HEADROOM = 4
+VARCHAR_MIN_LENGTH = 64
+
+# encodings recommended by redshift for each type, declared in the DDL
+# so COPY doesn't need to analyze compression (COMPUPDATE OFF)
+_ENCODINGS = {
+    "BOOLEAN": "RAW",
+    "BIGINT": "AZ64",
+    "DOUBLE PRECISION": "ZSTD",
+    "DATE": "AZ64",
+    "TIMESTAMPTZ": "AZ64",
+    "VARCHAR": "ZSTD",
+}
+
+
+def varchar(max_length: Optional[int]) -> str:
+    if max_length is None:
+        return VARCHAR
+    length = max(VARCHAR_MIN_LENGTH, max_length * VARCHAR_HEADROOM)
+    # the next power of two
+    length = 1 << (length - 1).bit_length()
+    return VARCHAR if length >= VARCHAR_MAX_LENGTH else f"VARCHAR({length})"
+
+
+def get_encoding(column_type: str) -> str:
+    return _ENCODINGS[column_type.split("(")[0]]
+
+
+def _merge_types(current: Optional[str], new: str) -> str:
+    # the same rules of the profile (see files-service services/profiling.py)
+    if current is None or current == new:
+        return new
+    if {current, new} == {"integer", "decimal"}:
+        return "decimal"
+    if {current, new} == {"date", "timestamp"}:
+        return "timestamp"
+    return "string"
+
+
+def get_sort_key(columns: List[str], column_types: List[str]) -> Optional[str]:
+    """ The first date or timestamp column is a good candidate for the sort key """
+    for column, column_type in zip(columns, column_types):
+        if column_type in ("DATE", "TIMESTAMPTZ"):
+            return column
+    return None
+
+
+@tracer.start_as_current_span("infer_file_column_types")
+def infer_file_column_types(columns: List[str], files: List[dict]) -> List[str]:
+    """
+        Returns the redshift type of each column from the profiles of the files.
+
+        The profile of a large file is a sample of it, so a later row may not
+        fit the type or the length of its column. Those loads fail with a load
+        error, the failed columns are changed to VARCHAR(65535) and the files
+        are loaded again (see services.load_into_table), which is cheaper than
+        making every column of the sampled files VARCHAR(65535).
+
+        Parameters:
+            columns: columns of the table
+            files: metadata of the files loaded, with their column_types and
+                column_max_lengths
+    """
+    span = trace.get_current_span()
+
+    # the columns of the files without a profile could have any value
+    profiled = all(f.get("column_types") for f in files)
+
+    profile_types = {}
+    max_lengths = {}
+    for file in files if profiled else []:
+        for column, column_type in zip(file["columns"], file.get("column_types") or []):
+            profile_types[column] = _merge_types(profile_types.get(column), column_type)
+        for column, length in zip(file["columns"], file.get("column_max_lengths") or []):
+            max_lengths[column] = max(max_lengths.get(column, 0), length)
+
+    # the files profiled before the lengths were measured have VARCHAR(65535)
+    measured = all(f.get("column_max_lengths") for f in files)
+    column_types = [
+        _TYPES.get(profile_types.get(c)) or varchar(max_lengths.get(c) if measured else None)
+        for c in columns
+    ]
+
+    span.set_attributes({
+        "file.names": [f["filename"] for f in files], "file.columns": columns,
+        "file.profiled": profiled,
+        "file.sampled": any(f.get("row_count_estimated") is not False for f in files),
+        "warehouse.column_types": column_types,
+    })
+    return column_types
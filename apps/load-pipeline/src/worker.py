@@ -0,0 +1,224 @@
+"""
+    Long running consumer of the files queue, an alternative to the lambda for
+    sustained loads: the process, its clients and its instrumentation are
+    started once, and there is no limit of 15 minutes per invocation.
+
+    Every message is processed with `process_message`, the same function used
+    by the lambda. Run it from apps/load-pipeline:
+
+        SQS_QUEUE_URL=<queue url> python -m src.worker
+"""
+import os
+import time
+import signal
+import threading
+from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+
+from opentelemetry import trace
+from opentelemetry.instrumentation.utils import suppress_instrumentation
+
+from .app import process_message
+from .services import renew_load_leases
+from .clients import get_client
+from .instrumentation import flush_spans
+
+SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
+# messages processed at the same time
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "10"))
+# seconds that a receive waits for messages (long polling, max 20)
+WORKER_WAIT_TIME = int(os.getenv("WORKER_WAIT_TIME", "20"))
+# seconds that the messages in progress are hidden from other consumers, it's
+# extended every WORKER_HEARTBEAT_INTERVAL seconds while the COPY runs, with
+# the lease of their files (LOAD_LEASE_SECONDS)
+WORKER_VISIBILITY_TIMEOUT = int(os.getenv("WORKER_VISIBILITY_TIMEOUT", "300"))
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "60"))
+# seconds between the deletes of the processed messages and the export of the spans
+WORKER_FLUSH_INTERVAL = float(os.getenv("WORKER_FLUSH_INTERVAL", "1"))
+
+# max entries of the sqs batch requests
+SQS_BATCH_SIZE = 10
+
+
+def to_record(message: dict) -> dict:
+    """ Message of ReceiveMessage in the format of the lambda event records """
+    return {
+        "messageId": message["MessageId"],
+        "receiptHandle": message["ReceiptHandle"],
+        "body": message["Body"],
+        "attributes": message.get("Attributes", {}),
+        "messageAttributes": {
+            k: {"stringValue": v.get("StringValue"), "dataType": v["DataType"]}
+            for k, v in message.get("MessageAttributes", {}).items()
+        },
+    }
+
+
+class QueueWorker:
+    """
+        Receives messages of the queue while there are free workers, processes
+        them in a pool of `concurrency` threads and deletes the processed ones
+        in batches. The failed messages are not deleted, they return to the
+        queue when their visibility timeout expires, like the lambda failures.
+    """
+
+    def __init__(
+        self,
+        queue_url: str = SQS_QUEUE_URL,
+        concurrency: int = WORKER_CONCURRENCY,
+        visibility_timeout: int = WORKER_VISIBILITY_TIMEOUT,
+    ):
+        if not queue_url:
+            raise Exception("SQS_QUEUE_URL is required")
+
+        self.queue_url = queue_url
+        self.concurrency = concurrency
+        self.visibility_timeout = visibility_timeout
+        self.sqs = get_client("sqs")
+
+        # receipt handles of the messages in progress and of the processed ones
+        self._in_progress: Dict[str, str] = {}
+        self._processed: List[str] = []
+        self._lock = threading.Condition()
+        self._stop = threading.Event()
+        # set when the messages in progress are finished, after the stop
+        self._finished = threading.Event()
+
+    def _free_workers(self) -> int:
+        """ Waits until a worker is free, returns the number of free workers """
+        with self._lock:
+            while len(self._in_progress) >= self.concurrency and not self._stop.is_set():
+                self._lock.wait(timeout=1)
+            return self.concurrency - len(self._in_progress)
+
+    def _receive(self, max_messages: int) -> List[dict]:
+        # the polls are not traced, most of them don't return messages
+        with suppress_instrumentation():
+            res = self.sqs.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=min(max_messages, SQS_BATCH_SIZE),
+                WaitTimeSeconds=WORKER_WAIT_TIME,
+                VisibilityTimeout=self.visibility_timeout,
+                AttributeNames=["SentTimestamp"],
+                MessageAttributeNames=["All"],
+            )
+        return res.get("Messages", [])
+
+    def _process(self, record: dict):
+        receipt_handle = record["receiptHandle"]
+        try:
+            process_message(record)
+            processed = True
+        except Exception as e:
+            print("failed to process message:", record["messageId"], e)
+            processed = False
+
+        with self._lock:
+            del self._in_progress[receipt_handle]
+            if processed:
+                self._processed.append(receipt_handle)
+            self._lock.notify_all()
+
+    def _change_visibility(self, receipt_handles: List[str], timeout: int):
+        for i in range(0, len(receipt_handles), SQS_BATCH_SIZE):
+            chunk = receipt_handles[i:i + SQS_BATCH_SIZE]
+            res = self.sqs.change_message_visibility_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": str(n), "ReceiptHandle": handle, "VisibilityTimeout": timeout}
+                    for n, handle in enumerate(chunk)
+                ],
+            )
+            for failed in res.get("Failed", []):
+                print("failed to change the visibility of a message:", failed)
+
+    def _delete_processed(self):
+        with self._lock:
+            handles, self._processed = self._processed, []
+
+        for i in range(0, len(handles), SQS_BATCH_SIZE):
+            chunk = handles[i:i + SQS_BATCH_SIZE]
+            res = self.sqs.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{"Id": str(n), "ReceiptHandle": h} for n, h in enumerate(chunk)],
+            )
+            # a message not deleted is processed again once it's visible
+            for failed in res.get("Failed", []):
+                print("failed to delete a message:", failed)
+
+    def _maintain(self):
+        """
+            Deletes the processed messages, exports the spans and extends the
+            visibility of the messages in progress and the leases of their
+            files, also while the worker stops
+        """
+        last_heartbeat = time.monotonic()
+        while not self._finished.wait(WORKER_FLUSH_INTERVAL):
+            try:
+                self._delete_processed()
+                flush_spans()
+
+                if time.monotonic() - last_heartbeat >= WORKER_HEARTBEAT_INTERVAL:
+                    last_heartbeat = time.monotonic()
+                    with self._lock:
+                        handles = list(self._in_progress)
+                    self._change_visibility(handles, self.visibility_timeout)
+                    renew_load_leases()
+            except Exception as e:
+                print("worker maintenance failed:", e)
+
+    def run(self):
+        """ Consumes the queue until stop is called, then finishes the messages in progress """
+        print("worker started, queue:", self.queue_url, "concurrency:", self.concurrency)
+        maintenance = threading.Thread(target=self._maintain, daemon=True)
+        maintenance.start()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while not self._stop.is_set():
+                free = self._free_workers()
+                if self._stop.is_set():
+                    break
+
+                try:
+                    messages = self._receive(free)
+                except Exception as e:
+                    print("failed to receive messages:", e)
+                    self._stop.wait(5)
+                    continue
+
+                if self._stop.is_set():
+                    # received during the shutdown, they are released to other consumers
+                    self._change_visibility([m["ReceiptHandle"] for m in messages], 0)
+                    break
+
+                for message in messages:
+                    record = to_record(message)
+                    with self._lock:
+                        self._in_progress[record["receiptHandle"]] = record["messageId"]
+                    pool.submit(self._process, record)
+
+            print("worker stopping, messages in progress:", len(self._in_progress))
+
+        self._finished.set()
+        maintenance.join()
+        self._delete_processed()
+        flush_spans()
+        print("worker stopped")
+
+    def stop(self, *args):
+        self._stop.set()
+        with self._lock:
+            self._lock.notify_all()
+
+
+def main():
+    worker = QueueWorker()
+    # ECS and kubernetes send SIGTERM before killing the process
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+    trace.get_tracer_provider().shutdown()
+
+
+if __name__ == "__main__":
+    main()
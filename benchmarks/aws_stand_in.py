@@ -0,0 +1,696 @@
+"""
+    In memory stand-in of the aws apis used by the apps: DynamoDB, S3, SQS and
+    the Redshift Data API. It implements only the operations and expressions
+    that the apps use, with the same wire protocol, so the apps run unchanged
+    with AWS_ENDPOINT_URL pointing to it.
+
+    The requests to /v1/traces and /v1/metrics (OTLP over http) are passed to
+    the `on_otlp` callback.
+"""
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.etree import ElementTree
+
+# hash key of every table, the others use "id"
+TABLE_KEYS = {"otel-observability-auth": "token"}
+
+
+class ApiError(Exception):
+    def __init__(self, code: str, message: str, extra: dict = None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.extra = extra or {}
+
+
+def _resolve(token: str, names: dict) -> str:
+    token = token.strip()
+    return names.get(token, token)
+
+
+def _split_top_level(expression: str, separator: str) -> List[str]:
+    """ Splits by the separator outside of parentheses """
+    parts, depth, current = [], 0, ""
+    i = 0
+    while i < len(expression):
+        if expression[i] == "(":
+            depth += 1
+        elif expression[i] == ")":
+            depth -= 1
+        if depth == 0 and expression[i:i + len(separator)] == separator:
+            parts.append(current)
+            current = ""
+            i += len(separator)
+            continue
+        current += expression[i]
+        i += 1
+    parts.append(current)
+    return parts
+
+
+def _evaluate_condition(expression: Optional[str], item: Optional[dict], names: dict, values: dict) -> bool:
+    """ attribute_exists, attribute_not_exists, =, <>, <, >, and IN, joined with AND / OR """
+    if not expression:
+        return True
+    item = item or {}
+
+    for alternative in _split_top_level(expression, " OR "):
+        if all(
+            _evaluate_comparison(c.strip(), item, names, values)
+            for c in _split_top_level(alternative, " AND ")
+        ):
+            return True
+    return False
+
+
+def _evaluate_comparison(condition: str, item: dict, names: dict, values: dict) -> bool:
+    while condition.startswith("(") and condition.endswith(")"):
+        condition = condition[1:-1].strip()
+        if len(_split_top_level(condition, " OR ")) > 1 or len(_split_top_level(condition, " AND ")) > 1:
+            return _evaluate_condition(condition, item, names, values)
+
+    match = re.match(r"^(attribute_exists|attribute_not_exists)\s*\(\s*([^)]+)\)$", condition)
+    if match:
+        exists = _resolve(match.group(2), names) in item
+        return exists if match.group(1) == "attribute_exists" else not exists
+
+    match = re.match(r"^(\S+)\s+IN\s*\((.+)\)$", condition, re.IGNORECASE)
+    if match:
+        value = item.get(_resolve(match.group(1), names))
+        return value in [values[v.strip()] for v in match.group(2).split(",")]
+
+    match = re.match(r"^(\S+)\s*(=|<>)\s*(\S+)$", condition)
+    if match:
+        value = item.get(_resolve(match.group(1), names))
+        expected = values[match.group(3)]
+        return (value == expected) == (match.group(2) == "=")
+
+    match = re.match(r"^(\S+)\s*(<|>)\s*(\S+)$", condition)
+    if match:
+        value = item.get(_resolve(match.group(1), names))
+        if value is None:
+            return False
+        (kind, value), = value.items()
+        (_, expected), = values[match.group(3)].items()
+        if kind == "N":
+            value, expected = float(value), float(expected)
+        return value < expected if match.group(2) == "<" else value > expected
+
+    # not supported, it doesn't block the write
+    return True
+
+
+def _project(item: dict, projection: Optional[str], names: dict) -> dict:
+    if not projection:
+        return item
+    fields = [_resolve(f, names) for f in projection.split(",")]
+    return {k: v for k, v in item.items() if k in fields}
+
+
+class DynamoStandIn:
+    def __init__(self):
+        self.tables: Dict[str, Dict[str, dict]] = {}
+        # (table, key) -> [(status, time)], to measure the time until a file is loaded
+        self.status_changes: Dict[tuple, List[tuple]] = {}
+        self.lock = threading.Lock()
+
+    def _table(self, name: str) -> Dict[str, dict]:
+        return self.tables.setdefault(name, {})
+
+    def _key(self, table: str, key: dict) -> str:
+        hash_key = TABLE_KEYS.get(table, "id")
+        return list(key[hash_key].values())[0]
+
+    def _record_status(self, table: str, key: str, item: dict):
+        if "status" in item:
+            changes = self.status_changes.setdefault((table, key), [])
+            status = item["status"]["S"]
+            if not changes or changes[-1][0] != status:
+                changes.append((status, time.time()))
+
+    def _put(self, request: dict):
+        table = request["TableName"]
+        item = request["Item"]
+        key = self._key(table, item)
+        current = self._table(table).get(key)
+        if not _evaluate_condition(
+            request.get("ConditionExpression"), current,
+            request.get("ExpressionAttributeNames", {}),
+            request.get("ExpressionAttributeValues", {}),
+        ):
+            raise ApiError("ConditionalCheckFailedException", "The conditional request failed")
+        self._table(table)[key] = item
+        self._record_status(table, key, item)
+
+    def _update(self, request: dict) -> dict:
+        table = request["TableName"]
+        key = self._key(table, request["Key"])
+        names = request.get("ExpressionAttributeNames", {})
+        values = request.get("ExpressionAttributeValues", {})
+        current = self._table(table).get(key)
+        if not _evaluate_condition(request.get("ConditionExpression"), current, names, values):
+            returned = request.get("ReturnValuesOnConditionCheckFailure") == "ALL_OLD" and current
+            raise ApiError(
+                "ConditionalCheckFailedException", "The conditional request failed",
+                {"Item": current} if returned else None,
+            )
+
+        item = dict(current or request["Key"])
+        expression = request["UpdateExpression"].strip()
+        if not expression.lower().startswith("set "):
+            raise ApiError("ValidationException", "only SET and REMOVE expressions are supported")
+        # SET a = :a, b = :b [REMOVE c, d]
+        assignments, *removed = re.split(r"\s+remove\s+", expression[4:], 1, flags=re.IGNORECASE)
+        for assignment in _split_top_level(assignments, ","):
+            name, value = assignment.split("=", 1)
+            item[_resolve(name, names)] = values[value.strip()]
+        for name in (removed[0].split(",") if removed else []):
+            item.pop(_resolve(name.strip(), names), None)
+
+        self._table(table)[key] = item
+        self._record_status(table, key, item)
+        return item
+
+    def _delete(self, request: dict):
+        table = request["TableName"]
+        self._table(table).pop(self._key(table, request["Key"]), None)
+
+    def handle(self, operation: str, request: dict) -> dict:
+        with self.lock:
+            return getattr(self, operation)(request)
+
+    def GetItem(self, request: dict) -> dict:
+        table = request["TableName"]
+        item = self._table(table).get(self._key(table, request["Key"]))
+        if item is None:
+            return {}
+        names = request.get("ExpressionAttributeNames", {})
+        return {"Item": _project(item, request.get("ProjectionExpression"), names)}
+
+    def PutItem(self, request: dict) -> dict:
+        self._put(request)
+        return {}
+
+    def UpdateItem(self, request: dict) -> dict:
+        item = self._update(request)
+        return {"Attributes": item} if request.get("ReturnValues") == "ALL_NEW" else {}
+
+    def DeleteItem(self, request: dict) -> dict:
+        self._delete(request)
+        return {}
+
+    def BatchWriteItem(self, request: dict) -> dict:
+        for table, writes in request["RequestItems"].items():
+            for write in writes:
+                if "PutRequest" in write:
+                    self._put({"TableName": table, **write["PutRequest"]})
+                else:
+                    self._delete({"TableName": table, **write["DeleteRequest"]})
+        return {"UnprocessedItems": {}}
+
+    def BatchGetItem(self, request: dict) -> dict:
+        responses = {}
+        for table, keys in request["RequestItems"].items():
+            items = [self._table(table).get(self._key(table, k)) for k in keys["Keys"]]
+            responses[table] = [i for i in items if i is not None]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def TransactWriteItems(self, request: dict) -> dict:
+        # checks every condition before writing anything
+        reasons = []
+        for action in request["TransactItems"]:
+            (kind, params), = action.items()
+            table = params["TableName"]
+            key = self._key(table, params.get("Key") or params.get("Item"))
+            ok = _evaluate_condition(
+                params.get("ConditionExpression"), self._table(table).get(key),
+                params.get("ExpressionAttributeNames", {}),
+                params.get("ExpressionAttributeValues", {}),
+            )
+            reasons.append({"Code": "None"} if ok else {"Code": "ConditionalCheckFailed"})
+
+        if any(r["Code"] != "None" for r in reasons):
+            raise ApiError(
+                "TransactionCanceledException",
+                "Transaction cancelled, please refer cancellation reasons for specific reasons",
+                {"CancellationReasons": reasons},
+            )
+
+        for action in request["TransactItems"]:
+            (kind, params), = action.items()
+            params = {k: v for k, v in params.items() if k != "ConditionExpression"}
+            if kind == "Put":
+                self._put(params)
+            elif kind == "Update":
+                self._update(params)
+            elif kind == "Delete":
+                self._delete(params)
+        return {}
+
+    def _page(self, items: List[dict], table: str, request: dict) -> dict:
+        start = request.get("ExclusiveStartKey")
+        if start:
+            keys = [self._key(table, i) for i in items]
+            start_key = self._key(table, start)
+            items = items[keys.index(start_key) + 1:] if start_key in keys else []
+
+        limit = request.get("Limit")
+        page = items[:limit] if limit else items
+        names = request.get("ExpressionAttributeNames", {})
+
+        # the filter is applied after the Limit, like dynamodb
+        matched = [
+            i for i in page if _evaluate_condition(
+                request.get("FilterExpression"), i, names,
+                request.get("ExpressionAttributeValues", {}),
+            )
+        ]
+        res = {"Count": len(matched), "ScannedCount": len(page)}
+        if request.get("Select") != "COUNT":
+            res["Items"] = [_project(i, request.get("ProjectionExpression"), names) for i in matched]
+        if limit and len(items) > limit:
+            hash_key = TABLE_KEYS.get(table, "id")
+            last = page[-1]
+            res["LastEvaluatedKey"] = {
+                k: v for k, v in last.items() if k in (hash_key, "data_type")
+            }
+        return res
+
+    def Scan(self, request: dict) -> dict:
+        table = request["TableName"]
+        return self._page(list(self._table(table).values()), table, request)
+
+    def Query(self, request: dict) -> dict:
+        """ Only equality on the hash key of the table or of an index sorted by id """
+        table = request["TableName"]
+        names = request.get("ExpressionAttributeNames", {})
+        values = request.get("ExpressionAttributeValues", {})
+        name, value = request["KeyConditionExpression"].split("=")
+        name, value = _resolve(name, names), values[value.strip()]
+
+        items = [i for i in self._table(table).values() if i.get(name) == value]
+        items.sort(
+            key=lambda i: list(i.get("id", {"S": ""}).values())[0],
+            reverse=not request.get("ScanIndexForward", True),
+        )
+        return self._page(items, table, request)
+
+
+class SqsStandIn:
+    """ `duplicate_rate` is the ratio of messages delivered twice, as sqs can do """
+
+    def __init__(self, duplicate_rate: float = 0.0):
+        self.duplicate_rate = duplicate_rate
+        self.queues: Dict[str, List[dict]] = {}
+        # receipt handle -> (queue name, message, time when it's visible again)
+        self.in_flight: Dict[str, tuple] = {}
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.deleted = 0
+
+    def _queue_name(self, queue_url: str) -> str:
+        return queue_url.rstrip("/").split("/")[-1]
+
+    def _message(self, entry: dict) -> dict:
+        return {
+            "messageId": str(uuid.uuid4()),
+            "body": entry["MessageBody"],
+            "attributes": {"SentTimestamp": str(int(time.time() * 1000))},
+            "messageAttributes": {
+                k: {"stringValue": v.get("StringValue"), "dataType": v["DataType"]}
+                for k, v in entry.get("MessageAttributes", {}).items()
+            },
+        }
+
+    def _enqueue(self, queue: List[dict], message: dict):
+        queue.append(message)
+        if random.random() < self.duplicate_rate:
+            queue.append({**message, "messageId": str(uuid.uuid4())})
+
+    def _return_expired(self):
+        now = time.time()
+        for handle, (name, message, visible_at) in list(self.in_flight.items()):
+            if visible_at <= now:
+                del self.in_flight[handle]
+                self.queues.setdefault(name, []).append(message)
+
+    def _take(self, name: str, max_messages: int, visibility_timeout: float) -> List[dict]:
+        self._return_expired()
+        queue = self.queues.setdefault(name, [])
+        messages, queue[:] = queue[:max_messages], queue[max_messages:]
+        for message in messages:
+            handle = str(uuid.uuid4())
+            message["receiptHandle"] = handle
+            self.in_flight[handle] = (name, message, time.time() + visibility_timeout)
+        return messages
+
+    def handle(self, operation: str, request: dict) -> dict:
+        name = self._queue_name(request["QueueUrl"])
+        if operation == "ReceiveMessage":
+            # long polling, waits until there are messages or the wait time ends
+            deadline = time.time() + request.get("WaitTimeSeconds", 0)
+            while True:
+                with self.lock:
+                    messages = self._take(
+                        name, request.get("MaxNumberOfMessages", 1),
+                        request.get("VisibilityTimeout", 30),
+                    )
+                if messages or time.time() >= deadline:
+                    break
+                time.sleep(0.02)
+            return {"Messages": [{
+                "MessageId": m["messageId"],
+                "ReceiptHandle": m["receiptHandle"],
+                "Body": m["body"],
+                "Attributes": m["attributes"],
+                "MessageAttributes": {
+                    k: {"StringValue": v["stringValue"], "DataType": v["dataType"]}
+                    for k, v in m["messageAttributes"].items()
+                },
+            } for m in messages]}
+
+        with self.lock:
+            queue = self.queues.setdefault(name, [])
+            if operation == "SendMessage":
+                message = self._message(request)
+                self._enqueue(queue, message)
+                self.sent += 1
+                return {"MessageId": message["messageId"]}
+            if operation == "SendMessageBatch":
+                successful = []
+                for entry in request["Entries"]:
+                    message = self._message(entry)
+                    self._enqueue(queue, message)
+                    successful.append({"Id": entry["Id"], "MessageId": message["messageId"]})
+                self.sent += len(successful)
+                return {"Successful": successful, "Failed": []}
+            if operation == "DeleteMessageBatch":
+                for entry in request["Entries"]:
+                    if self.in_flight.pop(entry["ReceiptHandle"], None) is not None:
+                        self.deleted += 1
+                return {"Successful": [{"Id": e["Id"]} for e in request["Entries"]], "Failed": []}
+            if operation == "ChangeMessageVisibilityBatch":
+                successful, failed = [], []
+                for entry in request["Entries"]:
+                    in_flight = self.in_flight.get(entry["ReceiptHandle"])
+                    if in_flight is None:
+                        failed.append({
+                            "Id": entry["Id"], "SenderFault": True,
+                            "Code": "ReceiptHandleIsInvalid", "Message": "not in flight",
+                        })
+                        continue
+                    queue_name, message, _ = in_flight
+                    visible_at = time.time() + entry["VisibilityTimeout"]
+                    self.in_flight[entry["ReceiptHandle"]] = (queue_name, message, visible_at)
+                    successful.append({"Id": entry["Id"]})
+                self._return_expired()
+                return {"Successful": successful, "Failed": failed}
+            raise ApiError("InvalidAction", f"{operation} is not supported")
+
+    def receive(self, queue_name: str, max_messages: int) -> List[dict]:
+        """ Takes the next messages of the queue, as the lambda event source does """
+        with self.lock:
+            queue = self.queues.setdefault(queue_name, [])
+            messages, queue[:] = queue[:max_messages], queue[max_messages:]
+            return messages
+
+
+class RedshiftStandIn:
+    """ Every statement finishes after `latency` seconds, the tables are always empty """
+
+    def __init__(self, latency: float = 0.5):
+        self.latency = latency
+        self.statements: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def handle(self, operation: str, request: dict) -> dict:
+        with self.lock:
+            if operation in ("ExecuteStatement", "BatchExecuteStatement"):
+                sqls = request.get("Sqls") or [request["Sql"]]
+                id = str(uuid.uuid4())
+                self.statements[id] = {
+                    "sqls": sqls,
+                    "finished_at": time.time() + self.latency * len(sqls),
+                }
+                return {"Id": id}
+
+            statement = self.statements[request["Id"]]
+            if operation == "DescribeStatement":
+                finished = time.time() >= statement["finished_at"]
+                return {
+                    "Id": request["Id"],
+                    "Status": "FINISHED" if finished else "STARTED",
+                    "HasResultSet": statement["sqls"][-1].strip().upper().startswith("SELECT"),
+                }
+            if operation == "GetStatementResult":
+                return {"Records": [], "ColumnMetadata": [], "TotalNumRows": 0}
+            raise ApiError("ValidationException", f"{operation} is not supported")
+
+    def count(self, keyword: str) -> int:
+        with self.lock:
+            return sum(
+                1 for s in self.statements.values() for sql in s["sqls"]
+                if sql.strip().upper().startswith(keyword)
+            )
+
+
+class S3StandIn:
+    def __init__(self):
+        self.objects: Dict[tuple, bytes] = {}
+        # upload id -> {"bucket", "key", "initiated", "parts": {number: bytes}}
+        self.uploads: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+
+class AwsStandIn:
+    """
+        The aws stand-in listening in 127.0.0.1, use `endpoint_url` as
+        AWS_ENDPOINT_URL of the apps
+    """
+
+    def __init__(
+        self, redshift_latency: float = 0.5, on_otlp: Callable = None, latency: float = 0.0,
+    ):
+        # seconds added to every dynamodb, sqs and s3 request, the network round trip
+        self.latency = latency
+        self.dynamodb = DynamoStandIn()
+        self.sqs = SqsStandIn()
+        self.redshift = RedshiftStandIn(redshift_latency)
+        self.s3 = S3StandIn()
+        self.on_otlp = on_otlp
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self.server.daemon_threads = True
+
+    @property
+    def endpoint_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def _make_handler(aws: AwsStandIn):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def _reply(self, status: int, body: bytes = b"", headers: dict = None):
+            self.send_response(status)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def _body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def _json(self, service, operation: str):
+            request = json.loads(self._body() or b"{}")
+            try:
+                res = service.handle(operation, request)
+                status = 200
+            except ApiError as e:
+                res = {"__type": e.code, "message": e.message, **e.extra}
+                status = 400
+            self._reply(status, json.dumps(res).encode(), {"Content-Type": "application/x-amz-json-1.0"})
+
+        def do_POST(self):
+            if self.path.startswith("/v1/"):
+                body = self._body()
+                if aws.on_otlp is not None:
+                    aws.on_otlp(self.path, body)
+                self._reply(200, headers={"Content-Type": "application/x-protobuf"})
+                return
+
+            target = self.headers.get("X-Amz-Target")
+            # the redshift statements have their own latency
+            if not (target or "").startswith("RedshiftData"):
+                time.sleep(aws.latency)
+            if target:
+                prefix, operation = target.split(".", 1)
+                service = {
+                    "DynamoDB_20120810": aws.dynamodb,
+                    "AmazonSQS": aws.sqs,
+                    "RedshiftData": aws.redshift,
+                }[prefix]
+                self._json(service, operation)
+                return
+
+            self._s3()
+
+        def do_GET(self):
+            time.sleep(aws.latency)
+            self._s3()
+
+        def do_HEAD(self):
+            time.sleep(aws.latency)
+            self._s3()
+
+        def do_PUT(self):
+            time.sleep(aws.latency)
+            self._s3()
+
+        def do_DELETE(self):
+            time.sleep(aws.latency)
+            self._s3()
+
+        def _xml(self, status: int, root: str, fields: dict):
+            element = ElementTree.Element(root)
+            for k, v in fields.items():
+                for value in v if isinstance(v, list) else [v]:
+                    child = ElementTree.SubElement(element, k)
+                    if isinstance(value, dict):
+                        for sk, sv in value.items():
+                            ElementTree.SubElement(child, sk).text = str(sv)
+                    else:
+                        child.text = str(value)
+            self._reply(status, ElementTree.tostring(element), {"Content-Type": "application/xml"})
+
+        def _s3_error(self, status: int, code: str):
+            self._xml(status, "Error", {"Code": code, "Message": code})
+
+        def _s3(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query, keep_blank_values=True)
+            bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+            s3 = aws.s3
+            body = self._body() if self.command in ("PUT", "POST") else b""
+
+            with s3.lock:
+                if self.command == "POST" and "uploads" in query:
+                    upload_id = uuid.uuid4().hex
+                    s3.uploads[upload_id] = {
+                        "bucket": bucket, "key": key, "initiated": time.time(), "parts": {},
+                    }
+                    self._xml(200, "InitiateMultipartUploadResult", {
+                        "Bucket": bucket, "Key": key, "UploadId": upload_id,
+                    })
+                    return
+
+                upload_id = query.get("uploadId", [None])[0]
+                if upload_id is not None and upload_id not in s3.uploads:
+                    self._s3_error(404, "NoSuchUpload")
+                    return
+                upload = s3.uploads.get(upload_id)
+
+                if self.command == "PUT" and upload is not None:
+                    upload["parts"][int(query["partNumber"][0])] = body
+                    self._reply(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+                    return
+
+                if self.command == "POST" and upload is not None:
+                    numbers = [
+                        int(e.text) for e in ElementTree.fromstring(body).iter()
+                        if e.tag.endswith("PartNumber")
+                    ]
+                    s3.objects[(bucket, key)] = b"".join(upload["parts"][n] for n in numbers)
+                    del s3.uploads[upload_id]
+                    self._xml(200, "CompleteMultipartUploadResult", {
+                        "Bucket": bucket, "Key": key, "ETag": '"complete"',
+                    })
+                    return
+
+                if self.command == "DELETE" and upload is not None:
+                    del s3.uploads[upload_id]
+                    self._reply(204)
+                    return
+
+                if self.command == "GET" and upload is not None:
+                    parts = [
+                        {"PartNumber": n, "ETag": f'"{hashlib.md5(p).hexdigest()}"', "Size": len(p)}
+                        for n, p in sorted(upload["parts"].items())
+                    ]
+                    self._xml(200, "ListPartsResult", {
+                        "Bucket": bucket, "Key": key, "UploadId": upload_id,
+                        "IsTruncated": "false", "Part": parts,
+                    })
+                    return
+
+                if self.command == "GET" and "uploads" in query:
+                    uploads = [
+                        {
+                            "Key": u["key"], "UploadId": id,
+                            "Initiated": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(u["initiated"])),
+                        }
+                        for id, u in s3.uploads.items() if u["bucket"] == bucket
+                    ]
+                    self._xml(200, "ListMultipartUploadsResult", {
+                        "Bucket": bucket, "IsTruncated": "false", "Upload": uploads,
+                    })
+                    return
+
+                if self.command == "POST" and "delete" in query:
+                    keys = [
+                        e.text for e in ElementTree.fromstring(body).iter() if e.tag.endswith("Key")
+                    ]
+                    for k in keys:
+                        s3.objects.pop((bucket, k), None)
+                    self._xml(200, "DeleteResult", {})
+                    return
+
+                if self.command == "PUT":
+                    s3.objects[(bucket, key)] = body
+                    self._reply(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+                    return
+
+                if self.command == "DELETE":
+                    s3.objects.pop((bucket, key), None)
+                    self._reply(204)
+                    return
+
+                data = s3.objects.get((bucket, key))
+                if data is None:
+                    self._s3_error(404, "NoSuchKey")
+                    return
+
+            headers = {"ETag": f'"{hashlib.md5(data).hexdigest()}"', "Content-Type": "text/csv"}
+            range_header = self.headers.get("Range")
+            if range_header:
+                start, _, end = range_header.removeprefix("bytes=").partition("-")
+                start = int(start)
+                end = min(int(end) if end else len(data) - 1, len(data) - 1)
+                if start >= len(data):
+                    self._s3_error(416, "InvalidRange")
+                    return
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+                self._reply(206, data[start:end + 1], headers)
+                return
+            self._reply(200, data, headers)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
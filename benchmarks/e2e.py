@@ -0,0 +1,397 @@
+"""
+    End to end benchmark of the upload flow without an aws account: it boots
+    files-service and auth-service against local stand-ins of DynamoDB, S3, SQS
+    and the Redshift Data API (see aws_stand_in.py), uploads csv files as the
+    frontend does, and runs the load pipeline with the messages of the queue,
+    as the lambda event source does.
+
+    It reports the latency p50/p95/p99 of every route, the spans of every kind
+    of trace and the time from the start of an upload until the file is loaded,
+    and saves the results as json to compare them between changes.
+
+    Run it from the root of the repository, with the dependencies of the three
+    apps installed:
+
+        python -m benchmarks.e2e --uploads 50 --concurrency 10 --file-size-kb 512
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.aws_stand_in import AwsStandIn
+from benchmarks.otlp_receiver import SpanCollector, start_grpc_receiver
+
+ROOT = Path(__file__).resolve().parent.parent
+APPS = ROOT / "apps"
+RESULTS = ROOT / "benchmarks" / "results"
+
+FILES_TABLE = "otel-observability-files"
+QUEUE_NAME = "otel-observability-files-queue"
+BUCKET_NAME = "otel-benchmark"
+TOKEN = "benchmark-token"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def aws_env(aws: AwsStandIn) -> dict:
+    return {
+        "AWS_ENDPOINT_URL": aws.endpoint_url,
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_REGION": "us-east-1",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "S3_BUCKET_NAME": BUCKET_NAME,
+    }
+
+
+def start_service(name: str, port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app:app",
+            "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+        ],
+        cwd=APPS / name,
+        env={**os.environ, **env},
+    )
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"{url} exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{url}/openapi.json").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise Exception(f"{url} didn't start in {timeout} seconds")
+
+
+def stop_service(process: subprocess.Popen):
+    # a graceful shutdown exports the spans left in the batch processor
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def make_csv(size: int) -> bytes:
+    lines = ["id,name,amount,active,created_at"]
+    total, i = len(lines[0]) + 1, 0
+    while total < size:
+        line = f"{i},name {i},{i * 1.5:.2f},{'true' if i % 2 else 'false'},2024-01-{i % 28 + 1:02d}"
+        lines.append(line)
+        total += len(line) + 1
+        i += 1
+    return ("\n".join(lines) + "\n").encode()
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def p(q: float) -> float:
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+
+    return {
+        "count": len(values),
+        "p50_ms": p(0.50), "p95_ms": p(0.95), "p99_ms": p(0.99),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2),
+    }
+
+
+class Latencies:
+    def __init__(self):
+        self.values: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def timed(self, route: str, request):
+        start = time.perf_counter()
+        try:
+            res = await request
+        except httpx.HTTPError:
+            self.errors[route] += 1
+            raise
+        self.values[route].append(time.perf_counter() - start)
+        if res.status_code >= 400:
+            self.errors[route] += 1
+            res.raise_for_status()
+        return res
+
+    def report(self) -> dict:
+        return {
+            route: {**percentiles(values), "errors": self.errors[route]}
+            for route, values in sorted(self.values.items())
+        }
+
+
+async def upload_file(
+    client: httpx.AsyncClient, files_url: str, filename: str, data: bytes,
+    args, latencies: Latencies,
+) -> tuple:
+    """ The requests of the frontend to upload a file, returns the file id and its start time """
+    headers = {"token": TOKEN}
+    started = time.time()
+
+    res = await latencies.timed("POST /upload/init", client.post(
+        f"{files_url}/upload/init", headers=headers,
+        json={"filename": filename, "file_size": len(data)},
+    ))
+    init = res.json()
+    upload_id, file_id = init["upload_id"], init["file_id"]
+
+    part_size = args.part_size_kb * 1024
+    chunks = [data[i:i + part_size] for i in range(0, len(data), part_size)]
+
+    if args.batch_urls:
+        res = await latencies.timed("POST /upload/get-presigned-urls", client.post(
+            f"{files_url}/upload/get-presigned-urls", headers=headers,
+            json={"filename": filename, "upload_id": upload_id,
+                  "first_part": 1, "last_part": len(chunks)},
+        ))
+        urls = {u["part_number"]: u["url"] for u in res.json()["urls"]}
+
+    semaphore = asyncio.Semaphore(args.part_concurrency)
+
+    async def upload_part(part_number: int, chunk: bytes) -> dict:
+        async with semaphore:
+            if args.batch_urls:
+                url = urls[part_number]
+            else:
+                res = await latencies.timed("POST /upload/get-presigned-url", client.post(
+                    f"{files_url}/upload/get-presigned-url", headers=headers,
+                    json={"filename": filename, "upload_id": upload_id, "part_number": part_number},
+                ))
+                url = res.json()["url"]
+
+            res = await latencies.timed("PUT s3 part", client.put(url, content=chunk))
+            return {"PartNumber": part_number, "ETag": res.headers["ETag"]}
+
+    parts = await asyncio.gather(*[
+        upload_part(n, chunk) for n, chunk in enumerate(chunks, start=1)
+    ])
+
+    await latencies.timed("POST /upload/complete", client.post(
+        f"{files_url}/upload/complete", headers=headers,
+        json={"file_id": file_id, "filename": filename, "upload_id": upload_id, "parts": parts},
+    ))
+    return file_id, started
+
+
+async def run_uploads(files_url: str, data: bytes, args) -> tuple:
+    latencies = Latencies()
+    started: Dict[str, float] = {}
+    failed = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    limits = httpx.Limits(max_connections=args.concurrency * args.part_concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+
+        async def upload(i: int):
+            nonlocal failed
+            # files of the same table are loaded together by the pipeline
+            filename = f"benchmark_{i % args.tables}.csv"
+            async with semaphore:
+                try:
+                    file_id, start = await upload_file(client, files_url, filename, data, args, latencies)
+                    started[file_id] = start
+                except Exception as e:
+                    print("upload failed:", repr(e))
+                    failed += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[upload(i) for i in range(args.uploads)])
+        seconds = time.perf_counter() - start
+
+    return latencies, started, failed, seconds
+
+
+def run_pipeline(aws: AwsStandIn, stop: threading.Event, args):
+    """ Invokes the load pipeline with batches of the queue, as the lambda event source does """
+    sys.path.insert(0, str(APPS / "load-pipeline"))
+    from src.app import main
+
+    if args.worker:
+        # the long running consumer of src/worker.py instead of the lambda
+        from src.worker import QueueWorker
+
+        worker = QueueWorker(
+            f"{aws.endpoint_url}/000000000000/{QUEUE_NAME}",
+            concurrency=args.pipeline_concurrency * args.pipeline_batch_size,
+        )
+        thread = threading.Thread(target=worker.run, daemon=True)
+        thread.start()
+        threading.Thread(target=lambda: (stop.wait(), worker.stop()), daemon=True).start()
+        return [thread]
+
+    def consume():
+        while not stop.is_set():
+            messages = aws.sqs.receive(QUEUE_NAME, args.pipeline_batch_size)
+            if not messages:
+                time.sleep(0.05)
+                continue
+            try:
+                res = main({"Records": messages}, None)
+                failures = res.get("batchItemFailures", []) if res else []
+                if failures:
+                    print("pipeline failures:", failures)
+            except Exception as e:
+                print("pipeline failed:", repr(e))
+
+    threads = [threading.Thread(target=consume, daemon=True) for _ in range(args.pipeline_concurrency)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def loaded_latencies(aws: AwsStandIn, started: Dict[str, float]) -> Dict[str, float]:
+    latencies = {}
+    with aws.dynamodb.lock:
+        for file_id, start in started.items():
+            changes = aws.dynamodb.status_changes.get((FILES_TABLE, file_id), [])
+            loaded = next((t for status, t in changes if status == "loaded"), None)
+            if loaded is not None:
+                latencies[file_id] = loaded - start
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10, help="uploads at the same time")
+    parser.add_argument("--file-size-kb", type=int, default=512)
+    parser.add_argument("--part-size-kb", type=int, default=128)
+    parser.add_argument("--part-concurrency", type=int, default=4, help="parts at the same time per upload")
+    parser.add_argument("--batch-urls", action="store_true", help="sign every part with one request")
+    parser.add_argument("--tables", type=int, default=5, help="different tables of the uploaded files")
+    parser.add_argument("--redshift-latency", type=float, default=0.2, help="seconds per statement")
+    parser.add_argument("--aws-latency", type=float, default=0.0, help="seconds per dynamodb, sqs and s3 request")
+    parser.add_argument("--files-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="setting of files-service, e.g. AWS_IO_THREADS=50")
+    parser.add_argument("--pipeline-concurrency", type=int, default=2, help="lambda invocations at the same time")
+    parser.add_argument("--pipeline-batch-size", type=int, default=10)
+    parser.add_argument("--duplicates", type=float, default=0.0, help="ratio of messages delivered twice")
+    parser.add_argument("--worker", action="store_true", help="load with the queue worker instead of the lambda handler")
+    parser.add_argument("--load-timeout", type=float, default=120, help="seconds to wait until the files are loaded")
+    parser.add_argument("--output", help="json file of the results, by default in benchmarks/results")
+    args = parser.parse_args()
+
+    collector = SpanCollector()
+    grpc_server, grpc_port = start_grpc_receiver(collector)
+    aws = AwsStandIn(
+        redshift_latency=args.redshift_latency, on_otlp=collector.add_http, latency=args.aws_latency,
+    )
+    aws.sqs.duplicate_rate = args.duplicates
+    aws.start()
+
+    env = {
+        **aws_env(aws),
+        "SQS_QUEUE_URL": f"{aws.endpoint_url}/000000000000/{QUEUE_NAME}",
+        "OTLP_COLLECTOR_ENDPOINT": f"127.0.0.1:{grpc_port}",
+        "OUTBOX_POLL_INTERVAL": "0.5",
+    }
+    auth_port, files_port = free_port(), free_port()
+    auth_url, files_url = f"http://127.0.0.1:{auth_port}", f"http://127.0.0.1:{files_port}"
+
+    # the load pipeline runs in this process, its config is read on import
+    os.environ.update({
+        **aws_env(aws),
+        "OTLP_COLLECTOR_ENDPOINT": f"{aws.endpoint_url}/v1/traces",
+        "REDSHIFT_WORKGROUP": "benchmark",
+        "REDSHIFT_DATABASE": "benchmark",
+        "POLL_INITIAL_INTERVAL": "0.05",
+        "WORKER_WAIT_TIME": "1",
+    })
+
+    auth = start_service("auth-service", auth_port, env)
+    files_env = dict(setting.split("=", 1) for setting in args.files_env)
+    files = start_service("files-service", files_port, {**env, "AUTH_DOMAIN": auth_url, **files_env})
+    stop = threading.Event()
+    consumers = []
+    try:
+        wait_ready(auth_url, auth)
+        wait_ready(files_url, files)
+        httpx.post(f"{auth_url}/tokens/bulk", json=[{"username": "benchmark", "token": TOKEN}]).raise_for_status()
+
+        consumers = run_pipeline(aws, stop, args)
+
+        data = make_csv(args.file_size_kb * 1024)
+        latencies, started, failed, seconds = asyncio.run(run_uploads(files_url, data, args))
+
+        deadline = time.time() + args.load_timeout
+        while len(loaded_latencies(aws, started)) < len(started) and time.time() < deadline:
+            time.sleep(0.2)
+        loaded = loaded_latencies(aws, started)
+    finally:
+        stop.set()
+        for consumer in consumers:
+            consumer.join(timeout=30)
+        stop_service(files)
+        stop_service(auth)
+        grpc_server.stop(grace=2)
+        aws.stop()
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "uploads": {
+            "completed": len(started),
+            "failed": failed,
+            "seconds": round(seconds, 3),
+            "uploads_per_second": round(len(started) / seconds, 2) if seconds else 0,
+        },
+        "routes": latencies.report(),
+        "upload_to_loaded": {
+            **percentiles(list(loaded.values())),
+            "not_loaded": len(started) - len(loaded),
+        },
+        "spans": {
+            "total": collector.total(),
+            "per_upload": round(collector.total() / len(started), 2) if started else 0,
+            "by_root": collector.spans_per_trace(),
+        },
+        "aws": {
+            "sqs_messages": aws.sqs.sent,
+            "sqs_deleted": aws.sqs.deleted,
+            "redshift_copies": aws.redshift.count("COPY"),
+        },
+    }
+
+    print(f"\n{'route':<36} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    rows = {**results["routes"], "upload -> loaded": {**results["upload_to_loaded"], "errors": 0}}
+    for route, r in rows.items():
+        print(f"{route:<36} {r['count']:>6} {r.get('p50_ms', 0):>8} {r.get('p95_ms', 0):>8} "
+              f"{r.get('p99_ms', 0):>8} {r['errors']:>6}")
+    print(f"\nuploads/s: {results['uploads']['uploads_per_second']}  "
+          f"spans per upload: {results['spans']['per_upload']}  "
+          f"not loaded: {results['upload_to_loaded']['not_loaded']}")
+
+    output = Path(args.output) if args.output else RESULTS / f"e2e-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print("results:", output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+    Receives the spans exported by the apps, over grpc (files-service and
+    auth-service) and http (load-pipeline, see aws_stand_in.py), and groups
+    them by trace to count the spans of every request.
+"""
+import threading
+from concurrent import futures
+from collections import defaultdict
+from typing import Dict, List
+
+import grpc
+from opentelemetry.proto.collector.trace.v1 import trace_service_pb2, trace_service_pb2_grpc
+from opentelemetry.proto.collector.metrics.v1 import metrics_service_pb2, metrics_service_pb2_grpc
+
+
+class SpanCollector:
+    def __init__(self):
+        # trace id -> [(service, span name, is root)]
+        self.traces: Dict[bytes, List[tuple]] = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def add(self, request: trace_service_pb2.ExportTraceServiceRequest):
+        with self.lock:
+            for resource_spans in request.resource_spans:
+                service = next(
+                    (a.value.string_value for a in resource_spans.resource.attributes
+                     if a.key == "service.name"),
+                    "unknown",
+                )
+                for scope_spans in resource_spans.scope_spans:
+                    for span in scope_spans.spans:
+                        self.traces[span.trace_id].append(
+                            (service, span.name, not span.parent_span_id)
+                        )
+
+    def add_http(self, path: str, body: bytes):
+        if path == "/v1/traces":
+            request = trace_service_pb2.ExportTraceServiceRequest()
+            request.ParseFromString(body)
+            self.add(request)
+
+    def spans_per_trace(self) -> Dict[str, dict]:
+        """ Number of spans of the traces grouped by the name of their root span """
+        groups = defaultdict(list)
+        with self.lock:
+            for spans in self.traces.values():
+                roots = [f"{service}: {name}" for service, name, root in spans if root]
+                # the root of the trace could be dropped by the sampler or not exported yet
+                groups[roots[0] if roots else "(no root)"].append(len(spans))
+
+        return {
+            root: {
+                "traces": len(counts),
+                "spans": sum(counts),
+                "spans_per_trace": round(sum(counts) / len(counts), 2),
+            }
+            for root, counts in sorted(groups.items())
+        }
+
+    def total(self) -> int:
+        with self.lock:
+            return sum(len(spans) for spans in self.traces.values())
+
+
+class _TraceService(trace_service_pb2_grpc.TraceServiceServicer):
+    def __init__(self, collector: SpanCollector):
+        self.collector = collector
+
+    def Export(self, request, context):
+        self.collector.add(request)
+        return trace_service_pb2.ExportTraceServiceResponse()
+
+
+class _MetricsService(metrics_service_pb2_grpc.MetricsServiceServicer):
+    # the metrics are accepted so the exporters don't retry, they are not measured
+    def Export(self, request, context):
+        return metrics_service_pb2.ExportMetricsServiceResponse()
+
+
+def start_grpc_receiver(collector: SpanCollector) -> tuple:
+    """ Returns the grpc server and the port where it listens """
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    trace_service_pb2_grpc.add_TraceServiceServicer_to_server(_TraceService(collector), server)
+    metrics_service_pb2_grpc.add_MetricsServiceServicer_to_server(_MetricsService(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    return server, port
@@ -4,7 +4,34 @@ DIR=$(cd $(dirname "${BASH_SOURCE[0]}") && pwd)
 source "$DIR/base.sh"
 source "$DIR/infra.sh"
 
+# every app is built from its own folder (the docker build context, the
+# lambda zip only has src), so the modules used by several apps are copied
+# in each of them. The copies are compared before the deploy
+function compare_copies() {
+  # compares the lines of the files from the first one that matches the pattern
+  pattern=$1
+  shift
+  for copy in "${@:2}"; do
+    if [ "$(sed -n "/$pattern/,\$p" "$DIR/../$1")" != "$(sed -n "/$pattern/,\$p" "$DIR/../$copy")" ]; then
+      log "$copy is different from $1, update the copies of the module" "warn"
+      exit 1
+    fi
+  done
+}
+
+function check_shared_modules() {
+  compare_copies "^" apps/auth-service/clients.py apps/files-service/clients.py
+  compare_copies "^" apps/auth-service/batch_write.py apps/files-service/batch_write.py
+  compare_copies "^" apps/auth-service/sampling.py apps/files-service/sampling.py \
+    apps/load-pipeline/src/sampling.py
+  compare_copies "^def _start_timer" apps/auth-service/instruments.py \
+    apps/files-service/instruments.py apps/load-pipeline/src/instruments.py
+  log "The shared modules are the same in every app"
+}
+
 function deploy_all() {
+  check_shared_modules
+
   frontend_ip=$(get_ip frontend)
   files_service_ip=$(get_ip files-service)
   auth_service_ip=$(get_ip auth-service)
@@ -37,12 +64,15 @@ function deploy_all() {
   echo "  Auth service:  http://$auth_service_ip/docs"
 
   log "OBSERVABILITY:"
-  echo "  Jaeger UI:  http://$observability_ip:16686\n"
+  echo "  Jaeger UI:  http://$observability_ip:16686"
+  echo "  Prometheus: http://$observability_ip:9090\n"
 }
 
 function deploy_one() {
   app=$1
 
+  check_shared_modules
+
   frontend_ip=$(get_ip frontend)
   files_service_ip=$(get_ip files-service)
   auth_service_ip=$(get_ip auth-service)
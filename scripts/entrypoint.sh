@@ -23,6 +23,9 @@ case $action in
   deploy)
     deploy_all
   ;;
+  check-shared)
+    check_shared_modules
+  ;;
   deploy-one)
     deploy_one $2
   ;;
@@ -59,7 +59,8 @@ function info() {
   echo "  Auth service:  http://$auth_service_ip/docs"
 
   log "OBSERVABILITY:"
-  echo "  Jaeger UI:  http://$observability_ip:16686\n"
+  echo "  Jaeger UI:  http://$observability_ip:16686"
+  echo "  Prometheus: http://$observability_ip:9090\n"
 }
 
 function update_stack() {